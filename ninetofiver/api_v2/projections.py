@@ -0,0 +1,104 @@
+"""925r API v2 projections."""
+import threading
+from collections import OrderedDict
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from ninetofiver.api_v2.serializers import BaseSerializer
+
+
+class Projection(object):
+    """
+    Projection of model instances onto the representation of a serializer.
+
+    Projections are compiled once from the fields of a serializer, and then reused for every instance. This avoids
+    constructing a serializer, and deep-copying its fields, per embedded object. The resulting representation is the
+    same as the one produced by the serializer, but projections are only suited for read-only embeds.
+
+    """
+
+    def __init__(self, serializer_class):
+        """Constructor."""
+        self.serializer = serializer_class()
+        self.getters = [(field.field_name, self.compile_field(field)) for field in self.serializer.fields.values()
+                        if not field.write_only]
+
+    def compile_field(self, field):
+        """Compile a getter returning the representation of the given field for an instance."""
+        # Types and display labels are determined directly, unless the serializer determines them differently
+        if isinstance(field, serializers.SerializerMethodField):
+            method = getattr(self.serializer.__class__, field.method_name)
+            if method is BaseSerializer.get_type:
+                return lambda instance: instance.__class__.__name__
+            elif method is BaseSerializer.get_display_label:
+                return str
+
+            return getattr(self.serializer, field.method_name)
+
+        # Nested serializers are projected as well
+        if isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.Serializer):
+            child = get_projection(field.child.__class__)
+            return lambda instance: child.project_many(field.get_attribute(instance))
+        elif isinstance(field, serializers.Serializer):
+            nested = get_projection(field.__class__)
+
+            def get_nested(instance):
+                attribute = field.get_attribute(instance)
+                return None if attribute is None else nested.project(attribute)
+
+            return get_nested
+
+        def get(instance):
+            attribute = field.get_attribute(instance)
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            return None if check_for_none is None else field.to_representation(attribute)
+
+        return get
+
+    def project(self, instance):
+        """Project a single instance."""
+        res = OrderedDict()
+
+        for field_name, getter in self.getters:
+            try:
+                res[field_name] = getter(instance)
+            except SkipField:
+                continue
+
+        return res
+
+    def project_many(self, instances):
+        """Project multiple instances, or the instances of a related manager."""
+        if hasattr(instances, 'all'):
+            instances = instances.all()
+
+        return [self.project(instance) for instance in instances]
+
+
+_projections = {}
+# Compiling a projection compiles the projections of nested serializers as well, hence the reentrant lock
+_projections_lock = threading.RLock()
+
+
+def get_projection(serializer_class):
+    """Get the (compiled) projection for the given serializer class."""
+    try:
+        return _projections[serializer_class]
+    except KeyError:
+        pass
+
+    with _projections_lock:
+        if serializer_class not in _projections:
+            _projections[serializer_class] = Projection(serializer_class)
+
+    return _projections[serializer_class]
+
+
+def project(serializer_class, instance):
+    """Project a single instance onto the representation of the given serializer class."""
+    return get_projection(serializer_class).project(instance)
+
+
+def project_many(serializer_class, instances):
+    """Project multiple instances onto the representation of the given serializer class."""
+    return get_projection(serializer_class).project_many(instances)
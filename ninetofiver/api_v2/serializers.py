@@ -3,15 +3,59 @@ from django.contrib.auth import models as auth_models
 from django_countries.serializers import CountryFieldMixin
 from django.utils.translation import ugettext_lazy as _
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, Prefetch, Manager, prefetch_related_objects
 from django.utils import timezone
-from decimal import Decimal
 import dateutil
 import copy
 import datetime
 
 from rest_framework import serializers
-from ninetofiver import models, settings
+from ninetofiver import caching, models, settings
+
+
+def get_requested_fields(request, param):
+    """Get the comma-separated field names passed in a query parameter of a read request, or None if not passed."""
+    if (request is None) or (request.method not in ('GET', 'HEAD')) or (param not in request.query_params):
+        return None
+
+    return set([x.strip() for x in request.query_params[param].split(',') if x.strip()])
+
+
+def is_top_level(serializer):
+    """Determine whether the given serializer represents top-level objects, as opposed to nested ones."""
+    parent = serializer.parent
+    if isinstance(parent, serializers.ListSerializer):
+        parent = parent.parent
+
+    return (parent is None) and serializer.context.get('sparse_fieldsets', True)
+
+
+def limit_fields(fields, request):
+    """
+    Limit the given fields to the ones requested.
+
+    Read requests can pass `fields` to only include the given fields, `omit` to leave out the given fields, and
+    `expand` to only embed the given nested objects, representing other ones by their primary keys.
+
+    """
+    only = get_requested_fields(request, 'fields')
+    omit = get_requested_fields(request, 'omit')
+    expand = get_requested_fields(request, 'expand')
+
+    for name, field in list(fields.items()):
+        if ((only is not None) and (name not in only)) or ((omit is not None) and (name in omit)):
+            fields.pop(name)
+        elif (expand is not None) and (name not in expand):
+            kwargs = {'read_only': True}
+            if field.source not in (None, name):
+                kwargs['source'] = field.source
+
+            if isinstance(field, serializers.ListSerializer):
+                fields[name] = serializers.PrimaryKeyRelatedField(many=True, **kwargs)
+            elif isinstance(field, serializers.BaseSerializer):
+                fields[name] = serializers.PrimaryKeyRelatedField(**kwargs)
+
+    return fields
 
 
 class BaseSerializer(serializers.ModelSerializer):
@@ -39,6 +83,10 @@ class BaseSerializer(serializers.ModelSerializer):
     def get_display_label(self, obj):
         return str(obj)
 
+    def get_fields(self):
+        fields = super().get_fields()
+        return limit_fields(fields, self.context.get('request', None)) if is_top_level(self) else fields
+
     def populate_validated_data_from_context(self, validated_data):
         pass
 
@@ -55,7 +103,19 @@ class MinimalSerializer(BaseSerializer):
     """Minimal serializer."""
 
     def to_internal_value(self, data):
-        return (serializers.PrimaryKeyRelatedField(queryset=self.__class__.Meta.model.objects.all()).to_internal_value(data))
+        field = serializers.PrimaryKeyRelatedField(queryset=self.__class__.Meta.model.objects.all())
+
+        # Instances can be preloaded through the context, indexed by model and ID
+        preloaded = self.context.get('preloaded', {}).get(self.__class__.Meta.model, None)
+        if preloaded is None:
+            return field.to_internal_value(data)
+
+        try:
+            return preloaded[int(data)]
+        except (TypeError, ValueError):
+            field.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            field.fail('does_not_exist', pk_value=data)
 
 
 class BasicSerializer(BaseSerializer):
@@ -72,9 +132,32 @@ class BasicSerializer(BaseSerializer):
         )
 
 
+class PolymorphicListSerializer(serializers.ListSerializer):
+    """List serializer which groups polymorphic objects by type, so related objects are prefetched per type."""
+
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, Manager) else data)
+
+        instances_by_type = {}
+        for instance in instances:
+            instances_by_type.setdefault(instance.__class__.__name__, []).append(instance)
+        for type_str, type_instances in instances_by_type.items():
+            self.child.prefetch(type_str, type_instances)
+
+        return [self.child.to_representation(x) for x in instances]
+
+
 class BasePolymorphicSerializer(serializers.Serializer):
     """Serializer to handle polymorphic child model serialization."""
 
+    class Meta:
+        list_serializer_class = PolymorphicListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Child serializers are built once per type, and then reused for every object of that type
+        self.child_serializers = {}
+
     def get_serializer_map(self):
         """
         Return a dict to map class names to their respective serializer classes.
@@ -84,6 +167,40 @@ class BasePolymorphicSerializer(serializers.Serializer):
         """
         raise NotImplementedError()
 
+    def get_prefetch_map(self):
+        """Return a dict to map class names to the lookups to prefetch for objects of that class."""
+        return {}
+
+    def get_child_serializer(self, type_str):
+        """Get the serializer for objects of the given class name."""
+        serializer = self.child_serializers.get(type_str, None)
+
+        if serializer is None:
+            try:
+                serializer_class = self.get_serializer_map()[type_str]
+            except KeyError:
+                raise ValueError(
+                    'Serializer for "{}" does not exist'.format(type_str),
+                )
+
+            # Only limit the fields of children when representing top-level objects
+            context = self.context if is_top_level(self) else dict(self.context, sparse_fieldsets=False)
+            serializer = self.child_serializers[type_str] = serializer_class(context=context)
+
+        return serializer
+
+    def prefetch(self, type_str, instances):
+        """Prefetch related objects for the given objects of the given class name."""
+        lookups = self.get_prefetch_map().get(type_str, [])
+
+        if lookups:
+            # Relations left out of the representation aren't prefetched
+            sources = set([x.source.split('.')[0] for x in self.get_child_serializer(type_str).fields.values()])
+            lookups = [x for x in lookups if x.split('__')[0] in sources]
+
+        if lookups:
+            prefetch_related_objects(instances, *lookups)
+
     def to_representation(self, obj):
         """
         Translate object to internal data representation
@@ -93,15 +210,9 @@ class BasePolymorphicSerializer(serializers.Serializer):
         """
         type_str = obj.__class__.__name__
 
-        try:
-            serializer = self.get_serializer_map()[type_str]
-        except KeyError:
-            raise ValueError(
-                'Serializer for "{}" does not exist'.format(type_str),
-            )
-
-        data = serializer(obj, context=self.context).to_representation(obj)
-        data['type'] = type_str
+        data = self.get_child_serializer(type_str).to_representation(obj)
+        if 'type' in data:
+            data['type'] = type_str
 
         return data
 
@@ -415,6 +526,7 @@ class LeaveSerializer(BasicSerializer):
 
             work_schedule = None
             employment_contract = None
+            holiday_calendar = caching.get_holiday_calendar()
 
             for i in range(leave_date_count):
                 # Determine date for this day
@@ -433,13 +545,12 @@ class LeaveSerializer(BasicSerializer):
                 # Determine amount of hours to work on this day based on work schedule
                 work_hours = 0.00
                 if work_schedule:
-                    work_hours = float(getattr(work_schedule, current_date.strftime('%A').lower(), Decimal(0.00)))
+                    work_hours = float(work_schedule.get_hours_for_date(current_date))
 
                 # Determine existence of holidays on this day based on work schedule
-                holiday = None
+                holiday = False
                 if employment_contract:
-                    holiday = models.Holiday.objects.filter(date=current_date,
-                                                            country=employment_contract.company.country).first()
+                    holiday = holiday_calendar.is_holiday(employment_contract.company.country, current_date)
 
                 # If we have to work a certain amount of hours on this day, and there is no holiday on that day,
                 # add a leave date pair for that amount of hours
@@ -631,6 +742,227 @@ class PerformanceSerializer(BasePolymorphicSerializer):
             models.StandbyPerformance.__name__: StandbyPerformanceSerializer,
         }
 
+    def get_prefetch_map(self):
+        return {
+            models.ActivityPerformance.__name__: ['performance_type', 'contract_role'],
+        }
+
+
+def parse_ids(values):
+    """Parse the valid IDs out of the given values."""
+    ids = set()
+
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+
+    return ids
+
+
+class BulkPerformanceSerializer(serializers.Serializer):
+    """
+    Serializer to create, update and delete performances in bulk.
+
+    Performances are validated in a single pass, against timesheets, contracts, contract users and performance types
+    which are loaded up front rather than per performance. Errors are reported per item, in which case nothing is
+    written. Updates are partial.
+
+    """
+
+    create = serializers.ListField(child=serializers.DictField(), required=False)
+    update = serializers.ListField(child=serializers.DictField(), required=False)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        creates = attrs.get('create', [])
+        updates = attrs.get('update', [])
+        deletes = attrs.get('delete', [])
+        serializer_map = PerformanceSerializer().get_serializer_map()
+
+        # Preload the performances to update or delete, along with everything performances refer to
+        update_ids = parse_ids([x.get('id') for x in updates])
+        delete_ids = set(deletes)
+        instances = {x.id: x for x in (models.Performance.objects
+                                       .filter(timesheet__user=user, id__in=update_ids | delete_ids))}
+        contract_ids = parse_ids([x.get('contract') for x in creates + updates] +
+                                 [x.contract_id for x in instances.values()])
+        contracts = {x.id: x for x in (models.Contract.objects
+                                       .filter(id__in=contract_ids)
+                                       .prefetch_related(Prefetch('performance_types',
+                                                                  queryset=(models.PerformanceType.objects
+                                                                            .non_polymorphic()))))}
+        contract_roles = set(models.ContractUser.objects
+                             .filter(user=user, contract__in=contract_ids)
+                             .values_list('contract_id', 'contract_role_id'))
+        reference_data = caching.get_reference_data()
+        context = dict(self.context, preloaded={
+            models.Contract: contracts,
+            models.PerformanceType: reference_data.load(models.PerformanceType),
+            models.ContractRole: reference_data.load(models.ContractRole),
+        })
+
+        for instance in instances.values():
+            if instance.contract_id in contracts:
+                instance.contract = contracts[instance.contract_id]
+
+        errors = {'create': [], 'update': [], 'delete': []}
+        performances = {'create': [], 'update': []}
+
+        # Performances can be listed only once, for either an update or a deletion
+        updated_ids = set()
+        deleted_ids = set()
+
+        # Deserialize performances
+        for action, items in [('create', creates), ('update', updates)]:
+            for item in items:
+                instance = None
+                if action == 'update':
+                    instance = instances.get(next(iter(parse_ids([item.get('id')])), None), None)
+                    if instance is None:
+                        errors[action].append({'id': [_('Not found.')]})
+                        continue
+                    elif instance.id in updated_ids:
+                        errors[action].append({'id': [_('This performance is listed more than once.')]})
+                        continue
+                    elif instance.id in delete_ids:
+                        errors[action].append({'id': [_('This performance is listed for deletion as well.')]})
+                        continue
+                    updated_ids.add(instance.id)
+
+                type_str = item.get('type', instance.__class__.__name__ if instance else None)
+                serializer_class = serializer_map.get(type_str, None)
+                if type_str is None:
+                    errors[action].append({'type': [_('This field is required')]})
+                    continue
+                elif serializer_class is None:
+                    errors[action].append({'type': [_('Serializer for "%(type)s" does not exist') %
+                                                    {'type': type_str}]})
+                    continue
+                elif instance and not isinstance(instance, serializer_class.Meta.model):
+                    errors[action].append({'type': [_('The type of a performance cannot be changed.')]})
+                    continue
+
+                serializer = serializer_class(instance, data=item, partial=bool(instance), context=context)
+                if not serializer.is_valid():
+                    errors[action].append(serializer.errors)
+                    continue
+
+                instance = instance if instance else serializer_class.Meta.model()
+                for attr, value in serializer.validated_data.items():
+                    setattr(instance, attr, value)
+
+                # Keep track of the index of the item, so errors found later on can be reported for it
+                performances[action].append((len(errors[action]), instance))
+                errors[action].append({})
+
+        # Preload timesheets, along with standby performances which may conflict
+        dates = [x[1].date for x in performances['create'] + performances['update']]
+        timesheets = list(models.Timesheet.objects
+                          .filter(Q(user=user) & (Q(year__in=set([x.year for x in dates])) |
+                                                  Q(id__in=[x.timesheet_id for x in instances.values()]))))
+        timesheets_by_id = {x.id: x for x in timesheets}
+        timesheets = {(x.year, x.month): x for x in timesheets}
+
+        standbys = set(models.StandbyPerformance.objects
+                       .filter(timesheet__user=user, date__in=dates)
+                       .exclude(id__in=instances.keys())
+                       .values_list('contract_id', 'date'))
+
+        # Validate performances
+        for action in ['create', 'update']:
+            for index, performance in performances[action]:
+                timesheet = timesheets.get((performance.date.year, performance.date.month), None)
+                if timesheet:
+                    performance.timesheet = timesheet
+                else:
+                    performance.timesheet_id = None
+
+                errors[action][index] = self.validate_performance(performance, timesheet, contract_roles, standbys)
+
+        for pk in deletes:
+            instance = instances.get(pk, None)
+            if instance is None:
+                errors['delete'].append({'id': [_('Not found.')]})
+            elif pk in deleted_ids:
+                errors['delete'].append({'id': [_('This performance is listed more than once.')]})
+            elif pk in update_ids:
+                errors['delete'].append({'id': [_('This performance is listed for update as well.')]})
+            elif timesheets_by_id[instance.timesheet_id].status != models.STATUS_ACTIVE:
+                errors['delete'].append({'timesheet': [_('Performances can only be attached to active timesheets.')]})
+            else:
+                errors['delete'].append({})
+            deleted_ids.add(pk)
+
+        errors = {x: y for x, y in errors.items() if any(y)}
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return {
+            'create': [x[1] for x in performances['create']],
+            'update': [x[1] for x in performances['update']],
+            'delete': [instances[x] for x in deletes],
+        }
+
+    def validate_performance(self, performance, timesheet, contract_roles, standbys):
+        """
+        Validate a performance, given its timesheet, the (contract, contract role) pairs of its user and the
+        (contract, date) pairs of standby performances planned so far.
+
+        Mirrors the additional validation of performances, without any queries. Returns errors by field.
+
+        """
+        # Missing timesheets are created as active ones
+        if timesheet and (timesheet.status != models.STATUS_ACTIVE):
+            return {'timesheet': [_('Performances can only be attached to active timesheets.')]}
+
+        if isinstance(performance, models.ActivityPerformance) and performance.contract:
+            if (performance.contract_id, performance.contract_role_id) not in contract_roles:
+                return {'contract_role':
+                        [_('The selected contract role is not valid for that user on that contract.')]}
+
+            allowed_type_ids = [x.id for x in performance.contract.performance_types.all()]
+            if allowed_type_ids and (performance.performance_type_id not in allowed_type_ids):
+                return {'performance_type':
+                        [_('The selected performance type is not valid for the selected contract')]}
+
+        if isinstance(performance, models.StandbyPerformance):
+            if (performance.contract_id, performance.date) in standbys:
+                return {'date': [_('The standby performance is already linked to that contract for that date.')]}
+            standbys.add((performance.contract_id, performance.date))
+
+            if performance.contract and (performance.contract.get_real_instance_class() != models.SupportContract):
+                return {'contract': [_('Standy performances can only be created for support contracts.')]}
+
+        return {}
+
+    def save(self, **kwargs):
+        # The create field shadows Serializer.create, so performances are written here instead
+        validated_data = dict(self.validated_data, **kwargs)
+        user = self.context['request'].user
+        timesheets = {}
+
+        with transaction.atomic():
+            for performance in validated_data['delete']:
+                performance.delete(validate=False)
+
+            # Multi-table inherited models can't be created or updated in bulk, so performances are saved one by one,
+            # skipping validation which was already performed
+            for performance in validated_data['create'] + validated_data['update']:
+                if performance.timesheet_id is None:
+                    key = (performance.date.year, performance.date.month)
+                    if key not in timesheets:
+                        timesheets[key] = models.Timesheet.objects.get_or_create(user=user, year=key[0],
+                                                                                 month=key[1])[0]
+                    performance.timesheet = timesheets[key]
+
+                performance.save(validate=False)
+
+        self.instance = validated_data
+        return validated_data
+
 
 class AttachmentSerializer(BasicSerializer):
     """Attachment serializer."""
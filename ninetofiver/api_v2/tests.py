@@ -3,11 +3,13 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_assured import testcases
 from ninetofiver import factories, models
+from ninetofiver.api_v2 import serializers
 from ninetofiver.tests import ModelTestMixin, AuthenticatedAPITestCase
 from django.utils import timezone
 from django.shortcuts import reverse
 import tempfile
 import datetime
+import json
 
 
 class GenericViewTests(AuthenticatedAPITestCase):
@@ -30,6 +32,18 @@ class GenericViewTests(AuthenticatedAPITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_conditional_range_info_view(self):
+        """Test conditional range info view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today()),
+        }
+        response = self.client.get('/api/v2/range_info/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/v2/range_info/', params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def test_range_availability_view(self):
         """Test range availability view."""
         response = self.client.get('/api/v2/range_availability/', {
@@ -38,6 +52,27 @@ class GenericViewTests(AuthenticatedAPITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_streamed_range_availability_view(self):
+        """Test streamed range availability view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=7)),
+        }
+        expected = self.client.get('/api/v2/range_availability/', params)
+        response = self.client.get('/api/v2/range_availability/', dict(params, stream='true'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode('utf-8')), expected.json())
+
+    def test_compact_range_availability_view(self):
+        """Test compact range availability view."""
+        response = self.client.get('/api/v2/range_availability/', {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today()),
+            'compact': 'true',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['users'][str(self.user.id)]['days']), 1)
+
 
 class ApiKeyAuthenticationTests(APITestCase):
     """API key authentication tests."""
@@ -79,6 +114,29 @@ class ApiKeyAuthenticationTests(APITestCase):
         })
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
 
+    def test_cached_api_key(self):
+        """Test revoking a cached API key."""
+        user = factories.UserFactory()
+        api_key = models.ApiKey.objects.create(user=user, read_only=True)
+
+        for i in range(2):
+            res = self.client.get('/api/v2/me/?api_key=%s' % api_key.key)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        api_key.delete()
+        res = self.client.get('/api/v2/me/?api_key=%s' % api_key.key)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # Deactivating users should revoke their API keys as well
+        api_key = models.ApiKey.objects.create(user=user, read_only=True)
+        res = self.client.get('/api/v2/me/?api_key=%s' % api_key.key)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        user.is_active = False
+        user.save()
+        res = self.client.get('/api/v2/me/?api_key=%s' % api_key.key)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_read_only_header_api_key(self):
         """Test with read-only header API key."""
         user = factories.UserFactory()
@@ -185,6 +243,25 @@ class TimesheetAPITestCase(testcases.ReadWriteRESTAPITestCaseMixin, testcases.Ba
 class TimesheetTests(AuthenticatedAPITestCase):
     """Timesheet tests."""
 
+    def test_conditional_get(self):
+        """Test conditional timesheet retrieval."""
+        timesheet = factories.TimesheetFactory.create(user=self.user)
+
+        res = self.client.get('/api/v2/timesheets/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        res = self.client.get('/api/v2/timesheets/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get('/api/v2/timesheets/%s/' % timesheet.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        # Deleting a timesheet should change the ETag
+        timesheet.delete()
+        res = self.client.get('/api/v2/timesheets/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
     def test_extended_validation(self):
         """Test non active timesheet creation."""
         today = datetime.date.today()
@@ -243,6 +320,66 @@ class TimesheetTests(AuthenticatedAPITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class LeaveTests(AuthenticatedAPITestCase):
+    """Leave tests."""
+
+    def test_conditional_get(self):
+        """Test whether changes to embedded leave types and leave dates change the ETag of leave."""
+        leave_type = factories.LeaveTypeFactory.create()
+        leave = factories.LeaveFactory.create(user=self.user, leave_type=leave_type, status=models.STATUS_DRAFT)
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2018, month=3)
+        leave_dates = [factories.LeaveDateFactory.create(
+            leave=leave, timesheet=timesheet,
+            starts_at=timezone.make_aware(datetime.datetime(2018, 3, day, 9, 0)),
+            ends_at=timezone.make_aware(datetime.datetime(2018, 3, day, 17, 0))) for day in [6, 7]]
+
+        res = self.client.get('/api/v2/leave/')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        res = self.client.get('/api/v2/leave/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Renaming the leave type changes the display label of the leave
+        leave_type.name = 'Renamed'
+        leave_type.save()
+        res = self.client.get('/api/v2/leave/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        # Deleting a leave date changes the embedded leave dates
+        leave_dates[0].delete()
+        res = self.client.get('/api/v2/leave/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_conditional_feed(self):
+        """Test whether changes to leave types and users shown in the leave feed change its ETag."""
+        leave_type = factories.LeaveTypeFactory.create()
+        leave = factories.LeaveFactory.create(user=self.user, leave_type=leave_type, status=models.STATUS_APPROVED)
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2018, month=3)
+        factories.LeaveDateFactory.create(leave=leave, timesheet=timesheet,
+                                          starts_at=timezone.make_aware(datetime.datetime(2018, 3, 6, 9, 0)),
+                                          ends_at=timezone.make_aware(datetime.datetime(2018, 3, 6, 17, 0)))
+
+        res = self.client.get('/api/v2/feeds/leave/all.ics')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        res = self.client.get('/api/v2/feeds/leave/all.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        leave_type.name = 'Renamed'
+        leave_type.save()
+        res = self.client.get('/api/v2/feeds/leave/all.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        etag = res['ETag']
+
+        self.user.username = 'renamed'
+        self.user.save()
+        res = self.client.get('/api/v2/feeds/leave/all.ics', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
 class HolidayAPITestCase(testcases.ReadRESTAPITestCaseMixin, testcases.BaseRESTAPITestCase, ModelTestMixin):
     """Holiday API test case."""
 
@@ -452,3 +589,105 @@ class PerformanceAPITestCase(testcases.ReadWriteRESTAPITestCaseMixin, testcases.
     def _update_check_db(self, obj, data=None, results=None):
         setattr(obj, 'type', 'ActivityPerformance')
         super()._update_check_db(obj, data=data, results=results)
+
+    def test_bulk(self):
+        """Test creating, updating and deleting performances in bulk."""
+        updated = self.get_object(self.factory_class)
+        deleted = self.get_object(self.factory_class)
+        item = {
+            'type': 'ActivityPerformance',
+            'date': str(datetime.date(self.timesheet.year, self.timesheet.month, 5)),
+            'duration': 2,
+            'contract': self.contract.id,
+            'performance_type': self.performance_type.id,
+            'contract_role': self.contract_role.id,
+        }
+
+        # Invalid items should be reported, without writing anything
+        res = self.client.post('/api/v2/performances/bulk/', {
+            'create': [item, dict(item, contract_role=factories.ContractRoleFactory.create().id)],
+            'delete': [deleted.id],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['create'][0], {})
+        self.assertIn('contract_role', res.data['create'][1])
+        self.assertTrue(models.Performance.objects.filter(id=deleted.id).exists())
+
+        # Performances should be listed only once, for either an update or a deletion
+        res = self.client.post('/api/v2/performances/bulk/', {'delete': [deleted.id, deleted.id]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['delete'][0], {})
+        self.assertIn('id', res.data['delete'][1])
+
+        res = self.client.post('/api/v2/performances/bulk/', {
+            'update': [{'id': updated.id, 'duration': 3}, {'id': updated.id, 'duration': 4}],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['update'][0], {})
+        self.assertIn('id', res.data['update'][1])
+
+        res = self.client.post('/api/v2/performances/bulk/', {
+            'update': [{'id': deleted.id, 'duration': 3}],
+            'delete': [deleted.id],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', res.data['update'][0])
+        self.assertIn('id', res.data['delete'][0])
+        self.assertTrue(models.Performance.objects.filter(id=deleted.id).exists())
+
+        res = self.client.post('/api/v2/performances/bulk/', {
+            'create': [item, item],
+            'update': [{'id': updated.id, 'duration': 3}],
+            'delete': [deleted.id],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['created']), 2)
+        self.assertEqual(res.data['deleted'], [deleted.id])
+        self.assertEqual(models.ActivityPerformance.objects.get(id=updated.id).duration, 3)
+        self.assertFalse(models.Performance.objects.filter(id=deleted.id).exists())
+
+    def test_keyset_pagination(self):
+        """Test paginating performances using cursors."""
+        for i in range(3):
+            self.get_object(self.factory_class)
+        expected = list(models.Performance.objects.filter(timesheet__user=self.user)
+                        .order_by('date', 'id').values_list('id', flat=True))
+
+        ids = []
+        res = self.client.get('/api/v2/performances/', {'cursor': '', 'page_size': 2})
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', res.data)
+            ids += [x['id'] for x in res.data['results']]
+            if not res.data['next']:
+                break
+            res = self.client.get(res.data['next'])
+
+        self.assertEqual(ids, expected)
+
+        res = self.client.get('/api/v2/performances/', {'cursor': 'invalid'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sparse_fieldsets(self):
+        """Test limiting the fields of performances."""
+        res = self.client.get('/api/v2/performances/', {'fields': 'id,date,duration'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(res.data['results'][0].keys()), {'id', 'date', 'duration'})
+
+        res = self.client.get('/api/v2/performances/', {'omit': 'display_label', 'expand': ''})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('display_label', res.data['results'][0])
+        self.assertEqual(res.data['results'][0]['contract'], self.contract.id)
+        self.assertEqual(res.data['results'][0]['type'], 'ActivityPerformance')
+
+    def test_polymorphic_serializer_reuse(self):
+        """Test reusing child serializers for performances of the same type."""
+        for i in range(2):
+            self.get_object(self.factory_class)
+        performances = list(models.Performance.objects.filter(timesheet__user=self.user).order_by('id'))
+
+        serializer = serializers.PerformanceSerializer(performances, many=True)
+        data = serializer.data
+        self.assertEqual(list(serializer.child.child_serializers.keys()), ['ActivityPerformance'])
+        self.assertEqual([dict(x) for x in data],
+                         [dict(serializers.ActivityPerformanceSerializer(x).data) for x in performances])
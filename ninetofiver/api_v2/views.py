@@ -1,20 +1,229 @@
 """925r API v2 views."""
 import datetime
 import dateutil
+import hashlib
+import json
 from django.contrib.auth import models as auth_models
-from django.core.exceptions import ValidationError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Prefetch
+from django.db.models import Q, Prefetch, Count, Max
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import mixins, permissions, viewsets, status
+from rest_framework import serializers as rest_serializers
+from rest_framework.decorators import list_route
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.utils import encoders
 from ninetofiver.api_v2 import serializers, filters
-from ninetofiver import models, feeds, calculation, redmine
+from ninetofiver import models, feeds, caching, calculation, ledger, pagination, redmine
 from ninetofiver.views import BaseTimesheetContractPdfExportServiceAPIView
 from ninetofiver.exceptions import InvalidRedmineUserException
 
 
+def stream_json_object(items):
+    """Stream (key, value) pairs as a JSON object, encoding one value at a time."""
+    yield '{'
+    for i, (key, value) in enumerate(items):
+        yield '%s%s: %s' % (', ' if i else '', json.dumps(str(key)), json.dumps(value, cls=encoders.JSONEncoder))
+    yield '}'
+
+
+def get_queryset_validator(queryset, fields=('updated_at',), relations=()):
+    """
+    Get the amount of objects in a queryset, along with the last time any of the given fields was updated.
+
+    Fields of related objects are given as lookups. The amount includes the objects of the given (multi-valued)
+    relations, so removing one of them changes it as well.
+
+    """
+    # Related fields can't be aggregated over distinct querysets, so these are narrowed down using a subquery instead
+    if queryset.query.distinct:
+        queryset = queryset.model._default_manager.filter(pk__in=queryset.order_by().values('pk'))
+
+    aggregates = {'last_%s' % i: Max(field) for i, field in enumerate(fields)}
+    counts = {'count_%s' % i: Count(relation, distinct=True) for i, relation in enumerate(relations)}
+    res = queryset.order_by().aggregate(count=Count('id', distinct=True), **aggregates, **counts)
+    last_modified = max([res[x] for x in aggregates if res[x]], default=None)
+
+    return res['count'] + sum([res[x] for x in counts]), last_modified
+
+
+def get_feed_validator(feed, items):
+    """
+    Get a validator for the given items of the given feed, along with the last time any of them was updated.
+
+    Users have no update timestamp, so the names and email addresses of the users the items belong to are included in
+    the validator as is.
+
+    """
+    count, last_modified = get_queryset_validator(items, fields=feed.validator_fields)
+    users = list(auth_models.User.objects
+                 .filter(id__in=items.order_by().values(feed.user_lookup))
+                 .order_by('id')
+                 .values_list('id', 'username', 'email'))
+
+    return [count, last_modified, users], last_modified
+
+
+def conditional_response(request, handler, validator, last_modified=None):
+    """
+    Respond to a request conditionally.
+
+    The ETag is derived from the given validator, along with the user and the full path of the request. Requests
+    passing a matching ETag are answered with a 304, without calling the handler. Last-Modified is merely informative,
+    as deleting objects doesn't change it.
+
+    """
+    etag = hashlib.sha1(repr([request.user.pk, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+                              validator]).encode('utf-8')).hexdigest()
+    etag = '"%s"' % etag
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    response = handler()
+    if response.status_code == status.HTTP_200_OK:
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+
+    return response
+
+
+def resolve_source(model, name):
+    """Resolve the field or reverse relation of the given model with the given name, or None if there is none."""
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == name:
+            return rel
+
+    return None
+
+
+def get_select_related_paths(tree, prefix=''):
+    """Get the paths of the given select_related tree."""
+    paths = []
+
+    for name, subtree in tree.items():
+        path = prefix + name
+        paths += get_select_related_paths(subtree, path + '__') if subtree else [path]
+
+    return paths
+
+
+def limit_queryset(queryset, serializer):
+    """
+    Limit a queryset to the data needed for the fields of the given serializer.
+
+    Relations which aren't embedded are no longer joined, relations which aren't represented at all are no longer
+    prefetched, and columns which aren't represented are deferred. Fields whose data can't be determined, such as
+    display labels, leave the queryset as is.
+
+    """
+    if isinstance(serializer, serializers.BasePolymorphicSerializer):
+        children = [x(context=serializer.context) for x in serializer.get_serializer_map().values()]
+    else:
+        children = [serializer]
+
+    sources = set()
+    embedded = set()
+    for child in children:
+        for field in child.fields.values():
+            if field.source == '*':
+                if field.field_name != 'type':
+                    return queryset
+                continue
+
+            name = field.source.split('.')[0]
+            if resolve_source(child.Meta.model, name) is None:
+                return queryset
+
+            sources.add(name)
+            if isinstance(field, rest_serializers.BaseSerializer):
+                embedded.add(name)
+
+    select_related = queryset.query.select_related
+    if isinstance(select_related, dict):
+        paths = [x for x in get_select_related_paths(select_related) if x.split('__')[0] in embedded]
+        queryset = queryset.select_related(None)
+        if paths:
+            queryset = queryset.select_related(*paths)
+
+    lookups = [x for x in queryset._prefetch_related_lookups
+               if (x.prefetch_through if isinstance(x, Prefetch) else x).split('__')[0] in sources]
+    queryset = queryset.prefetch_related(None).prefetch_related(*lookups)
+
+    deferred = [x.name for x in queryset.model._meta.concrete_fields
+                if not (x.primary_key or x.is_relation or (x.name in sources))]
+    if deferred:
+        queryset = queryset.defer(*deferred)
+
+    return queryset
+
+
+class SparseFieldsetMixin(object):
+    """Only query the data needed for the fields requested through `fields`, `omit` or `expand`."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        if any([serializers.get_requested_fields(self.request, x) is not None for x in ['fields', 'omit', 'expand']]):
+            queryset = limit_queryset(queryset, self.get_serializer())
+
+        return queryset
+
+
+class ConditionalGetMixin(object):
+    """
+    Answer list and retrieve requests conditionally.
+
+    ETags are derived from the amount and last update of the (filtered) objects, so unchanged responses are answered
+    without fetching or serializing any of them. Viewsets embedding related objects list the fields those are updated
+    through in `validator_fields`, and their multi-valued relations in `validator_relations`.
+
+    """
+
+    validator_fields = ('updated_at',)
+    validator_relations = ()
+
+    def get_validator_queryset(self):
+        """Get the queryset the validator is determined for."""
+        queryset = self.filter_queryset(self.get_queryset())
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            try:
+                queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            except (TypeError, ValueError, ValidationError):
+                queryset = queryset.none()
+
+        return queryset
+
+    def get_validator(self):
+        """Get the amount of objects the validator is determined for, along with their last update."""
+        return get_queryset_validator(self.get_validator_queryset(), fields=self.validator_fields,
+                                      relations=self.validator_relations)
+
+    def list(self, request, *args, **kwargs):
+        count, last_modified = self.get_validator()
+        return conditional_response(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+                                    [count, last_modified], last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        count, last_modified = self.get_validator()
+        return conditional_response(request,
+                                    lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+                                    [count, last_modified], last_modified)
+
+
 class MeAPIView(APIView):
     """Get the currently authenticated user."""
 
@@ -26,7 +235,7 @@ class MeAPIView(APIView):
         return Response(data)
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve users."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -38,7 +247,7 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
                 .select_related('userinfo'))
 
 
-class LeaveTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaveTypeViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve leave types."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -46,7 +255,7 @@ class LeaveTypeViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.LeaveType.objects.all()
 
 
-class ContractRoleViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractRoleViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contract roles."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -54,7 +263,7 @@ class ContractRoleViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.ContractRole.objects.all()
 
 
-class PerformanceTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class PerformanceTypeViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve performance types."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -62,7 +271,7 @@ class PerformanceTypeViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.PerformanceType.objects.all()
 
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+class LocationViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve locations."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -70,7 +279,7 @@ class LocationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.Location.objects.all()
 
 
-class HolidayViewSet(viewsets.ReadOnlyModelViewSet):
+class HolidayViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve holidays."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -79,12 +288,14 @@ class HolidayViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.Holiday.objects.all()
 
 
-class ContractViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contracts."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.ContractSerializer
     filter_class = filters.ContractFilter
+    validator_fields = ('updated_at', 'company__updated_at', 'customer__updated_at', 'performance_types__updated_at')
+    validator_relations = ('performance_types', 'attachments', 'contract_groups')
     queryset = (models.Contract.objects.all()
                 .select_related('company', 'customer')
                 .prefetch_related(
@@ -100,12 +311,14 @@ class ContractViewSet(viewsets.ReadOnlyModelViewSet):
         return self.queryset.filter(contractuser__user=self.request.user)
 
 
-class ContractUserViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractUserViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contract users."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.ContractUserSerializer
     filter_class = filters.ContractUserFilter
+    validator_fields = ('updated_at', 'contract__updated_at', 'contract__customer__updated_at',
+                        'contract_role__updated_at')
     queryset = (models.ContractUser.objects.all()
                 .select_related('contract', 'contract__customer', 'contract_role', 'user')
                 .distinct())
@@ -114,12 +327,13 @@ class ContractUserViewSet(viewsets.ReadOnlyModelViewSet):
         return self.queryset.filter(user=self.request.user)
 
 
-class TimesheetViewSet(viewsets.ModelViewSet):
+class TimesheetViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """CRUD timesheets."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.TimesheetSerializer
     filter_class = filters.TimesheetFilter
+    validator_relations = ('attachments',)
     queryset = models.Timesheet.objects.all()
 
     def get_queryset(self):
@@ -131,12 +345,16 @@ class TimesheetViewSet(viewsets.ModelViewSet):
         return super().perform_destroy(instance)
 
 
-class LeaveViewSet(viewsets.ModelViewSet):
+class LeaveViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """CRUD leave."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.LeaveSerializer
     filter_class = filters.LeaveFilter
+    validator_fields = ('updated_at', 'leave_type__updated_at', 'leavedate__updated_at')
+    validator_relations = ('leavedate', 'attachments')
+    pagination_class = pagination.CustomizablePageNumberOrKeysetPagination
+    keyset_ordering = ('id',)
     queryset = (models.Leave.objects.all()
                 .select_related('leave_type')
                 .prefetch_related('leavedate_set'))
@@ -150,12 +368,15 @@ class LeaveViewSet(viewsets.ModelViewSet):
         return super().perform_destroy(instance)
 
 
-class WhereaboutViewSet(viewsets.ModelViewSet):
+class WhereaboutViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """CRUD whereabouts."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.WhereaboutSerializer
     filter_class = filters.WhereaboutFilter
+    validator_fields = ('updated_at', 'location__updated_at')
+    pagination_class = pagination.CustomizablePageNumberOrKeysetPagination
+    keyset_ordering = ('starts_at', 'id')
     queryset = (models.Whereabout.objects.all()
                 .select_related('location'))
 
@@ -163,20 +384,47 @@ class WhereaboutViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(timesheet__user=self.request.user)
 
 
-class PerformanceViewSet(viewsets.ModelViewSet):
+class PerformanceViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """CRUD performance."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.PerformanceSerializer
     filter_class = filters.PerformanceFilter
+    validator_fields = ('updated_at', 'contract__updated_at', 'contract__customer__updated_at',
+                        'activityperformance__performance_type__updated_at',
+                        'activityperformance__contract_role__updated_at')
+    pagination_class = pagination.CustomizablePageNumberOrKeysetPagination
+    keyset_ordering = ('date', 'id')
     queryset = (models.Performance.objects.all()
                 .select_related('contract', 'contract__customer'))
 
     def get_queryset(self):
         return self.queryset.filter(timesheet__user=self.request.user)
 
+    def filter_queryset(self, queryset):
+        # Fetch activity and standby performances using a single query, rather than an additional query per type
+        return models.join_performance_children(super().filter_queryset(queryset))
+
+    @list_route(methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        """Create, update and delete performances in bulk."""
+        serializer = serializers.BulkPerformanceSerializer(data=request.data, context=self.get_serializer_context())
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Deleted performances lose their IDs
+        deleted_ids = [x.id for x in serializer.validated_data['delete']]
+        res = serializer.save()
+        context = self.get_serializer_context()
+
+        return Response({
+            'created': serializers.PerformanceSerializer(res['create'], many=True, context=context).data,
+            'updated': serializers.PerformanceSerializer(res['update'], many=True, context=context).data,
+            'deleted': deleted_ids,
+        }, status=status.HTTP_200_OK)
 
-class AttachmentViewSet(viewsets.ModelViewSet):
+
+class AttachmentViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """CRUD attachments."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -214,7 +462,9 @@ class LeaveFeedAPIView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, format=None):
-        return feeds.LeaveFeed().__call__(request)
+        feed = feeds.LeaveFeed()
+        validator, last_modified = get_feed_validator(feed, feed.items())
+        return conditional_response(request, lambda: feed.__call__(request), validator, last_modified)
 
 
 class UserLeaveFeedAPIView(APIView):
@@ -225,7 +475,9 @@ class UserLeaveFeedAPIView(APIView):
     def get(self, request, user_username=None, format=None):
         username = request.parser_context['kwargs'].get('user_username', None)
         user = get_object_or_404(auth_models.User, username=username, is_active=True) if username else request.user
-        return feeds.UserLeaveFeed().__call__(request, user=user)
+        feed = feeds.UserLeaveFeed()
+        validator, last_modified = get_feed_validator(feed, feed.items(user))
+        return conditional_response(request, lambda: feed.__call__(request, user=user), validator, last_modified)
 
 
 class WhereaboutFeedAPIView(APIView):
@@ -234,7 +486,9 @@ class WhereaboutFeedAPIView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, format=None):
-        return feeds.WhereaboutFeed().__call__(request)
+        feed = feeds.WhereaboutFeed()
+        validator, last_modified = get_feed_validator(feed, feed.items())
+        return conditional_response(request, lambda: feed.__call__(request), validator, last_modified)
 
 
 class UserWhereaboutFeedAPIView(APIView):
@@ -245,7 +499,9 @@ class UserWhereaboutFeedAPIView(APIView):
     def get(self, request, user_username=None, format=None):
         username = request.parser_context['kwargs'].get('user_username', None)
         user = get_object_or_404(auth_models.User, username=username, is_active=True) if username else request.user
-        return feeds.UserWhereaboutFeed().__call__(request, user=user)
+        feed = feeds.UserWhereaboutFeed()
+        validator, last_modified = get_feed_validator(feed, feed.items(user))
+        return conditional_response(request, lambda: feed.__call__(request, user=user), validator, last_modified)
 
 
 class PerformanceImportAPIView(APIView):
@@ -281,7 +537,13 @@ class PerformanceImportAPIView(APIView):
 
 
 class RangeAvailabilityAPIView(APIView):
-    """Get availability for all active users."""
+    """
+    Get availability for all active users.
+
+    Pass `stream=true` to stream availability one user at a time rather than building it for all users at once, or
+    `compact=true` to encode the availability of every user and day as a bitmask instead.
+
+    """
 
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -294,13 +556,29 @@ class RangeAvailabilityAPIView(APIView):
         users = users if not request.query_params.get('user', None) else \
             users.filter(id__in=list(map(int, request.query_params.get('user', None).split(','))))
 
-        data = calculation.get_availability(users, from_date, until_date, serialize=True)
+        if request.query_params.get('compact', 'false') == 'true':
+            data = calculation.get_compact_availability(list(users), from_date, until_date)
+            return Response(data, status=status.HTTP_200_OK)
+
+        if request.query_params.get('stream', 'false') == 'true':
+            data = calculation.iter_availability(users, from_date, until_date, serialize=True)
+            return StreamingHttpResponse(stream_json_object((user.id, x) for user, x in data),
+                                         content_type='application/json')
+
+        data = calculation.calculate_sharded(calculation.get_availability, users, from_date, until_date,
+                                             serialize=True)
 
         return Response(data, status=status.HTTP_200_OK)
 
 
 class RangeInfoAPIView(APIView):
-    """Calculates and returns information for a given date range."""
+    """
+    Calculates and returns information for a given date range.
+
+    Pass `delta=true` along with `daily=true` to receive a token. Passing that token back returns only the days of
+    months which changed since, along with a new token.
+
+    """
 
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -314,8 +592,22 @@ class RangeInfoAPIView(APIView):
         detailed = request.query_params.get('detailed', 'false') == 'true'
         summary = request.query_params.get('summary', 'false') == 'true'
 
-        data = calculation.get_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
-                                          summary=summary, serialize=True)
-        data = data[user.id]
-
-        return Response(data)
\ No newline at end of file
+        token = request.query_params.get('token', None)
+        delta = request.query_params.get('delta', 'false') == 'true'
+
+        def get_response():
+            if daily and (delta or token):
+                data = caching.get_range_info_delta(user, from_date, until_date, token=token, detailed=detailed,
+                                                    summary=summary)
+            elif not (daily or detailed or summary):
+                # Plain totals are summed from the user day ledger
+                data = ledger.get_user_day_ledger_totals(user, from_date, until_date)
+                data.pop('standby_count')
+            else:
+                data = caching.get_range_info(user, from_date, until_date, daily=daily, detailed=detailed,
+                                              summary=summary)
+
+            return Response(data)
+
+        return conditional_response(request, get_response,
+                                    caching.get_range_info_validator(user, from_date, until_date))
\ No newline at end of file
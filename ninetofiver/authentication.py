@@ -2,7 +2,7 @@
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication as BaseTokenAuthentication, get_authorization_header
-from ninetofiver import models
+from ninetofiver import caching, models
 
 
 class ApiKeyAuthentication(BaseTokenAuthentication):
@@ -10,6 +10,16 @@ class ApiKeyAuthentication(BaseTokenAuthentication):
 
     model = models.ApiKey
 
+    def authenticate_credentials(self, key):
+        """Authenticate the given API key, using cached credentials where possible."""
+        res = caching.get_api_key_credentials(key)
+
+        if res is None:
+            res = super().authenticate_credentials(key)
+            caching.set_api_key_credentials(key, res)
+
+        return res
+
     def authenticate(self, request):
         """Authenticate the request."""
         token = request.GET.get('api_key', None)
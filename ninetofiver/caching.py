@@ -0,0 +1,698 @@
+"""Caching."""
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils.functional import cached_property
+from ninetofiver import calculation, models, settings
+
+
+RANGE_INFO_CACHE_PREFIX = 'ninetofiver.range_info'
+RANGE_INFO_DELTA_TOKEN_SALT = 'ninetofiver.range_info.delta'
+HOLIDAY_CALENDAR_VERSION_KEY = 'ninetofiver.holiday_calendar.version'
+REFERENCE_DATA_CACHE_PREFIX = 'ninetofiver.reference_data'
+REFERENCE_DATA_MODELS = (models.LeaveType, models.PerformanceType, models.Location, models.ContractRole)
+API_KEY_CACHE_PREFIX = 'ninetofiver.api_key'
+
+
+def is_cache_shared():
+    """Check whether the default cache is shared between processes, rather than local to this process or disabled."""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _get_version_key(user_id=None, year=None, month=None):
+    """Get the cache key of a range info version counter."""
+    parts = [RANGE_INFO_CACHE_PREFIX, 'version']
+    if user_id:
+        parts.append(str(user_id))
+    if year and month:
+        parts += [str(year), str(month)]
+
+    return '.'.join(parts)
+
+
+def _get_initial_version():
+    """Get an initial version, which won't collide with versions used before the counter got evicted."""
+    return int(time.time() * 1000)
+
+
+def get_versions(keys):
+    """Get the versions for the given version keys, initializing missing ones."""
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _get_initial_version(), None)
+            versions[key] = cache.get(key, 0)
+
+    return versions
+
+
+def bump_version(key):
+    """Bump the version for the given version key."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _get_initial_version(), None)
+
+
+def bump_range_info_version(user_id=None, date=None):
+    """
+    Bump a range info version, invalidating cached range info.
+
+    Without a user, range info for all users is invalidated. Without a date, range info for all months of the given
+    user is invalidated.
+
+    """
+    key = _get_version_key(user_id, *((date.year, date.month) if (user_id and date) else (None, None)))
+
+    # Bumping before the changes are committed would allow other requests to cache stale data under the new version
+    transaction.on_commit(lambda: bump_version(key))
+
+
+def get_month_segments(from_date, until_date):
+    """Split a date range into (from, until, full month) segments per calendar month."""
+    segments = []
+    current_date = from_date
+
+    while current_date <= until_date:
+        month_start = current_date.replace(day=1)
+        month_end = month_start + relativedelta(months=1) - timedelta(days=1)
+        segment_until = min(month_end, until_date)
+        segments.append((current_date, segment_until, (current_date == month_start) and (segment_until == month_end)))
+        current_date = segment_until + timedelta(days=1)
+
+    return segments
+
+
+def merge_range_info(parts, daily=False, detailed=False, summary=False):
+    """Merge (serialized) range info of consecutive date ranges for a single user."""
+    res = {
+        'work_hours': 0,
+        'holiday_hours': 0,
+        'leave_hours': 0,
+        'pending_leave_hours': 0,
+        'performed_hours': 0,
+    }
+    details = {}
+    performances = {}
+
+    for part in parts:
+        for key in res:
+            res[key] += part[key]
+
+        if daily:
+            for day, day_data in part['details'].items():
+                details[day] = dict(day_data)
+                if not detailed:
+                    for key in ['leaves', 'holidays', 'activity_performances', 'standby_performances']:
+                        details[day].pop(key, None)
+
+        if summary:
+            for performance in part['summary']['performances']:
+                merged = performances.setdefault(performance['contract']['id'], {
+                    'contract': performance['contract'],
+                    'duration': 0,
+                    'standby_days': 0,
+                })
+                merged['duration'] += performance['duration']
+                merged['standby_days'] += performance['standby_days']
+
+    res['total_hours'] = res['holiday_hours'] + res['leave_hours'] + res['performed_hours']
+    res['overtime_hours'] = abs(min(0, res['work_hours'] - res['total_hours']))
+    res['remaining_hours'] = max(0, res['work_hours'] - res['total_hours'])
+
+    if daily:
+        res['details'] = details
+    if summary:
+        res['summary'] = {'performances': list(performances.values())}
+
+    return res
+
+
+def get_range_info(user, from_date, until_date, daily=False, detailed=False, summary=False):
+    """
+    Determine and return serialized range info for a single user, using cached month slices.
+
+    Full calendar months are cached per user, and invalidated using version counters which are bumped whenever the
+    data they are derived from changes. Partial months at the edges of the range are always calculated. Months are
+    only cached when the cache is shared between processes, as a version bump would otherwise go unnoticed by other
+    processes.
+
+    """
+    if not is_cache_shared():
+        return calculation.get_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
+                                          summary=summary, serialize=True)[user.id]
+
+    segments = get_month_segments(from_date, until_date)
+
+    # Determine cache keys for full months
+    global_version_key = _get_version_key()
+    user_version_key = _get_version_key(user.id)
+    month_version_keys = {x[0]: _get_version_key(user.id, x[0].year, x[0].month) for x in segments if x[2]}
+    versions = get_versions([global_version_key, user_version_key] + list(month_version_keys.values()))
+
+    cache_keys = {}
+    for segment_from, month_version_key in month_version_keys.items():
+        cache_keys[segment_from] = '%s.%s.%s.%s.%s.%s.%s' % (RANGE_INFO_CACHE_PREFIX, user.id, segment_from,
+                                                             'detailed' if detailed else 'basic',
+                                                             versions[global_version_key], versions[user_version_key],
+                                                             versions[month_version_key])
+    cached = cache.get_many(list(cache_keys.values()))
+
+    # Calculate all segments which aren't cached, sharing calendar data between them
+    parts = {}
+    missing = []
+    for segment_from, segment_until, full_month in segments:
+        if full_month and (cache_keys[segment_from] in cached):
+            parts[segment_from] = cached[cache_keys[segment_from]]
+        else:
+            missing.append((segment_from, segment_until, full_month))
+
+    if missing:
+        context = calculation.CalendarContext([user], missing[0][0], missing[-1][1])
+        to_cache = {}
+
+        for segment_from, segment_until, full_month in missing:
+            parts[segment_from] = calculation.get_range_info([user], segment_from, segment_until, daily=True,
+                                                             detailed=detailed, summary=True, serialize=True,
+                                                             context=context)[user.id]
+            if full_month:
+                to_cache[cache_keys[segment_from]] = parts[segment_from]
+
+        if to_cache:
+            cache.set_many(to_cache, settings.RANGE_INFO_CACHE_TIMEOUT)
+
+    return merge_range_info([parts[x[0]] for x in segments], daily=daily, detailed=detailed, summary=summary)
+
+
+def get_range_info_fingerprints(user, from_date, until_date):
+    """
+    Get fingerprints of the data range info is derived from, indexed by day.
+
+    Fingerprints are based on the amount and last update of the performances, leave dates and whereabouts of a day,
+    so they change whenever any of them is created, updated or deleted.
+
+    """
+    day_data = {}
+
+    performances = (models.Performance.objects
+                    .non_polymorphic()
+                    .filter(timesheet__user=user, date__gte=from_date, date__lte=until_date)
+                    .order_by()
+                    .values('date')
+                    .annotate(count=Count('id'), last_updated_at=Max('updated_at')))
+    for performance in performances:
+        day_data.setdefault(performance['date'], []).append(
+            ('performance', performance['count'], performance['last_updated_at']))
+
+    leave_dates = (models.LeaveDate.objects
+                   .non_polymorphic()
+                   .filter(leave__user=user, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
+                   .annotate(day=TruncDate('starts_at'))
+                   .order_by()
+                   .values('day')
+                   .annotate(count=Count('id'), last_updated_at=Max('updated_at'),
+                             last_leave_updated_at=Max('leave__updated_at')))
+    for leave_date in leave_dates:
+        day_data.setdefault(leave_date['day'], []).append(
+            ('leave_date', leave_date['count'], leave_date['last_updated_at'], leave_date['last_leave_updated_at']))
+
+    whereabouts = (models.Whereabout.objects
+                   .non_polymorphic()
+                   .filter(timesheet__user=user, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
+                   .annotate(day=TruncDate('starts_at'))
+                   .order_by()
+                   .values('day')
+                   .annotate(count=Count('id'), last_updated_at=Max('updated_at')))
+    for whereabout in whereabouts:
+        day_data.setdefault(whereabout['day'], []).append(
+            ('whereabout', whereabout['count'], whereabout['last_updated_at']))
+
+    return {str(day): hashlib.sha1(repr(sorted(entries)).encode('utf-8')).hexdigest()[:12]
+            for day, entries in day_data.items()}
+
+
+def get_range_info_month_fingerprints(user, from_date, until_date):
+    """
+    Get fingerprints of the data range info is derived from, indexed by month.
+
+    Month fingerprints combine the fingerprints of their days, so tokens holding them stay compact for long ranges.
+
+    """
+    month_data = {}
+    for day_key, fingerprint in sorted(get_range_info_fingerprints(user, from_date, until_date).items()):
+        month_data.setdefault(day_key[:7], []).append((day_key, fingerprint))
+
+    return {month_key: hashlib.sha1(repr(entries).encode('utf-8')).hexdigest()[:12]
+            for month_key, entries in month_data.items()}
+
+
+def get_range_info_dependency_fingerprint(user, from_date, until_date):
+    """
+    Get a fingerprint of the data range info as a whole is derived from, rather than that of single days.
+
+    The fingerprint is based on the amount and last update of the holidays within the range, the employment
+    contracts of the user along with their companies and work schedules, and performance types. It is determined
+    from the database, so it doesn't depend on version counters being shared between processes.
+
+    """
+    holidays = (models.Holiday.objects
+                .filter(date__gte=from_date, date__lte=until_date)
+                .aggregate(count=Count('id'), last_updated_at=Max('updated_at')))
+    employment_contracts = (models.EmploymentContract.objects
+                            .filter(user=user)
+                            .aggregate(count=Count('id'), last_updated_at=Max('updated_at'),
+                                       last_company_updated_at=Max('company__updated_at'),
+                                       last_work_schedule_updated_at=Max('work_schedule__updated_at')))
+    performance_types = (models.PerformanceType.objects
+                         .non_polymorphic()
+                         .aggregate(count=Count('id'), last_updated_at=Max('updated_at')))
+
+    data = [sorted(x.items()) for x in [holidays, employment_contracts, performance_types]]
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()[:12]
+
+
+def get_range_info_validator(user, from_date, until_date):
+    """
+    Get a validator for range info of a single user, which changes whenever the range info does.
+
+    The validator consists of the fingerprint of the data the range as a whole depends on, along with the
+    fingerprints of its days.
+
+    """
+    return (get_range_info_dependency_fingerprint(user, from_date, until_date),
+            sorted(get_range_info_fingerprints(user, from_date, until_date).items()))
+
+
+def get_range_info_delta(user, from_date, until_date, token=None, detailed=False, summary=False):
+    """
+    Determine and return serialized daily range info for a single user, along with a token for later deltas.
+
+    When given a token issued for the same user and range, only the days of months whose performances, leave dates
+    or whereabouts changed since are included, and the result is marked as a delta. Totals (and the summary) are
+    always included. Changes to data affecting whole ranges, such as holidays or employment contracts, result in full
+    range info.
+
+    """
+    parameters = [str(from_date), str(until_date), detailed, summary]
+    dependencies = get_range_info_dependency_fingerprint(user, from_date, until_date)
+
+    # Determine fingerprints before calculating, so changes made meanwhile show up in the next delta
+    fingerprints = get_range_info_month_fingerprints(user, from_date, until_date)
+
+    previous = None
+    if token:
+        try:
+            previous = signing.loads(token, salt=RANGE_INFO_DELTA_TOKEN_SALT)
+        except signing.BadSignature:
+            previous = None
+    if previous and ((previous.get('user') != user.id) or (previous.get('parameters') != parameters) or
+                     (previous.get('dependencies') != dependencies)):
+        previous = None
+
+    if previous is None:
+        res = get_range_info(user, from_date, until_date, daily=True, detailed=detailed, summary=summary)
+        res['delta'] = False
+    else:
+        # Totals are aggregated without calculating every day
+        res = calculation.get_range_info([user], from_date, until_date, summary=summary,
+                                         serialize=True)[user.id]
+        res['delta'] = True
+        res['details'] = {}
+
+        previous_fingerprints = previous['fingerprints']
+        changed_days = [current_date for current_date, day_key in calculation.get_days(from_date, until_date)
+                        if fingerprints.get(day_key[:7], None) != previous_fingerprints.get(day_key[:7], None)]
+
+        if changed_days:
+            context = calculation.CalendarContext([user], changed_days[0], changed_days[-1])
+            for current_date in changed_days:
+                day_res = calculation.get_range_info([user], current_date, current_date, daily=True,
+                                                     detailed=detailed, serialize=True, context=context)[user.id]
+                res['details'].update(day_res['details'])
+
+    res['token'] = signing.dumps({
+        'user': user.id,
+        'parameters': parameters,
+        'dependencies': dependencies,
+        'fingerprints': fingerprints,
+    }, salt=RANGE_INFO_DELTA_TOKEN_SALT, compress=True)
+
+    return res
+
+
+class HolidayCalendar(object):
+    """
+    Holiday calendar.
+
+    Holidays are loaded into memory per year the first time they are needed, and indexed by country and year, then by
+    date. As holidays rarely change, loaded years are kept until the calendar is invalidated or expires.
+
+    """
+
+    def __init__(self, version=None, timeout=None):
+        """Constructor."""
+        self.version = version
+        self.expires_at = (time.monotonic() + timeout) if timeout is not None else None
+        self.years = set()
+        self.holidays = {}
+        self.lock = threading.Lock()
+
+    def is_expired(self):
+        """Check whether this calendar expired."""
+        return (self.expires_at is not None) and (self.expires_at <= time.monotonic())
+
+    def load_year(self, year):
+        """Ensure the holidays of the given year are loaded."""
+        if year in self.years:
+            return
+
+        with self.lock:
+            if year in self.years:
+                return
+
+            for holiday in models.Holiday.objects.filter(date__year=year).order_by('date', 'id'):
+                (self.holidays
+                    .setdefault((str(holiday.country), year), {})
+                    .setdefault(holiday.date, [])
+                    .append(holiday))
+            self.years.add(year)
+
+    def get_holidays(self, country, date):
+        """Get the holidays of the given country on the given date."""
+        self.load_year(date.year)
+        return self.holidays.get((str(country), date.year), {}).get(date, [])
+
+    def is_holiday(self, country, date):
+        """Check whether the given date is a holiday in the given country."""
+        return bool(self.get_holidays(country, date))
+
+    def get_range(self, from_date, until_date, country=None):
+        """Get the holidays within the given date range, indexed by date, then by country."""
+        res = {}
+
+        for year in range(from_date.year, until_date.year + 1):
+            self.load_year(year)
+
+        for (holiday_country, year), dates in list(self.holidays.items()):
+            if (year < from_date.year) or (year > until_date.year) or \
+                    ((country is not None) and (holiday_country != str(country))):
+                continue
+
+            for date, holidays in dates.items():
+                if from_date <= date <= until_date:
+                    res.setdefault(date, {})[holiday_country] = holidays
+
+        return res
+
+
+# Holiday calendar shared by all threads of this process
+_holiday_calendar = None
+
+
+def get_holiday_calendar():
+    """
+    Get the holiday calendar of this process.
+
+    The calendar is replaced once another process invalidated it, which is detected through a version counter in the
+    cache, or once it expires after HOLIDAY_CALENDAR_TIMEOUT. Unless the cache is shared between processes, other
+    processes can't be notified, so a new calendar is returned on each call instead.
+
+    """
+    global _holiday_calendar
+
+    if not is_cache_shared():
+        return HolidayCalendar()
+
+    version = get_versions([HOLIDAY_CALENDAR_VERSION_KEY])[HOLIDAY_CALENDAR_VERSION_KEY]
+
+    calendar = _holiday_calendar
+    if (calendar is None) or (calendar.version != version) or calendar.is_expired():
+        calendar = _holiday_calendar = HolidayCalendar(version, settings.HOLIDAY_CALENDAR_TIMEOUT)
+
+    return calendar
+
+
+def invalidate_holiday_calendar():
+    """
+    Invalidate the holiday calendar.
+
+    The calendar of this process is discarded right away, so the current transaction sees its own changes. Other
+    processes are notified once the transaction is committed.
+
+    """
+    global _holiday_calendar
+    _holiday_calendar = None
+
+    def bump():
+        global _holiday_calendar
+        _holiday_calendar = None
+        bump_version(HOLIDAY_CALENDAR_VERSION_KEY)
+
+    transaction.on_commit(bump)
+
+
+class ReferenceDataRegistry(object):
+    """
+    Reference data registry.
+
+    Keeps small, rarely changing reference tables (leave types, performance types, locations and contract roles) in
+    memory, so they can be resolved without joins or additional queries. Each model is loaded the first time it is
+    needed, in its default ordering.
+
+    """
+
+    def __init__(self, versions=None, timeout=None):
+        """Constructor."""
+        self.versions = versions if versions else {}
+        self.expires_at = (time.monotonic() + timeout) if timeout is not None else None
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def is_expired(self):
+        """Check whether this registry expired."""
+        return (self.expires_at is not None) and (self.expires_at <= time.monotonic())
+
+    def load(self, model):
+        """Ensure the instances of the given model are loaded, and return them indexed by ID."""
+        try:
+            return self.objects[model]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if model not in self.objects:
+                self.objects[model] = OrderedDict([(x.id, x) for x in model.objects.all()])
+
+        return self.objects[model]
+
+    def get_all(self, model):
+        """Get all instances of the given model."""
+        return list(self.load(model).values())
+
+    def get(self, model, pk):
+        """Get the instance of the given model with the given ID, or None if it does not exist."""
+        return self.load(model).get(pk, None)
+
+    def attach(self, instances, field, model):
+        """Set the given foreign key field of the given instances to the matching instances of the given model."""
+        objects = self.load(model)
+
+        for instance in instances:
+            related = objects.get(getattr(instance, '%s_id' % field), None)
+            if related is not None:
+                setattr(instance, field, related)
+
+    @cached_property
+    def sickness_leave_type_ids(self):
+        """Get the IDs of leave types which represent sickness."""
+        return set([x.id for x in self.get_all(models.LeaveType) if x.sickness])
+
+    @cached_property
+    def overtime_leave_type_ids(self):
+        """Get the IDs of leave types which compensate overtime."""
+        return set([x.id for x in self.get_all(models.LeaveType) if x.overtime])
+
+    def get_multiplier(self, performance_type_id):
+        """Get the multiplier of the performance type with the given ID."""
+        performance_type = self.get(models.PerformanceType, performance_type_id)
+        if performance_type is None:
+            performance_type = models.PerformanceType.objects.get(id=performance_type_id)
+
+        return performance_type.multiplier
+
+    def get_location_name(self, location_id):
+        """Get the name of the location with the given ID."""
+        location = self.get(models.Location, location_id)
+        if location is None:
+            location = models.Location.objects.get(id=location_id)
+
+        return location.name
+
+
+# Reference data registry shared by all threads of this process
+_reference_data = None
+
+
+def _get_reference_data_version_key(model):
+    """Get the cache key of the reference data version counter for the given model."""
+    return '%s.%s.version' % (REFERENCE_DATA_CACHE_PREFIX, model._meta.model_name)
+
+
+def get_reference_data():
+    """
+    Get the reference data registry of this process.
+
+    The registry is replaced once another process invalidated it, which is detected through version counters in the
+    cache, or once it expires after REFERENCE_DATA_TIMEOUT. Unless the cache is shared between processes, other
+    processes can't be notified, so a new registry is returned on each call instead.
+
+    """
+    global _reference_data
+
+    if not is_cache_shared():
+        return ReferenceDataRegistry()
+
+    versions = get_versions([_get_reference_data_version_key(x) for x in REFERENCE_DATA_MODELS])
+
+    registry = _reference_data
+    if (registry is None) or (registry.versions != versions) or registry.is_expired():
+        registry = _reference_data = ReferenceDataRegistry(versions, settings.REFERENCE_DATA_TIMEOUT)
+
+    return registry
+
+
+def invalidate_reference_data(model):
+    """
+    Invalidate the reference data registry for the given model.
+
+    The registry of this process is discarded right away, so the current transaction sees its own changes. Other
+    processes are notified once the transaction is committed.
+
+    """
+    global _reference_data
+    _reference_data = None
+
+    def bump():
+        global _reference_data
+        _reference_data = None
+        bump_version(_get_reference_data_version_key(model))
+
+    transaction.on_commit(bump)
+
+
+class LRUCache(object):
+    """In-process least recently used cache, expiring entries after a timeout."""
+
+    def __init__(self, max_size, timeout):
+        """Constructor."""
+        self.max_size = max_size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get the value for the given key, or None if it is missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            elif entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        """Set the value for the given key, evicting the least recently used entries if full."""
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """Delete the value for the given key."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+# API key cache shared by all threads of this process
+_api_key_cache = None
+
+
+def _get_api_key_cache():
+    """Get the API key cache of this process."""
+    global _api_key_cache
+
+    if _api_key_cache is None:
+        _api_key_cache = LRUCache(settings.API_KEY_CACHE_SIZE, settings.API_KEY_CACHE_TIMEOUT)
+
+    return _api_key_cache
+
+
+def _get_api_key_cache_key(key):
+    """Get the cache key for the given API key, which doesn't reveal the API key itself."""
+    return '%s.%s' % (API_KEY_CACHE_PREFIX, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def get_api_key_credentials(key):
+    """
+    Get the cached (user, API key) credentials for the given API key, or None if they aren't cached.
+
+    Credentials are cached per process, and optionally shared between processes through the cache. Each request gets
+    its own copy of them.
+
+    """
+    cache_key = _get_api_key_cache_key(key)
+
+    data = _get_api_key_cache().get(cache_key)
+    if (data is None) and settings.API_KEY_CACHE_SHARED:
+        data = cache.get(cache_key, None)
+        if data is not None:
+            _get_api_key_cache().set(cache_key, data)
+
+    return pickle.loads(data) if data is not None else None
+
+
+def set_api_key_credentials(key, credentials):
+    """Cache the given (user, API key) credentials for the given API key."""
+    cache_key = _get_api_key_cache_key(key)
+    data = pickle.dumps(credentials, pickle.HIGHEST_PROTOCOL)
+
+    _get_api_key_cache().set(cache_key, data)
+    if settings.API_KEY_CACHE_SHARED:
+        cache.set(cache_key, data, settings.API_KEY_CACHE_TIMEOUT)
+
+
+def invalidate_api_key_credentials(keys):
+    """
+    Invalidate cached credentials for the given API keys.
+
+    Credentials are invalidated right away, and once more when the transaction is committed, so they can't be cached
+    again in the meantime. Other processes may keep using their own copies until those expire.
+
+    """
+    cache_keys = [_get_api_key_cache_key(x) for x in keys]
+
+    def invalidate():
+        for cache_key in cache_keys:
+            _get_api_key_cache().delete(cache_key)
+        if settings.API_KEY_CACHE_SHARED:
+            cache.delete_many(cache_keys)
+
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -1,74 +1,516 @@
 """Calculation."""
-from django.db.models import Q
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.db import close_old_connections, connection, connections
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, prefetch_related_objects
+from django.utils.functional import cached_property
 from decimal import Decimal
 from datetime import timedelta
-import copy
-from ninetofiver import models
-from ninetofiver.api_v2 import serializers
-from ninetofiver.utils import AvailabilityInfo
+from ninetofiver import caching, models, settings
+from ninetofiver.api_v2 import projections, serializers
+from ninetofiver.utils import AvailabilityInfo, DateSegmentIndex
 
 
-def get_availability(users, from_date, until_date, serialize=False):
+log = logging.getLogger(__name__)
+
+# Flags used to encode compact availability
+AVAILABILITY_FLAGS = OrderedDict([
+    ('no_work', 1 << 0),
+    ('holiday', 1 << 1),
+    ('leave', 1 << 2),
+    ('leave_pending', 1 << 3),
+    ('sickness', 1 << 4),
+    ('sickness_pending', 1 << 5),
+])
+
+
+class ResultRecord(Mapping):
+    """
+    Compact result record.
+
+    Fields are stored in slots rather than a per-instance dict, as results are built for every user and day in a
+    range. Records support dict-style access, so they can be used wherever the dicts they replace were used. Fields
+    set to None are considered absent.
+
+    """
+
+    __slots__ = ()
+    defaults = {}
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        for key in self.__slots__:
+            setattr(self, key, kwargs.get(key, self.defaults.get(key, None)))
+
+    def __getitem__(self, key):
+        """Get a field."""
+        value = getattr(self, key) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """Set a field."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        """Iterate over the keys of fields which are set."""
+        return (key for key in self.__slots__ if getattr(self, key) is not None)
+
+    def __len__(self):
+        """Get the amount of fields which are set."""
+        return len([key for key in self])
+
+    def __repr__(self):
+        """Get a string representation."""
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(['%s=%r' % (key, value) for key, value in self.items()]))
+
+    def to_dict(self):
+        """Convert this record, and any records it contains, to plain dicts."""
+        return {key: to_dict(value) for key, value in self.items()}
+
+
+def to_dict(value):
+    """Convert result records contained in the given value to plain dicts."""
+    if isinstance(value, ResultRecord):
+        return value.to_dict()
+    elif isinstance(value, dict):
+        return {key: to_dict(x) for key, x in value.items()}
+
+    return value
+
+
+class HoursRecord(ResultRecord):
+    """Result record tracking hours."""
+
+    __slots__ = ()
+    hour_fields = ('work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                   'remaining_hours', 'total_hours', 'overtime_hours')
+    defaults = dict.fromkeys(hour_fields, 0)
+
+    def update_totals(self):
+        """Determine total, overtime and remaining hours."""
+        self.total_hours = self.holiday_hours + self.leave_hours + self.performed_hours
+        self.overtime_hours = abs(min(0, self.work_hours - self.total_hours))
+        self.remaining_hours = max(0, self.work_hours - self.total_hours)
+
+
+class DayResult(HoursRecord):
+    """Range info for a single user and day."""
+
+    __slots__ = HoursRecord.hour_fields + ('holidays', 'leaves', 'activity_performances', 'standby_performances')
+
+
+class UserRangeResult(HoursRecord):
+    """Range info for a single user and a date range."""
+
+    __slots__ = HoursRecord.hour_fields + ('details', 'summary')
+
+
+class DayAvailability(ResultRecord):
+    """
+    Availability for a single user and day.
+
+    Days without holidays, leave, sickness or whereabouts share an empty tuple rather than each holding empty lists.
+
+    """
+
+    __slots__ = ('work_hours', 'holidays', 'leave', 'sickness', 'whereabouts')
+    defaults = {'work_hours': 0, 'holidays': (), 'leave': (), 'sickness': (), 'whereabouts': ()}
+
+
+class CalendarContext(object):
+    """
+    Calendar context.
+
+    Lazily fetches and indexes the calendar data (employment contracts, leave dates, holidays, whereabouts,
+    contract user work schedules and performances) for a set of users and a date range, so it can be shared
+    between calculations and report views instead of being queried again by each of them.
+
+    """
+
+    # Data shared by all users, data indexed by user ID and data indexed by date, then by user ID
+    SHARED_DATA = ('sickness_type_ids', 'holiday_data')
+    USER_DATA = ('employment_contract_index', 'contract_user_work_schedule_index')
+    DATE_USER_DATA = ('leave_date_data', 'whereabout_data', 'activity_performance_data', 'standby_performance_data')
+
+    def __init__(self, users, from_date, until_date):
+        """Constructor."""
+        self.users = users
+        self.from_date = from_date
+        self.until_date = until_date
+
+    def load(self, *names):
+        """Load the given data right away, rather than once it is first needed."""
+        for name in names:
+            getattr(self, name)
+
+        return self
+
+    def get_shard(self, users):
+        """
+        Get a calendar context for a subset of the users of this context.
+
+        Data this context already loaded is filtered down to the given users instead of being fetched again, anything
+        else is loaded by the shard itself once needed.
+
+        """
+        shard = CalendarContext(users, self.from_date, self.until_date)
+        user_ids = set([x.id for x in users])
+
+        for name in self.SHARED_DATA:
+            if name in self.__dict__:
+                shard.__dict__[name] = self.__dict__[name]
+
+        for name in self.USER_DATA:
+            if name in self.__dict__:
+                shard.__dict__[name] = {user_id: x for user_id, x in self.__dict__[name].items()
+                                        if user_id in user_ids}
+
+        for name in self.DATE_USER_DATA:
+            if name in self.__dict__:
+                shard.__dict__[name] = {date: {user_id: x for user_id, x in date_data.items() if user_id in user_ids}
+                                        for date, date_data in self.__dict__[name].items()}
+
+        return shard
+
+    def ensure_covers(self, from_date, until_date):
+        """Ensure the given date range is covered by this context."""
+        if (from_date < self.from_date) or (until_date > self.until_date):
+            raise ValueError('The calendar context does not cover %s - %s' % (from_date, until_date))
+
+    @cached_property
+    def sickness_type_ids(self):
+        """Get the IDs of all sickness leave types."""
+        return caching.get_reference_data().sickness_leave_type_ids
+
+    @cached_property
+    def employment_contract_index(self):
+        """Get employment contracts, indexed by user ID, then by date segment."""
+        employment_contracts = (models.EmploymentContract.objects
+                                .filter(
+                                    (Q(ended_at__isnull=True) & Q(started_at__lte=self.until_date)) |
+                                    (Q(started_at__lte=self.until_date) & Q(ended_at__gte=self.from_date)),
+                                    user__in=self.users)
+                                .order_by('started_at')
+                                .select_related('user', 'company', 'work_schedule'))
+
+        employment_contract_data = {}
+        for employment_contract in employment_contracts:
+            (employment_contract_data
+                .setdefault(employment_contract.user.id, [])
+                .append(employment_contract))
+
+        return {user_id: DateSegmentIndex(user_employment_contracts, start_attr='started_at', end_attr='ended_at')
+                for user_id, user_employment_contracts in employment_contract_data.items()}
+
+    @cached_property
+    def contract_user_work_schedule_index(self):
+        """Get contract user work schedules, indexed by user ID, then by date segment."""
+        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
+                                        .filter(contract_user__user__in=self.users)
+                                        .filter(Q(ends_at__isnull=True, starts_at__lte=self.until_date) |
+                                                Q(ends_at__isnull=False, starts_at__lte=self.until_date,
+                                                  ends_at__gte=self.from_date))
+                                        .select_related('contract_user', 'contract_user__user',
+                                                        'contract_user__contract_role', 'contract_user__contract',
+                                                        'contract_user__contract__customer'))
+
+        contract_user_work_schedule_data = {}
+        for contract_user_work_schedule in contract_user_work_schedules:
+            (contract_user_work_schedule_data
+                .setdefault(contract_user_work_schedule.contract_user.user.id, [])
+                .append(contract_user_work_schedule))
+
+        return {user_id: DateSegmentIndex(user_contract_user_work_schedules)
+                for user_id, user_contract_user_work_schedules in contract_user_work_schedule_data.items()}
+
+    @cached_property
+    def leave_date_data(self):
+        """Get approved and pending leave dates, indexed by date, then by user ID."""
+        leave_dates = (models.LeaveDate.objects
+                       .filter(leave__user__in=self.users,
+                               leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                               starts_at__date__gte=self.from_date, starts_at__date__lte=self.until_date)
+                       .select_related('leave', 'leave__user'))
+        caching.get_reference_data().attach([x.leave for x in leave_dates], 'leave_type', models.LeaveType)
+
+        leave_date_data = {}
+        for leave_date in leave_dates:
+            (leave_date_data
+                .setdefault(leave_date.starts_at.date(), {})
+                .setdefault(leave_date.leave.user.id, [])
+                .append(leave_date))
+
+        return leave_date_data
+
+    @cached_property
+    def holiday_data(self):
+        """Get holidays, indexed by date, then by country code."""
+        return caching.get_holiday_calendar().get_range(self.from_date, self.until_date)
+
+    @cached_property
+    def whereabout_data(self):
+        """Get whereabouts, indexed by date, then by user ID."""
+        whereabouts = (models.Whereabout.objects
+                       .filter(timesheet__user__in=self.users, starts_at__date__gte=self.from_date,
+                               starts_at__date__lte=self.until_date)
+                       .select_related('timesheet', 'timesheet__user'))
+        caching.get_reference_data().attach(whereabouts, 'location', models.Location)
+
+        whereabout_data = {}
+        for whereabout in whereabouts:
+            (whereabout_data
+                .setdefault(whereabout.starts_at.date(), {})
+                .setdefault(whereabout.timesheet.user.id, [])
+                .append(whereabout))
+
+        return whereabout_data
+
+    @cached_property
+    def activity_performance_data(self):
+        """Get activity performances, indexed by date, then by user ID."""
+        activity_performances = (models.ActivityPerformance.objects
+                                 .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                         timesheet__user__in=self.users)
+                                 .select_related('contract', 'contract__customer', 'contract__company', 'timesheet',
+                                                 'timesheet__user'))
+        reference_data = caching.get_reference_data()
+        reference_data.attach(activity_performances, 'performance_type', models.PerformanceType)
+        reference_data.attach(activity_performances, 'contract_role', models.ContractRole)
+
+        activity_performance_data = {}
+        for performance in activity_performances:
+            (activity_performance_data
+                .setdefault(performance.date, {})
+                .setdefault(performance.timesheet.user.id, [])
+                .append(performance))
+
+        return activity_performance_data
+
+    @cached_property
+    def standby_performance_data(self):
+        """Get standby performances, indexed by date, then by user ID."""
+        standby_performances = (models.StandbyPerformance.objects
+                                .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                        timesheet__user__in=self.users)
+                                .select_related('contract', 'contract__customer', 'contract__company', 'timesheet',
+                                                'timesheet__user'))
+
+        standby_performance_data = {}
+        for performance in standby_performances:
+            (standby_performance_data
+                .setdefault(performance.date, {})
+                .setdefault(performance.timesheet.user.id, [])
+                .append(performance))
+
+        return standby_performance_data
+
+    def get_employment_contract(self, user_id, date):
+        """Get the employment contract active for the given user on the given date."""
+        index = self.employment_contract_index.get(user_id, None)
+        return index.first(date) if index else None
+
+    def get_contract_user_work_schedules(self, user_id, date):
+        """Get the contract user work schedules active for the given user on the given date."""
+        index = self.contract_user_work_schedule_index.get(user_id, None)
+        return list(index.get(date)) if index else []
+
+    def get_work_hours(self, user_id, from_date, until_date):
+        """Get the total hours the given user should work within the given date range."""
+        index = self.employment_contract_index.get(user_id, None)
+        work_hours = Decimal('0.00')
+
+        if index:
+            for segment_from, segment_until, employment_contracts in index.iter_segments(from_date, until_date):
+                work_schedule = employment_contracts[0].work_schedule if employment_contracts else None
+                if work_schedule:
+                    work_hours += work_schedule.get_hours_for_range(segment_from, segment_until)
+
+        return work_hours
+
+
+def get_days(from_date, until_date):
+    """Get (date, key) pairs for all days within the given date range."""
+    days = []
+    for i in range((until_date - from_date).days + 1):
+        current_date = from_date + timedelta(days=i)
+        days.append((current_date, str(current_date)))
+
+    return days
+
+
+def iter_user_chunks(users, chunk_size=None):
+    """Split users into lists of at most the given (or configured) size."""
+    chunk_size = chunk_size if chunk_size else settings.CALCULATION_CHUNK_SIZE
+    chunk = []
+
+    for user in users.iterator() if hasattr(users, 'iterator') else users:
+        chunk.append(user)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def get_user_shards(users, shard_count):
+    """Split users into (at most) the given amount of evenly sized shards."""
+    users = list(users)
+    shard_size = max(1, -(-len(users) // shard_count))
+
+    return [users[i:i + shard_size] for i in range(0, len(users), shard_size)]
+
+
+# Process pool used for sharded calculations, shared by all threads of this process
+_executor = None
+_executor_lock = threading.Lock()
+
+# Database connections inherited by a worker process, and the ID of the process which detached them
+_inherited_connections = []
+_worker_pid = None
+
+
+def get_executor():
+    """Get the process pool used for sharded calculations, which is created the first time it is needed."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.CALCULATION_WORKERS)
+
+        return _executor
+
+
+def discard_executor(executor):
+    """Discard the given process pool, so a new one is created the next time one is needed."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+    executor.shutdown(wait=False)
+
+
+def shutdown_executor():
+    """Shut down the process pool used for sharded calculations, waiting for its worker processes to exit."""
+    global _executor
+
+    with _executor_lock:
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+atexit.register(shutdown_executor)
+
+
+def detach_inherited_connections():
+    """
+    Detach the database connections a forked worker process inherited from its parent.
+
+    Closing them would end the sessions of the parent process, so they are kept referenced instead, and the worker
+    process opens connections of its own once needed.
+
+    """
+    for alias in connections:
+        _inherited_connections.append(connections[alias])
+        del connections[alias]
+
+
+def calculate_shard(func, users, args, kwargs):
+    """Perform a calculation for a shard of users, within a worker process."""
+    global _worker_pid
+
+    if _worker_pid != os.getpid():
+        detach_inherited_connections()
+        _worker_pid = os.getpid()
+
+    try:
+        return func(users, *args, **kwargs)
+    finally:
+        # Worker processes outlive calculations, so their connections are treated like those of a request
+        close_old_connections()
+
+
+def calculate_sharded(func, users, *args, **kwargs):
+    """
+    Perform a calculation for the given users, splitting them into shards calculated in a process pool.
+
+    Pools are used when CALCULATION_WORKERS is above 1 and there are more users than fit in a single chunk, and
+    never within a transaction. The calculation should return results indexed by user, the results of all shards are
+    merged. A given calendar context is split into a context per shard, so data it already loaded is reused.
+
+    """
+    users = list(users)
+    workers = settings.CALCULATION_WORKERS
+
+    if (workers <= 1) or (len(users) <= settings.CALCULATION_CHUNK_SIZE) or connection.in_atomic_block:
+        return func(users, *args, **kwargs)
+
+    context = kwargs.get('context', None)
+    executor = get_executor()
+    res = {}
+
+    try:
+        futures = [executor.submit(calculate_shard, func, shard, args,
+                                   dict(kwargs, context=context.get_shard(shard)) if context else kwargs)
+                   for shard in get_user_shards(users, workers)]
+        for future in futures:
+            res.update(future.result())
+    except BrokenProcessPool:
+        # A worker process died, so the pool is replaced for later calculations and this one is performed in process
+        log.warning('Process pool for sharded calculations is broken, calculating in process', exc_info=True)
+        discard_executor(executor)
+        return func(users, *args, **kwargs)
+
+    return res
+
+
+def get_engine(engine=None, detailed=False):
+    """
+    Get the calculation engine module to use, or None to use the default Python engine.
+
+    The NumPy engine is only used when it is selected, NumPy is installed and no detailed results are requested.
+
+    """
+    engine = engine if engine else settings.CALCULATION_ENGINE
+    if (engine != 'numpy') or detailed:
+        return None
+
+    from ninetofiver import calculation_numpy
+    if calculation_numpy.np is None:
+        log.warning('The NumPy calculation engine is selected, but NumPy is not installed')
+        return None
+
+    return calculation_numpy
+
+
+def get_availability(users, from_date, until_date, serialize=False, context=None):
     """Determine and return availability."""
     res = {}
 
-    # Fetch sickness leave type IDs
-    sickness_type_ids = list(models.LeaveType.objects.filter(sickness=True).values_list('id', flat=True))
-
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
-    leave_dates = (models.LeaveDate.objects
-                   .filter(Q(leave__status=models.STATUS_APPROVED) | Q(leave__status=models.STATUS_PENDING),
-                           leave__user__in=users, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all whereabouts for this period
-    whereabouts = (models.Whereabout.objects
-                   .filter(timesheet__user__in=users, starts_at__date__gte=from_date,
-                           starts_at__date__lte=until_date)
-                   .select_related('timesheet', 'timesheet__user', 'location'))
-    # Index whereabouts by day, then by user ID
-    whereabout_data = {}
-    for whereabout in whereabouts:
-        (whereabout_data
-            .setdefault(str(whereabout.starts_at.date()), {})
-            .setdefault(whereabout.timesheet.user.id, [])
-            .append(whereabout))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    # Fetch and index all calendar data for this period
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+    sickness_type_ids = context.sickness_type_ids
+    leave_date_data = context.leave_date_data
+    holiday_data = context.holiday_data
+    whereabout_data = context.whereabout_data
+
+    # Determine days, and the keys they are reported under
+    days = get_days(from_date, until_date)
 
     # Iterate over users
     for user in users:
@@ -76,128 +518,86 @@ def get_availability(users, from_date, until_date, serialize=False):
         res[str(user.id)] = user_data = {}
 
         # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-            user_data[str(current_date)] = user_day_data = {
-                'work_hours': 0,
-                'holidays': [],
-                'leave': [],
-                'sickness': [],
-                'whereabouts': [],
-            }
+        for current_date, day_key in days:
+            user_data[day_key] = user_day_data = DayAvailability()
 
             # Get employment contract for this day
             # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = context.get_employment_contract(user.id, current_date)
 
             work_schedule = employment_contract.work_schedule if employment_contract else None
             country = employment_contract.company.country if employment_contract else None
 
             # No work occurs when there is no work_schedule, or no hours should be worked that day
             if work_schedule:
-                user_day_data['work_hours'] = getattr(work_schedule, current_date.strftime('%A').lower(), 0.00)
+                user_day_data.work_hours = work_schedule.get_hours_for_date(current_date)
 
             # Holidays
             try:
                 if country:
-                    user_day_data['holidays'] = holiday_data[str(current_date)][country][0:]
+                    user_day_data.holidays = holiday_data[current_date][str(country)]
             except KeyError:
                 pass
 
             # Leave & Sickness
             try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
-                    if leave_date.leave.leave_type.id in sickness_type_ids:
-                        user_day_data['sickness'] += [leave_date]
-                    else:
-                        user_day_data['leave'] += [leave_date]
+                day_leave_dates = leave_date_data[current_date][user.id]
+                user_day_data.leave = [x for x in day_leave_dates if x.leave.leave_type.id not in sickness_type_ids]
+                user_day_data.sickness = [x for x in day_leave_dates if x.leave.leave_type.id in sickness_type_ids]
             except KeyError:
                 pass
 
             # Whereabouts
             try:
-                user_day_data['whereabouts'] = whereabout_data[str(current_date)][user.id][0:]
+                user_day_data.whereabouts = whereabout_data[current_date][user.id]
             except KeyError:
                 pass
 
             if serialize:
-                user_day_data['whereabouts'] = serializers.WhereaboutSerializer(user_day_data['whereabouts'], many=True).data
-                user_day_data['holidays'] = serializers.HolidaySerializer(user_day_data['holidays'], many=True).data
-                user_day_data['leave'] = serializers.LeaveDateSerializer(user_day_data['leave'], many=True).data
-                user_day_data['sickness'] = serializers.LeaveDateSerializer(user_day_data['sickness'], many=True).data
+                user_data[day_key] = {
+                    'work_hours': user_day_data.work_hours,
+                    'holidays': projections.project_many(serializers.HolidaySerializer, user_day_data.holidays),
+                    'leave': projections.project_many(serializers.LeaveDateSerializer, user_day_data.leave),
+                    'sickness': projections.project_many(serializers.LeaveDateSerializer, user_day_data.sickness),
+                    'whereabouts': projections.project_many(serializers.WhereaboutSerializer,
+                                                            user_day_data.whereabouts),
+                }
 
     return res
 
 
-def get_availability_info(users, from_date, until_date):
+def iter_availability(users, from_date, until_date, serialize=False, chunk_size=None):
+    """
+    Determine availability one user at a time, yielding (user, availability) pairs.
+
+    Calendar data is fetched per chunk of users rather than for all users at once, so memory use is bounded by the
+    chunk size instead of the amount of users.
+
+    """
+    for chunk in iter_user_chunks(users, chunk_size):
+        res = get_availability(chunk, from_date, until_date, serialize=serialize)
+        for user in chunk:
+            yield user, res.pop(str(user.id))
+
+
+def get_availability_info(users, from_date, until_date, context=None, engine=None):
     """Determine and return availability info."""
+    numpy_engine = get_engine(engine)
+    if numpy_engine:
+        return numpy_engine.get_availability_info(users, from_date, until_date, context=context)
+
     res = {}
 
-    # Fetch sickness leave type IDs
-    sickness_type_ids = list(models.LeaveType.objects.filter(sickness=True).values_list('id', flat=True))
-
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
-    leave_dates = (models.LeaveDate.objects
-                   .filter(Q(leave__status=models.STATUS_APPROVED) | Q(leave__status=models.STATUS_PENDING),
-                           leave__user__in=users, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all whereabouts for this period
-    whereabouts = (models.Whereabout.objects
-                   .filter(timesheet__user__in=users, starts_at__date__gte=from_date,
-                           starts_at__date__lte=until_date)
-                   .select_related('timesheet', 'timesheet__user', 'location'))
-    # Index whereabouts by day, then by user ID
-    whereabout_data = {}
-    for whereabout in whereabouts:
-        (whereabout_data
-            .setdefault(str(whereabout.starts_at.date()), {})
-            .setdefault(whereabout.timesheet.user.id, [])
-            .append(whereabout))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    # Fetch and index all calendar data for this period
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+    sickness_type_ids = context.sickness_type_ids
+    leave_date_data = context.leave_date_data
+    holiday_data = context.holiday_data
+    whereabout_data = context.whereabout_data
+
+    # Determine days, and the keys they are reported under
+    days = get_days(from_date, until_date)
 
     # Iterate over users
     for user in users:
@@ -205,42 +605,34 @@ def get_availability_info(users, from_date, until_date):
         res[str(user.id)] = user_data = {}
 
         # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-            user_data[str(current_date)] = user_day_info = AvailabilityInfo()
+        for current_date, day_key in days:
+            user_data[day_key] = user_day_info = AvailabilityInfo()
 
             # Get employment contract for this day
             # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = context.get_employment_contract(user.id, current_date)
 
             work_schedule = employment_contract.work_schedule if employment_contract else None
             country = employment_contract.company.country if employment_contract else None
 
             # No work occurs when there is no work_schedule, or no hours should be worked that day
-            if (not work_schedule) or (getattr(work_schedule, current_date.strftime('%A').lower(), 0.00) <= 0):
+            if (not work_schedule) or (work_schedule.get_hours_for_date(current_date) <= 0):
                 user_day_info.add_tag('no_work')
 
             # Holidays
             try:
-                if country and holiday_data[str(current_date)][country]:
+                if country and holiday_data[current_date][str(country)]:
                     user_day_info.add_tag('holiday')
             except KeyError:
                 pass
 
             # Leave & Sickness
             try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
+                for leave_date in leave_date_data[current_date][user.id]:
                     leave_status = leave_date.leave.status
                     # TODO: We will probably need to add the leave type to the structure here as well so that the
-                    # timesheet monthly overview report can distinguish between various kinds of leave for legal reasons?
+                    # timesheet monthly overview report can distinguish between various kinds of leave for legal
+                    # reasons?
                     user_day_info.leave_dates.append(leave_date)
                     if leave_date.leave.leave_type.id in sickness_type_ids:
                         if leave_status == models.STATUS_APPROVED:
@@ -257,7 +649,7 @@ def get_availability_info(users, from_date, until_date):
 
             # Whereabouts
             try:
-                for whereabout in whereabout_data[str(current_date)][user.id]:
+                for whereabout in whereabout_data[current_date][user.id]:
                     user_day_info.add_tag('whereabout_%s' % whereabout.location.name.lower().replace(' ', '_'))
             except KeyError:
                 pass
@@ -265,89 +657,141 @@ def get_availability_info(users, from_date, until_date):
     return res
 
 
-def get_internal_availability_info(users, from_date, until_date):
+def get_compact_availability(users, from_date, until_date, context=None):
+    """
+    Determine and return compact availability.
+
+    Availability of every user and day is encoded as an integer bitmask of AVAILABILITY_FLAGS. Holidays, leave dates
+    and whereabout locations are referenced by ID per day, and included once in side tables, without using
+    serializers.
+
+    """
+    res = {
+        'from': str(from_date),
+        'until': str(until_date),
+        'flags': AVAILABILITY_FLAGS,
+        'locations': {},
+        'holidays': {},
+        'leave_dates': {},
+        'users': {},
+    }
+
+    # Fetch and index all calendar data for this period
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+    sickness_type_ids = context.sickness_type_ids
+    leave_date_data = context.leave_date_data
+    holiday_data = context.holiday_data
+    whereabout_data = context.whereabout_data
+
+    # Determine days, and the keys they are reported under
+    days = get_days(from_date, until_date)
+
+    for user in users:
+        user_days = []
+        user_holidays = {}
+        user_leave_dates = {}
+        user_locations = {}
+        res['users'][str(user.id)] = {'days': user_days, 'holidays': user_holidays, 'leave_dates': user_leave_dates,
+                                      'locations': user_locations}
+
+        for day_index, (current_date, day_key) in enumerate(days):
+            flags = 0
+
+            # Get employment contract for this day
+            # This allows us to determine the work schedule and country of the user
+            employment_contract = context.get_employment_contract(user.id, current_date)
+
+            work_schedule = employment_contract.work_schedule if employment_contract else None
+            country = employment_contract.company.country if employment_contract else None
+
+            # No work occurs when there is no work_schedule, or no hours should be worked that day
+            if (not work_schedule) or (work_schedule.get_hours_for_date(current_date) <= 0):
+                flags |= AVAILABILITY_FLAGS['no_work']
+
+            # Holidays
+            holidays = holiday_data.get(current_date, {}).get(str(country), []) if country else []
+            if holidays:
+                flags |= AVAILABILITY_FLAGS['holiday']
+                user_holidays[day_index] = [x.id for x in holidays]
+                for holiday in holidays:
+                    if str(holiday.id) not in res['holidays']:
+                        res['holidays'][str(holiday.id)] = {'id': holiday.id, 'name': holiday.name,
+                                                            'date': holiday.date, 'country': str(holiday.country)}
+
+            # Leave & Sickness
+            leave_dates = leave_date_data.get(current_date, {}).get(user.id, [])
+            if leave_dates:
+                user_leave_dates[day_index] = [x.id for x in leave_dates]
+                for leave_date in leave_dates:
+                    tag = 'sickness' if leave_date.leave.leave_type_id in sickness_type_ids else 'leave'
+                    if leave_date.leave.status != models.STATUS_APPROVED:
+                        tag = '%s_pending' % tag
+                    flags |= AVAILABILITY_FLAGS[tag]
+                    res['leave_dates'][str(leave_date.id)] = {
+                        'id': leave_date.id,
+                        'leave': leave_date.leave.id,
+                        'leave_type': leave_date.leave.leave_type_id,
+                        'status': leave_date.leave.status,
+                        'starts_at': leave_date.starts_at,
+                        'ends_at': leave_date.ends_at,
+                    }
+
+            # Whereabouts
+            whereabouts = whereabout_data.get(current_date, {}).get(user.id, [])
+            if whereabouts:
+                user_locations[day_index] = sorted(set([x.location_id for x in whereabouts]))
+                for whereabout in whereabouts:
+                    if str(whereabout.location_id) not in res['locations']:
+                        res['locations'][str(whereabout.location_id)] = {'id': whereabout.location_id,
+                                                                         'name': whereabout.location.name}
+
+            user_days.append(flags)
+
+    return res
+
+
+def get_internal_availability_info(users, from_date, until_date, context=None):
     """Determine and return availability info."""
     res = {}
 
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch contract user work schedules
-    contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                                    .filter(contract_user__user__in=users)
-                                    .filter(Q(ends_at__isnull=True, starts_at__lte=until_date) |
-                                            Q(ends_at__isnull=False, starts_at__lte=until_date,
-                                              ends_at__gte=from_date))
-                                    .select_related('contract_user', 'contract_user__user',
-                                                    'contract_user__contract_role', 'contract_user__contract',
-                                                    'contract_user__contract__customer'))
-    # Index contract user work schedules by user
-    contract_user_work_schedule_data = {}
-    for contract_user_work_schedule in contract_user_work_schedules:
-        (contract_user_work_schedule_data
-            .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-            .append(contract_user_work_schedule))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    # Fetch and index all calendar data for this period
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+
+    # Determine days, and the keys they are reported under
+    days = get_days(from_date, until_date)
 
     # Iterate over users
     for user in users:
         # Initialize user data
         res[str(user.id)] = user_data = {}
         # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-            user_data[str(current_date)] = user_day_tags = []
+        for current_date, day_key in days:
+            user_data[day_key] = user_day_tags = []
 
             # Get employment contract for this day
             # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = context.get_employment_contract(user.id, current_date)
 
-            valid_contract_user_work_schedules = []
+            valid_contract_user_work_schedules = context.get_contract_user_work_schedules(user.id, current_date)
             contract_user_day_scheduled_hours = Decimal('0.00')
 
-            try:
-                for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                    if (contract_user_work_schedule.starts_at <= current_date) and \
-                            ((not contract_user_work_schedule.ends_at) or
-                                (contract_user_work_schedule.ends_at >= current_date)):
-                        valid_contract_user_work_schedules.append(contract_user_work_schedule)
-                        contract_user_day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                                     current_date.strftime('%A').lower(), Decimal('0.00'))
-            except KeyError:
-                pass
+            for contract_user_work_schedule in valid_contract_user_work_schedules:
+                contract_user_day_scheduled_hours += contract_user_work_schedule.get_hours_for_date(current_date)
 
             employment_contract_work_schedule = employment_contract.work_schedule if employment_contract else None
+            employment_contract_day_work_hours = (employment_contract_work_schedule.get_hours_for_date(current_date)
+                                                  if employment_contract_work_schedule else Decimal('0.00'))
             # No work occurs when there is no work_schedule, or no hours should be worked that day
-            if (not employment_contract_work_schedule) or (getattr(employment_contract_work_schedule, current_date.strftime('%A').lower(), 0.00) <= 0):
+            if (not employment_contract_work_schedule) or (employment_contract_day_work_hours <= 0):
                 user_day_tags.append('no_employment_contract_work_schedule')
 
             if (not valid_contract_user_work_schedules or contract_user_day_scheduled_hours <= 0):
                 user_day_tags.append('no_contract_user_work_schedule')
 
             # If no hours available
-            math_check = getattr(employment_contract_work_schedule, current_date.strftime('%A').lower(), 0) - contract_user_day_scheduled_hours
+            math_check = employment_contract_day_work_hours - contract_user_day_scheduled_hours
             if (math_check <= 0):
                 user_day_tags.append('not_available_for_internal_work')
 
@@ -357,165 +801,93 @@ def get_internal_availability_info(users, from_date, until_date):
     return res
 
 
-def get_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False):
+def get_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False,
+                   context=None, engine=None):
     """Determine and return range info."""
+    numpy_engine = get_engine(engine, detailed=detailed)
+    if numpy_engine:
+        return numpy_engine.get_range_info(users, from_date, until_date, daily=daily, summary=summary,
+                                           serialize=serialize, context=context)
+
+    # Without daily details, totals can be aggregated by the database
+    if not (daily or detailed):
+        return get_range_info_totals(users, from_date, until_date, summary=summary, serialize=serialize,
+                                     context=context)
+
     res = {}
 
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
-    leave_dates = (models.LeaveDate.objects
-                   .filter(leave__user__in=users, leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
-                           starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user')
-                   .prefetch_related('leave__attachments', 'leave__leavedate_set'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all activity performances for this period
-    activity_performances = (models.ActivityPerformance.objects
-                             .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
-                             .select_related('performance_type', 'contract_role', 'contract',
-                                             'contract__customer', 'timesheet', 'timesheet__user'))
-    # Index activity performances by day, then by user ID
-    activity_performance_data = {}
-    for performance in activity_performances:
-        (activity_performance_data
-            .setdefault(str(performance.date), {})
-            .setdefault(performance.timesheet.user.id, [])
-            .append(performance))
+    # Fetch and index all calendar data for this period
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+    leave_date_data = context.leave_date_data
+    holiday_data = context.holiday_data
+    activity_performance_data = context.activity_performance_data
+    standby_performance_data = context.standby_performance_data
 
-    # Fetch all standby performances for this period
-    standby_performances = (models.StandbyPerformance.objects
-                             .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
-                            .select_related('contract', 'contract__customer', 'timesheet', 'timesheet__user'))
-    # Index standby performances by day, then by user ID
-    standby_performance_data = {}
-    for performance in standby_performances:
-        (standby_performance_data
-            .setdefault(str(performance.date), {})
-            .setdefault(performance.timesheet.user.id, [])
-            .append(performance))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    # Determine days, and the keys they are reported under
+    days = get_days(from_date, until_date)
 
     for user in users:
         # Results are indexed by user ID
-        user_res = res[user.id] = {}
-        user_res['work_hours'] = 0
-        user_res['holiday_hours'] = 0
-        user_res['leave_hours'] = 0
-        user_res['pending_leave_hours'] = 0
-        user_res['performed_hours'] = 0
-        user_res['remaining_hours'] = 0
-        user_res['total_hours'] = 0
-        user_res['overtime_hours'] = 0
-        user_res['details'] = {}
-        user_res['summary'] = {
-            'performances': {},
-        }
+        # Work hours for the entire range are determined per employment contract rather than per day
+        user_res = res[user.id] = UserRangeResult(work_hours=context.get_work_hours(user.id, from_date, until_date),
+                                                  details={} if daily else None)
+        contract_performances = {}
 
         # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-
-            day_res = user_res['details'][str(current_date)] = {}
-            day_res['work_hours'] = 0
-            day_res['holiday_hours'] = 0
-            day_res['leave_hours'] = 0
-            day_res['pending_leave_hours'] = 0
-            day_res['performed_hours'] = 0
-            day_res['remaining_hours'] = 0
-            day_res['total_hours'] = 0
-            day_res['overtime_hours'] = 0
-            day_res['holidays'] = []
-            day_res['leaves'] = []
-            day_res['activity_performances'] = []
-            day_res['standby_performances'] = []
+        for current_date, day_key in days:
+            # Detail lists are only built when detailed results are requested
+            day_res = (DayResult(holidays=[], leaves=[], activity_performances=[], standby_performances=[])
+                       if detailed else DayResult())
+            if daily:
+                user_res.details[day_key] = day_res
 
             # Get employment contract for this day
             # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = context.get_employment_contract(user.id, current_date)
 
             work_schedule = employment_contract.work_schedule if employment_contract else None
             country = employment_contract.company.country if employment_contract else None
 
             # Work hours
-            if work_schedule:
-                duration = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
-                user_res['work_hours'] += duration
-                day_res['work_hours'] += duration
+            day_work_hours = work_schedule.get_hours_for_date(current_date) if work_schedule else Decimal('0.00')
+            day_res.work_hours += day_work_hours
 
             # Holidays
             try:
-                if country and holiday_data[str(current_date)][country]:
-                    duration = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
-                    user_res['holiday_hours'] += duration
-                    day_res['holiday_hours'] += duration
-                    day_res['holidays'] += holiday_data[str(current_date)][country]
+                if country and holiday_data[current_date][str(country)]:
+                    duration = day_work_hours
+                    user_res.holiday_hours += duration
+                    day_res.holiday_hours += duration
+                    if detailed:
+                        day_res.holidays += holiday_data[current_date][str(country)]
             except KeyError:
                 pass
 
             # Leave
             try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
+                for leave_date in leave_date_data[current_date][user.id]:
                     duration = leave_date.duration
                     if leave_date.leave.status == models.STATUS_APPROVED:
-                        user_res['leave_hours'] += duration
-                        day_res['leave_hours'] += duration
+                        user_res.leave_hours += duration
+                        day_res.leave_hours += duration
                     else:
-                        user_res['pending_leave_hours'] += duration
-                        day_res['pending_leave_hours'] += duration
-                    day_res['leaves'].append(leave_date.leave)
+                        user_res.pending_leave_hours += duration
+                        day_res.pending_leave_hours += duration
+                    if detailed:
+                        day_res.leaves.append(leave_date.leave)
             except KeyError:
                 pass
 
             # Activity performance
             try:
-                for performance in activity_performance_data[str(current_date)][user.id]:
+                for performance in activity_performance_data[current_date][user.id]:
                     duration = performance.normalized_duration
-                    user_res['performed_hours'] += duration
-                    day_res['performed_hours'] += duration
-                    day_res['activity_performances'].append(performance)
-                    user_res['summary']['performances'].setdefault(performance.contract.id, {
+                    user_res.performed_hours += duration
+                    day_res.performed_hours += duration
+                    if detailed:
+                        day_res.activity_performances.append(performance)
+                    contract_performances.setdefault(performance.contract.id, {
                         'contract': performance.contract,
                         'duration': 0,
                         'standby_days': 0,
@@ -525,9 +897,10 @@ def get_range_info(users, from_date, until_date, daily=False, detailed=False, su
 
             # Standby performance
             try:
-                for performance in standby_performance_data[str(current_date)][user.id]:
-                    day_res['standby_performances'].append(performance)
-                    user_res['summary']['performances'].setdefault(performance.contract.id, {
+                for performance in standby_performance_data[current_date][user.id]:
+                    if detailed:
+                        day_res.standby_performances.append(performance)
+                    contract_performances.setdefault(performance.contract.id, {
                         'contract': performance.contract,
                         'duration': 0,
                         'standby_days': 0,
@@ -535,37 +908,176 @@ def get_range_info(users, from_date, until_date, daily=False, detailed=False, su
             except KeyError:
                 pass
 
-            day_res['total_hours'] = (day_res['holiday_hours'] + day_res['leave_hours'] + day_res['performed_hours'])
-            day_res['overtime_hours'] = abs(min(0, day_res['work_hours'] - day_res['total_hours']))
-            day_res['remaining_hours'] = max(0, day_res['work_hours'] - day_res['total_hours'])
-
-        user_res['total_hours'] = user_res['holiday_hours'] + user_res['leave_hours'] + user_res['performed_hours']
-        user_res['overtime_hours'] = abs(min(0, user_res['work_hours'] - user_res['total_hours']))
-        user_res['remaining_hours'] = max(0, user_res['work_hours'] - user_res['total_hours'])
-        user_res['summary']['performances'] = user_res['summary']['performances'].values()
-
-        if not summary:
-            user_res.pop('summary', None)
-        elif serialize:
-            for performance in user_res['summary']['performances']:
-                performance['contract'] = serializers.MinimalContractSerializer(performance['contract']).data
-
-        if not detailed:
-            for day, day_data in user_res['details'].items():
-                day_data.pop('leaves', None)
-                day_data.pop('holidays', None)
-                day_data.pop('activity_performances', None)
-                day_data.pop('standby_performances', None)
-        elif serialize:
-            for day, day_data in user_res['details'].items():
-                day_data['holidays'] = serializers.HolidaySerializer(day_data['holidays'], many=True).data
-                day_data['leaves'] = serializers.LeaveSerializer(day_data['leaves'], many=True).data
-                day_data['activity_performances'] = serializers.ActivityPerformanceSerializer(
-                    day_data['activity_performances'], many=True).data
-                day_data['standby_performances'] = serializers.StandbyPerformanceSerializer(
-                    day_data['standby_performances'], many=True).data
-
-        if not daily:
-            user_res.pop('details', None)
+            day_res.update_totals()
+
+        user_res.update_totals()
+
+        if summary:
+            user_res.summary = {'performances': list(contract_performances.values())}
+            if serialize:
+                for performance in user_res.summary['performances']:
+                    performance['contract'] = projections.project(serializers.MinimalContractSerializer,
+                                                                  performance['contract'])
+
+        if daily and detailed and serialize:
+            # Leaves are serialized including their attachments and leave dates
+            prefetch_related_objects([leave for day_res in user_res.details.values()
+                                      for leave in day_res.leaves], 'attachments', 'leavedate_set')
+
+            for day, day_res in user_res.details.items():
+                day_res.holidays = projections.project_many(serializers.HolidaySerializer, day_res.holidays)
+                day_res.leaves = projections.project_many(serializers.LeaveSerializer, day_res.leaves)
+                day_res.activity_performances = projections.project_many(serializers.ActivityPerformanceSerializer,
+                                                                         day_res.activity_performances)
+                day_res.standby_performances = projections.project_many(serializers.StandbyPerformanceSerializer,
+                                                                        day_res.standby_performances)
+
+        # Serialized results are plain dicts
+        if serialize:
+            res[user.id] = user_res.to_dict()
+
+    return res
+
+
+def get_range_info_totals(users, from_date, until_date, summary=False, serialize=False, context=None):
+    """
+    Determine and return range info totals, without daily details.
+
+    Performance and leave totals are aggregated by the database, grouped by duration so per-row rounding can still be
+    applied exactly, rather than loading every performance and leave date. Only work hours and holidays, which depend
+    on employment contracts and work schedules, are determined in Python.
+
+    """
+    res = {}
+
+    # Only employment contracts and holidays are used from the calendar context
+    context = context if context else CalendarContext(users, from_date, until_date)
+    context.ensure_covers(from_date, until_date)
+    holiday_data = context.holiday_data
+
+    for user in users:
+        # Work hours for the entire range are determined per employment contract rather than per day
+        res[user.id] = UserRangeResult(work_hours=context.get_work_hours(user.id, from_date, until_date))
+
+    # Holidays
+    for current_date, country_holidays in holiday_data.items():
+        if (current_date < from_date) or (current_date > until_date):
+            continue
+
+        for user in users:
+            employment_contract = context.get_employment_contract(user.id, current_date)
+            if employment_contract and employment_contract.work_schedule and \
+                    country_holidays.get(str(employment_contract.company.country), None):
+                res[user.id].holiday_hours += employment_contract.work_schedule.get_hours_for_date(current_date)
+
+    # Leave, grouped by leave date length
+    leave_dates = (models.LeaveDate.objects
+                   .filter(leave__user__in=users,
+                           leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                           starts_at__date__gte=from_date, starts_at__date__lte=until_date)
+                   .annotate(length=ExpressionWrapper(F('ends_at') - F('starts_at'), output_field=DurationField()))
+                   .order_by()
+                   .values('leave__user_id', 'leave__status', 'length')
+                   .annotate(count=Count('id')))
+    for leave_date in leave_dates:
+        # Leave date durations are rounded per leave date
+        duration = Decimal(str(round(leave_date['length'].total_seconds() / 3600, 2))) * leave_date['count']
+        if leave_date['leave__status'] == models.STATUS_APPROVED:
+            res[leave_date['leave__user_id']].leave_hours += duration
+        else:
+            res[leave_date['leave__user_id']].pending_leave_hours += duration
+
+    # Activity performance, grouped by contract, duration and performance type
+    reference_data = caching.get_reference_data()
+    contract_performances = {}
+    activity_performances = (models.ActivityPerformance.objects
+                             .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
+                             .order_by()
+                             .values('timesheet__user_id', 'contract_id', 'duration', 'performance_type_id')
+                             .annotate(count=Count('id')))
+    for performance in activity_performances:
+        # Performance durations are normalized per performance
+        multiplier = reference_data.get_multiplier(performance['performance_type_id'])
+        duration = round(performance['duration'] * multiplier, 2) * performance['count']
+        res[performance['timesheet__user_id']].performed_hours += duration
+        (contract_performances
+            .setdefault(performance['timesheet__user_id'], {})
+            .setdefault(performance['contract_id'], {'duration': 0, 'standby_days': 0}))['duration'] += duration
+
+    # Standby performance, counted per contract
+    if summary:
+        standby_performances = (models.StandbyPerformance.objects
+                                .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
+                                .order_by()
+                                .values('timesheet__user_id', 'contract_id')
+                                .annotate(count=Count('id')))
+        for performance in standby_performances:
+            (contract_performances
+                .setdefault(performance['timesheet__user_id'], {})
+                .setdefault(performance['contract_id'], {'duration': 0, 'standby_days': 0}))['standby_days'] += \
+                performance['count']
+
+        contracts = (models.Contract.objects
+                     .non_polymorphic()
+                     .filter(id__in=set([y for x in contract_performances.values() for y in x.keys()]))
+                     .select_related('customer', 'company'))
+        contracts = {x.id: x for x in contracts}
+
+    for user in users:
+        user_res = res[user.id]
+        user_res.update_totals()
+
+        if summary:
+            user_res.summary = {'performances': [{
+                'contract': (projections.project(serializers.MinimalContractSerializer, contracts[contract_id])
+                             if serialize else contracts[contract_id]),
+                'duration': contract_performance['duration'],
+                'standby_days': contract_performance['standby_days'],
+            } for contract_id, contract_performance in contract_performances.get(user.id, {}).items()]}
+
+        # Serialized results are plain dicts
+        if serialize:
+            res[user.id] = user_res.to_dict()
+
+    return res
+
+
+def iter_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False,
+                    chunk_size=None):
+    """
+    Determine range info one user at a time, yielding (user, range info) pairs.
+
+    Calendar data is fetched per chunk of users rather than for all users at once, so memory use is bounded by the
+    chunk size instead of the amount of users.
+
+    """
+    for chunk in iter_user_chunks(users, chunk_size):
+        res = get_range_info(chunk, from_date, until_date, daily=daily, detailed=detailed, summary=summary,
+                             serialize=serialize)
+        for user in chunk:
+            yield user, res.pop(user.id)
+
+
+def get_range_info_for_periods(periods, daily=False, detailed=False, summary=False, serialize=False):
+    """
+    Determine and return range info for multiple periods.
+
+    Periods are (user, from_date, until_date) tuples. Periods sharing the same date range are calculated together,
+    so calendar data is fetched once per date range rather than once per period. Results are indexed by
+    (user ID, from date, until date).
+
+    """
+    res = {}
+
+    # Group users by date range
+    range_users = {}
+    for user, from_date, until_date in periods:
+        range_users.setdefault((from_date, until_date), {})[user.id] = user
+
+    for (from_date, until_date), users in range_users.items():
+        range_info = calculate_sharded(get_range_info, list(users.values()), from_date, until_date, daily=daily,
+                                       detailed=detailed, summary=summary, serialize=serialize)
+        for user_id, user_range_info in range_info.items():
+            res[(user_id, from_date, until_date)] = user_range_info
 
     return res
@@ -0,0 +1,366 @@
+"""
+NumPy calculation engine.
+
+Represents calendar data as dense (users x days) arrays of hundredths of hours, so totals can be determined using
+vector operations rather than nested loops. All hours involved have two decimal places, so integer hundredths keep
+results exact; they are converted back to decimals when building results.
+
+"""
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Q
+from ninetofiver import caching, calculation, models
+from ninetofiver.api_v2 import projections, serializers
+from ninetofiver.utils import AvailabilityInfo, DateSegmentIndex
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+EmploymentContractRow = namedtuple('EmploymentContractRow', ['started_at', 'ended_at', 'country', 'weekday_hours'])
+
+
+def to_hundredths(hours):
+    """Convert an amount of hours with (at most) two decimal places to hundredths of hours."""
+    return int(Decimal(hours) * 100)
+
+
+def to_hours(hundredths):
+    """Convert hundredths of hours to a decimal amount of hours."""
+    return Decimal(int(hundredths)).scaleb(-2)
+
+
+def get_employment_contract_row(employment_contract):
+    """Get the row for the given employment contract, along with the hours of its work schedule per weekday."""
+    if isinstance(employment_contract, EmploymentContractRow):
+        return employment_contract
+
+    country = employment_contract.company.country
+    return EmploymentContractRow(employment_contract.started_at, employment_contract.ended_at,
+                                 str(country) if country else None,
+                                 np.array([to_hundredths(getattr(employment_contract.work_schedule, x))
+                                           for x in models.WEEKDAYS], dtype=np.int64))
+
+
+class CalendarArrays(object):
+    """
+    Dense (users x days) arrays of calendar data for a set of users and a date range.
+
+    Calendar data is queried as plain values, unless a calendar context is given, in which case the data it holds
+    (or loads) is used instead, so it can be shared with other calculations.
+
+    """
+
+    def __init__(self, users, from_date, until_date, context=None):
+        """Constructor."""
+        self.users = list(users)
+        self.user_indexes = {user.id: i for i, user in enumerate(self.users)}
+        self.from_date = from_date
+        self.until_date = until_date
+        self.day_count = max(0, (until_date - from_date).days + 1)
+        self.context = context
+
+        if context:
+            context.ensure_covers(from_date, until_date)
+
+        shape = (len(self.users), self.day_count)
+        self.work = np.zeros(shape, dtype=np.int64)
+        self.holiday = np.zeros(shape, dtype=bool)
+
+        self._load_work_and_holidays()
+
+    def get_day_index(self, date):
+        """Get the index of the given date on the day axis."""
+        return (date - self.from_date).days
+
+    def get_day_keys(self):
+        """Get the keys days are reported under, ordered along the day axis."""
+        return [str(self.from_date + timedelta(days=i)) for i in range(self.day_count)]
+
+    def iter_context_data(self, data):
+        """
+        Iterate over (user ID, item) pairs of calendar context data, indexed by date, then by user ID.
+
+        Only items of the users and date range of these arrays are included.
+
+        """
+        for date, user_data in data.items():
+            if (date < self.from_date) or (date > self.until_date):
+                continue
+
+            for user_id, items in user_data.items():
+                if user_id in self.user_indexes:
+                    for item in items:
+                        yield user_id, item
+
+    def _load_employment_contract_indexes(self):
+        """Load employment contracts, indexed by user ID, then by date segment."""
+        if self.context:
+            return self.context.employment_contract_index
+
+        employment_contracts = (models.EmploymentContract.objects
+                                .filter(
+                                    (Q(ended_at__isnull=True) & Q(started_at__lte=self.until_date)) |
+                                    (Q(started_at__lte=self.until_date) & Q(ended_at__gte=self.from_date)),
+                                    user__in=self.users)
+                                .order_by('started_at')
+                                .values_list('user_id', 'started_at', 'ended_at', 'company__country',
+                                             *['work_schedule__%s' % x for x in models.WEEKDAYS]))
+        employment_contract_data = {}
+        for row in employment_contracts:
+            (employment_contract_data
+                .setdefault(row[0], [])
+                .append(EmploymentContractRow(row[1], row[2], str(row[3]) if row[3] else None,
+                                              np.array([to_hundredths(x) for x in row[4:]], dtype=np.int64))))
+
+        return {user_id: DateSegmentIndex(user_employment_contracts, start_attr='started_at', end_attr='ended_at')
+                for user_id, user_employment_contracts in employment_contract_data.items()}
+
+    def _load_work_and_holidays(self):
+        """Load work hours and holidays, based on the employment contract active on each day."""
+        weekdays = (self.from_date.weekday() + np.arange(self.day_count)) % 7
+
+        # Holiday masks, indexed by country
+        holiday_masks = {}
+        holidays = (self.context.holiday_data if self.context else
+                    caching.get_holiday_calendar().get_range(self.from_date, self.until_date))
+        for date, country_holidays in holidays.items():
+            if (date < self.from_date) or (date > self.until_date):
+                continue
+
+            for country in country_holidays.keys():
+                holiday_mask = holiday_masks.setdefault(country, np.zeros(self.day_count, dtype=bool))
+                holiday_mask[self.get_day_index(date)] = True
+
+        for user_id, index in self._load_employment_contract_indexes().items():
+            if user_id not in self.user_indexes:
+                continue
+
+            user_index = self.user_indexes[user_id]
+
+            for segment_from, segment_until, segment_contracts in index.iter_segments(self.from_date,
+                                                                                      self.until_date):
+                if not segment_contracts:
+                    continue
+
+                employment_contract = get_employment_contract_row(segment_contracts[0])
+                start = self.get_day_index(segment_from)
+                end = self.get_day_index(segment_until) + 1
+
+                self.work[user_index, start:end] = employment_contract.weekday_hours[weekdays[start:end]]
+                holiday_mask = (holiday_masks.get(employment_contract.country, None)
+                                if employment_contract.country else None)
+                if holiday_mask is not None:
+                    self.holiday[user_index, start:end] = holiday_mask[start:end]
+
+    def scatter(self, rows):
+        """Scatter (user ID, date, hundredths) rows into a new (users x days) array."""
+        res = np.zeros((len(self.users), self.day_count), dtype=np.int64)
+
+        if rows:
+            user_indexes, day_indexes, values = zip(*[(self.user_indexes[x[0]], self.get_day_index(x[1]), x[2])
+                                                      for x in rows])
+            np.add.at(res, (np.array(user_indexes), np.array(day_indexes)), np.array(values, dtype=np.int64))
+
+        return res
+
+
+def get_range_info(users, from_date, until_date, daily=False, summary=False, serialize=False, context=None):
+    """Determine and return range info."""
+    res = {}
+    arrays = CalendarArrays(users, from_date, until_date, context=context)
+
+    # Leave
+    approved_leave_rows = []
+    pending_leave_rows = []
+    if context:
+        leave_dates = [(user_id, x.starts_at, x.ends_at, x.leave.status)
+                       for user_id, x in arrays.iter_context_data(context.leave_date_data)]
+    else:
+        leave_dates = (models.LeaveDate.objects
+                       .filter(leave__user__in=arrays.users,
+                               leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                               starts_at__date__gte=from_date, starts_at__date__lte=until_date)
+                       .values_list('leave__user_id', 'starts_at', 'ends_at', 'leave__status'))
+    for user_id, starts_at, ends_at, status in leave_dates:
+        # Leave date durations are rounded per leave date
+        duration = to_hundredths(str(round((ends_at - starts_at).total_seconds() / 3600, 2)))
+        row = (user_id, starts_at.date(), duration)
+        (approved_leave_rows if status == models.STATUS_APPROVED else pending_leave_rows).append(row)
+
+    # Activity performance
+    reference_data = caching.get_reference_data()
+    performance_rows = []
+    contract_performances = {}
+    if context:
+        activity_performances = [(user_id, x.date, x.duration, x.performance_type_id, x.contract_id)
+                                 for user_id, x in arrays.iter_context_data(context.activity_performance_data)]
+    else:
+        activity_performances = (models.ActivityPerformance.objects
+                                 .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=arrays.users)
+                                 .values_list('timesheet__user_id', 'date', 'duration', 'performance_type_id',
+                                              'contract_id'))
+    for user_id, date, duration, performance_type_id, contract_id in activity_performances:
+        # Performance durations are normalized per performance
+        duration = to_hundredths(round(duration * reference_data.get_multiplier(performance_type_id), 2))
+        performance_rows.append((user_id, date, duration))
+        if summary:
+            contract_performance = (contract_performances
+                                    .setdefault(user_id, {})
+                                    .setdefault(contract_id, {'duration': 0, 'standby_days': 0}))
+            contract_performance['duration'] += duration
+
+    # Standby performance
+    if summary:
+        if context:
+            standby_performances = [(user_id, x.contract_id)
+                                    for user_id, x in arrays.iter_context_data(context.standby_performance_data)]
+        else:
+            standby_performances = (models.StandbyPerformance.objects
+                                    .filter(date__gte=from_date, date__lte=until_date,
+                                            timesheet__user__in=arrays.users)
+                                    .values_list('timesheet__user_id', 'contract_id'))
+        for user_id, contract_id in standby_performances:
+            (contract_performances
+                .setdefault(user_id, {})
+                .setdefault(contract_id, {'duration': 0, 'standby_days': 0}))['standby_days'] += 1
+
+    work = arrays.work
+    holiday = np.where(arrays.holiday, arrays.work, 0)
+    leave = arrays.scatter(approved_leave_rows)
+    pending_leave = arrays.scatter(pending_leave_rows)
+    performed = arrays.scatter(performance_rows)
+    total = holiday + leave + performed
+
+    # Totals
+    totals = {
+        'work_hours': work.sum(axis=1),
+        'holiday_hours': holiday.sum(axis=1),
+        'leave_hours': leave.sum(axis=1),
+        'pending_leave_hours': pending_leave.sum(axis=1),
+        'performed_hours': performed.sum(axis=1),
+        'total_hours': total.sum(axis=1),
+    }
+    totals['overtime_hours'] = np.maximum(0, totals['total_hours'] - totals['work_hours'])
+    totals['remaining_hours'] = np.maximum(0, totals['work_hours'] - totals['total_hours'])
+    totals = {key: value.tolist() for key, value in totals.items()}
+
+    # Daily values
+    if daily:
+        day_values = {
+            'work_hours': work,
+            'holiday_hours': holiday,
+            'leave_hours': leave,
+            'pending_leave_hours': pending_leave,
+            'performed_hours': performed,
+            'total_hours': total,
+            'overtime_hours': np.maximum(0, total - work),
+            'remaining_hours': np.maximum(0, work - total),
+        }
+        day_values = {key: value.tolist() for key, value in day_values.items()}
+        day_keys = arrays.get_day_keys()
+
+    # Contracts referenced in summaries
+    if summary:
+        contract_ids = set([y for x in contract_performances.values() for y in x.keys() if y])
+        contracts = {x.id: x for x in (models.Contract.objects.non_polymorphic()
+                                       .filter(id__in=contract_ids)
+                                       .select_related('customer', 'company'))}
+
+    for user_index, user in enumerate(arrays.users):
+        user_res = res[user.id] = calculation.UserRangeResult(**{key: to_hours(value[user_index])
+                                                                 for key, value in totals.items()})
+
+        if daily:
+            user_res.details = {day_key: calculation.DayResult(**{key: to_hours(value[user_index][day_index])
+                                                                  for key, value in day_values.items()})
+                                for day_index, day_key in enumerate(day_keys)}
+
+        if summary:
+            user_res.summary = {
+                'performances': [{
+                    'contract': (projections.project(serializers.MinimalContractSerializer, contracts[contract_id])
+                                 if serialize else contracts[contract_id]),
+                    'duration': to_hours(contract_performance['duration']),
+                    'standby_days': contract_performance['standby_days'],
+                } for contract_id, contract_performance in contract_performances.get(user.id, {}).items()
+                    if contract_id],
+            }
+
+        # Serialized results are plain dicts
+        if serialize:
+            res[user.id] = user_res.to_dict()
+
+    return res
+
+
+def get_availability_info(users, from_date, until_date, context=None):
+    """Determine and return availability info."""
+    res = {}
+    arrays = CalendarArrays(users, from_date, until_date, context=context)
+    no_work = (arrays.work <= 0).tolist()
+    holiday = arrays.holiday.tolist()
+
+    # Leave & Sickness tags, indexed by user ID, then by day index
+    reference_data = caching.get_reference_data()
+    sickness_type_ids = reference_data.sickness_leave_type_ids
+    leave_date_data = {}
+    if context:
+        leave_dates = [x for user_id, x in arrays.iter_context_data(context.leave_date_data)]
+    else:
+        leave_dates = (models.LeaveDate.objects
+                       .filter(leave__user__in=arrays.users,
+                               leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                               starts_at__date__gte=from_date, starts_at__date__lte=until_date)
+                       .select_related('leave', 'leave__user'))
+        reference_data.attach([x.leave for x in leave_dates], 'leave_type', models.LeaveType)
+    for leave_date in leave_dates:
+        tag = 'sickness' if leave_date.leave.leave_type_id in sickness_type_ids else 'leave'
+        if leave_date.leave.status != models.STATUS_APPROVED:
+            tag = '%s_pending' % tag
+        (leave_date_data
+            .setdefault(leave_date.leave.user.id, {})
+            .setdefault(arrays.get_day_index(leave_date.starts_at.date()), [])
+            .append((tag, leave_date)))
+
+    # Whereabout tags, indexed by user ID, then by day index
+    whereabout_data = {}
+    if context:
+        whereabouts = [(user_id, x.starts_at, x.location_id)
+                       for user_id, x in arrays.iter_context_data(context.whereabout_data)]
+    else:
+        whereabouts = (models.Whereabout.objects
+                       .filter(timesheet__user__in=arrays.users, starts_at__date__gte=from_date,
+                               starts_at__date__lte=until_date)
+                       .values_list('timesheet__user_id', 'starts_at', 'location_id'))
+    for user_id, starts_at, location_id in whereabouts:
+        location_name = reference_data.get_location_name(location_id)
+        (whereabout_data
+            .setdefault(user_id, {})
+            .setdefault(arrays.get_day_index(starts_at.date()), [])
+            .append('whereabout_%s' % location_name.lower().replace(' ', '_')))
+
+    day_keys = arrays.get_day_keys()
+
+    for user_index, user in enumerate(arrays.users):
+        res[str(user.id)] = user_data = {}
+        user_leave_date_data = leave_date_data.get(user.id, {})
+        user_whereabout_data = whereabout_data.get(user.id, {})
+
+        for day_index, day_key in enumerate(day_keys):
+            user_data[day_key] = user_day_info = AvailabilityInfo()
+
+            if no_work[user_index][day_index]:
+                user_day_info.add_tag('no_work')
+            if holiday[user_index][day_index]:
+                user_day_info.add_tag('holiday')
+            for tag, leave_date in user_leave_date_data.get(day_index, []):
+                user_day_info.leave_dates.append(leave_date)
+                user_day_info.add_tag(tag)
+            for tag in user_whereabout_data.get(day_index, []):
+                user_day_info.add_tag(tag)
+
+    return res
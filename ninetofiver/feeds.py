@@ -37,6 +37,10 @@ class LeaveFeed(BaseFeed):
     title = _('Leave')
     description = _('Leave')
 
+    # Fields items are updated through, including those of related objects shown in them, and the users they belong to
+    validator_fields = ('updated_at', 'leave__updated_at', 'leave__leave_type__updated_at')
+    user_lookup = 'leave__user'
+
     def items(self):
         """Get items."""
         return (models.LeaveDate.objects.all()
@@ -110,6 +114,10 @@ class WhereaboutFeed(BaseFeed):
     title = _('Whereabouts')
     description = _('Whereabouts')
 
+    # Fields items are updated through, including those of related objects shown in them, and the users they belong to
+    validator_fields = ('updated_at', 'location__updated_at')
+    user_lookup = 'timesheet__user'
+
     def items(self):
         """Get items."""
         return (models.Whereabout.objects.all()
@@ -0,0 +1,330 @@
+"""User day ledger and user month summaries."""
+import logging
+from decimal import Decimal
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Max, Min, Q, Sum
+from ninetofiver import calculation, models
+from ninetofiver.utils import month_date_range
+
+
+log = logging.getLogger(__name__)
+
+# Hour fields summed up for ledger totals
+LEDGER_HOUR_FIELDS = ('work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours')
+
+
+def get_user_day_ledger_entries(users, from_date, until_date, dates=None):
+    """
+    Calculate (unsaved) ledger entries for the given users and date range.
+
+    Entries can be limited to given dates, passed as sets of dates indexed by user ID.
+
+    """
+    entries = []
+
+    context = calculation.CalendarContext(users, from_date, until_date)
+    range_info = calculation.get_range_info(users, from_date, until_date, daily=True, context=context)
+    standby_performance_data = context.standby_performance_data
+
+    for user in users:
+        details = range_info[user.id]['details']
+
+        for current_date, day_key in calculation.get_days(from_date, until_date):
+            if (dates is not None) and (current_date not in dates.get(user.id, ())):
+                continue
+
+            day_res = details[day_key]
+            entries.append(models.UserDayLedger(
+                user=user,
+                date=current_date,
+                work_hours=day_res['work_hours'],
+                holiday_hours=day_res['holiday_hours'],
+                leave_hours=day_res['leave_hours'],
+                pending_leave_hours=day_res['pending_leave_hours'],
+                performed_hours=day_res['performed_hours'],
+                standby_count=len(standby_performance_data.get(current_date, {}).get(user.id, [])),
+            ))
+
+    return entries
+
+
+def store_user_day_ledger_entries(entries):
+    """
+    Store the given ledger entries.
+
+    Entries which another request stored in the meantime are left as they are.
+
+    """
+    try:
+        with transaction.atomic():
+            models.UserDayLedger.objects.bulk_create(entries, batch_size=1000)
+    except IntegrityError:
+        for entry in entries:
+            entry.pk = None
+            try:
+                with transaction.atomic():
+                    entry.save()
+            except IntegrityError:
+                pass
+
+
+def ensure_user_day_ledger(periods):
+    """Calculate and store the ledger entries missing for the given (user, from_date, until_date) periods."""
+    users = {user.id: user for user, from_date, until_date in periods}
+    if not users:
+        return
+
+    existing = set(models.UserDayLedger.objects
+                   .filter(user__in=list(users.keys()),
+                           date__gte=min([x[1] for x in periods]), date__lte=max([x[2] for x in periods]))
+                   .values_list('user_id', 'date'))
+
+    missing = {}
+    for user, from_date, until_date in periods:
+        for current_date, day_key in calculation.get_days(from_date, until_date):
+            if (user.id, current_date) not in existing:
+                missing.setdefault(user.id, set()).add(current_date)
+
+    # Users are calculated together when the ranges of their missing days match, sharing calendar data
+    range_users = {}
+    for user_id, dates in missing.items():
+        range_users.setdefault((min(dates), max(dates)), []).append(users[user_id])
+
+    for (from_date, until_date), range_user_list in range_users.items():
+        store_user_day_ledger_entries(get_user_day_ledger_entries(range_user_list, from_date, until_date,
+                                                                  dates=missing))
+
+
+def rebuild_user_day_ledger(user, from_date, until_date):
+    """Rebuild the ledger for the given user and date range from scratch."""
+    entries = get_user_day_ledger_entries([user], from_date, until_date)
+
+    with transaction.atomic():
+        models.UserDayLedger.objects.filter(user=user, date__gte=from_date, date__lte=until_date).delete()
+        store_user_day_ledger_entries(entries)
+
+
+def get_month_filter(from_date, until_date=None):
+    """Get a filter matching the (year, month) pairs of the months within the given date range."""
+    q = Q(year__gt=from_date.year) | Q(year=from_date.year, month__gte=from_date.month)
+    if until_date:
+        q &= Q(year__lt=until_date.year) | Q(year=until_date.year, month__lte=until_date.month)
+
+    return q
+
+
+def invalidate_user_day_ledger(user_ids, from_date, until_date=None, day_ledger=True):
+    """
+    Invalidate the ledger entries and month summaries of the given users within a date range.
+
+    Without an end date, everything from the start date onwards is invalidated. Entries are deleted right away, and
+    once more when the transaction is committed, so entries other requests calculated from the previous data in the
+    meantime are discarded as well. Deleted entries are recalculated when next requested. Pass `day_ledger=False` to
+    only invalidate month summaries.
+
+    """
+    user_ids = [x for x in user_ids if x]
+    if not (user_ids and from_date):
+        return
+
+    def invalidate():
+        if day_ledger:
+            entries = models.UserDayLedger.objects.filter(user_id__in=user_ids, date__gte=from_date)
+            if until_date:
+                entries = entries.filter(date__lte=until_date)
+            entries.delete()
+
+        (models.UserMonthSummary.objects
+            .filter(get_month_filter(from_date, until_date), user_id__in=user_ids)
+            .delete())
+
+    def invalidate_on_commit():
+        # The changes are committed at this point, so failing to invalidate should not fail the request
+        try:
+            invalidate()
+        except DatabaseError:
+            log.exception('Could not invalidate the user day ledger for users %s (%s - %s)' %
+                          (user_ids, from_date, until_date))
+
+    invalidate()
+    transaction.on_commit(invalidate_on_commit)
+
+
+def invalidate_employment_contract(employment_contract):
+    """Invalidate the ledger entries of the days covered by an employment contract."""
+    invalidate_user_day_ledger([employment_contract.user_id], employment_contract.started_at,
+                               employment_contract.ended_at)
+
+
+def invalidate_holiday(date, country):
+    """Invalidate the ledger entries of users affected by a holiday."""
+    user_ids = (models.EmploymentContract.objects
+                .filter(Q(ended_at__isnull=True) | Q(ended_at__gte=date),
+                        company__country=country, started_at__lte=date)
+                .values_list('user_id', flat=True)
+                .distinct())
+
+    invalidate_user_day_ledger(list(user_ids), date, date)
+
+
+def invalidate_performances(performances, day_ledger=True):
+    """Invalidate the ledger entries and month summaries of the days with any of the given performances."""
+    user_ranges = (performances
+                   .order_by()
+                   .values('timesheet__user_id')
+                   .annotate(from_date=Min('date'), until_date=Max('date')))
+
+    for user_range in user_ranges:
+        invalidate_user_day_ledger([user_range['timesheet__user_id']], user_range['from_date'],
+                                   user_range['until_date'], day_ledger=day_ledger)
+
+
+def invalidate_performance_type(performance_type):
+    """Invalidate the ledger entries and month summaries of the days with performances of a performance type."""
+    invalidate_performances(models.ActivityPerformance.objects.filter(performance_type=performance_type))
+
+
+def invalidate_contract(contract):
+    """Invalidate the month summaries of the months with performances for a contract."""
+    invalidate_performances(models.Performance.objects.filter(contract=contract), day_ledger=False)
+
+
+def invalidate_leave_type(leave_type):
+    """Invalidate the month summaries of the months with leave of a leave type."""
+    user_ranges = (models.LeaveDate.objects
+                   .filter(leave__leave_type=leave_type)
+                   .order_by()
+                   .values('leave__user_id')
+                   .annotate(from_date=Min('starts_at'), until_date=Max('starts_at')))
+
+    for user_range in user_ranges:
+        invalidate_user_day_ledger([user_range['leave__user_id']], user_range['from_date'].date(),
+                                   user_range['until_date'].date(), day_ledger=False)
+
+
+def get_user_day_ledger_totals_for_periods(periods):
+    """
+    Get ledger totals for the given (user, from_date, until_date) periods, calculating missing days first.
+
+    Totals are summed by the database, once per distinct date range. Results are indexed by
+    (user ID, from date, until date).
+
+    """
+    periods = list(set(periods))
+    res = {}
+
+    ensure_user_day_ledger(periods)
+
+    range_user_ids = {}
+    for user, from_date, until_date in periods:
+        range_user_ids.setdefault((from_date, until_date), set()).add(user.id)
+
+    for (from_date, until_date), user_ids in range_user_ids.items():
+        sums = (models.UserDayLedger.objects
+                .filter(user_id__in=user_ids, date__gte=from_date, date__lte=until_date)
+                .order_by()
+                .values('user_id')
+                .annotate(standby_count=Sum('standby_count'), **{x: Sum(x) for x in LEDGER_HOUR_FIELDS}))
+        sums = {x['user_id']: x for x in sums}
+
+        for user_id in user_ids:
+            user_sums = sums.get(user_id, {})
+            user_res = res[(user_id, from_date, until_date)] = {}
+
+            for key in LEDGER_HOUR_FIELDS:
+                user_res[key] = user_sums[key] if user_sums.get(key, None) is not None else Decimal('0.00')
+            user_res['standby_count'] = user_sums.get('standby_count', None) or 0
+
+            user_res['total_hours'] = user_res['holiday_hours'] + user_res['leave_hours'] + user_res['performed_hours']
+            user_res['overtime_hours'] = abs(min(0, user_res['work_hours'] - user_res['total_hours']))
+            user_res['remaining_hours'] = max(0, user_res['work_hours'] - user_res['total_hours'])
+
+    return res
+
+
+def get_user_day_ledger_totals(user, from_date, until_date):
+    """Get the ledger totals for the given user and date range, calculating missing days first."""
+    return get_user_day_ledger_totals_for_periods([(user, from_date, until_date)])[(user.id, from_date, until_date)]
+
+
+def get_user_month_summary_entries(periods):
+    """Calculate (unsaved) month summaries for the given (user, year, month) periods."""
+    entries = []
+
+    periods = [(user, year, month, month_date_range(year, month)) for user, year, month in periods]
+    range_info = calculation.get_range_info_for_periods([(user, date_range[0], date_range[1])
+                                                         for user, year, month, date_range in periods], summary=True)
+
+    for user, year, month, date_range in periods:
+        user_range_info = range_info[(user.id, date_range[0], date_range[1])]
+        performances = user_range_info['summary']['performances']
+
+        entries.append(models.UserMonthSummary(
+            user=user,
+            year=year,
+            month=month,
+            work_hours=user_range_info['work_hours'],
+            holiday_hours=user_range_info['holiday_hours'],
+            leave_hours=user_range_info['leave_hours'],
+            pending_leave_hours=user_range_info['pending_leave_hours'],
+            performed_hours=user_range_info['performed_hours'],
+            overtime_hours=user_range_info['overtime_hours'],
+            remaining_hours=user_range_info['remaining_hours'],
+            consultancy_hours=sum([x['duration'] for x in performances
+                                   if x['contract'].get_real_instance_class() == models.ConsultancyContract]),
+            project_hours=sum([x['duration'] for x in performances
+                               if x['contract'].get_real_instance_class() == models.ProjectContract]),
+            support_hours=sum([x['duration'] for x in performances
+                               if x['contract'].get_real_instance_class() == models.SupportContract]),
+            customer_hours=sum([x['duration'] for x in performances
+                                if x['contract'].customer != x['contract'].company]),
+            internal_hours=sum([x['duration'] for x in performances
+                                if x['contract'].customer == x['contract'].company]),
+        ))
+
+    return entries
+
+
+def get_stored_user_month_summaries(periods):
+    """Get the stored month summaries for the given (user, year, month) periods."""
+    periods = set([(user.id, year, month) for user, year, month in periods])
+    summaries = (models.UserMonthSummary.objects
+                 .filter(user__in=set([x[0] for x in periods]),
+                         year__in=set([x[1] for x in periods]),
+                         month__in=set([x[2] for x in periods])))
+
+    return [x for x in summaries if (x.user_id, x.year, x.month) in periods]
+
+
+def get_user_month_summaries(periods):
+    """
+    Get month summaries for the given (user, year, month) periods.
+
+    Summaries which are not stored yet are calculated and stored. Results are indexed by (user ID, year, month).
+
+    """
+    periods = list(set([(user, year, month) for user, year, month in periods]))
+    res = {}
+
+    if not periods:
+        return res
+
+    for summary in get_stored_user_month_summaries(periods):
+        res[(summary.user_id, summary.year, summary.month)] = summary
+
+    missing = [(user, year, month) for user, year, month in periods if (user.id, year, month) not in res]
+    if missing:
+        entries = get_user_month_summary_entries(missing)
+
+        for entry in entries:
+            res[(entry.user.id, entry.year, entry.month)] = entry
+
+        try:
+            with transaction.atomic():
+                models.UserMonthSummary.objects.bulk_create(entries)
+        except IntegrityError:
+            # Another request stored (some of) these summaries in the meantime, which take precedence
+            for summary in get_stored_user_month_summaries(missing):
+                res[(summary.user_id, summary.year, summary.month)] = summary
+
+    return res
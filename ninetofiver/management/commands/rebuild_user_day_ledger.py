@@ -0,0 +1,48 @@
+"""Rebuild the user day ledger."""
+import logging
+import datetime
+from django.core.management.base import BaseCommand
+from django.contrib.auth import models as auth_models
+from django.db.models import Min
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from ninetofiver import ledger
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Rebuild the user day ledger from scratch."""
+
+    args = ''
+    help = 'Rebuild the user day ledger from scratch'
+
+    def add_arguments(self, parser):
+        """Add arguments."""
+        parser.add_argument('--from-date', dest='from_date', default=None,
+                            help='Date to rebuild from, defaults to the start of the first employment contract')
+        parser.add_argument('--until-date', dest='until_date', default=None,
+                            help='Date to rebuild until, defaults to the end of next month')
+        parser.add_argument('--user', dest='users', action='append', type=int, default=[],
+                            help='ID of a user to rebuild the ledger for, defaults to all users')
+
+    def handle(self, *args, **options):
+        """Rebuild the user day ledger from scratch."""
+        from_date = parser.parse(options['from_date']).date() if options['from_date'] else None
+        until_date = (parser.parse(options['until_date']).date() if options['until_date'] else
+                      datetime.date.today().replace(day=1) + relativedelta(months=2) - relativedelta(days=1))
+
+        users = (auth_models.User.objects
+                 .annotate(first_employment_contract_date=Min('employmentcontract__started_at'))
+                 .filter(first_employment_contract_date__isnull=False))
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+
+        for user in users:
+            user_from_date = from_date if from_date else user.first_employment_contract_date
+            if user_from_date > until_date:
+                continue
+
+            log.info('Rebuilding user day ledger for user %s (%s - %s)' % (user, user_from_date, until_date))
+            ledger.rebuild_user_day_ledger(user, user_from_date, until_date)
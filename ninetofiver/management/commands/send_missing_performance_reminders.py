@@ -8,9 +8,8 @@ import calendar
 import datetime
 import requests
 from dateutil.relativedelta import relativedelta
-from ninetofiver import models, settings
+from ninetofiver import ledger, models, settings
 from ninetofiver.utils import send_mail
-from ninetofiver.calculation import get_range_info
 
 
 log = logging.getLogger(__name__)
@@ -28,13 +27,11 @@ class Command(BaseCommand):
         users = (auth_models.User.objects
                  .filter(is_active=True))
          
-        # Get range info for all users for yesterday
+        # Get ledger totals for all users for yesterday
         yesterday = datetime.date.today() - datetime.timedelta(days=1)
-        range_info = get_range_info(users, yesterday, yesterday)
-
+        range_info = ledger.get_user_day_ledger_totals_for_periods([(user, yesterday, yesterday) for user in users])
         for user in users:
-            user_range_info = range_info[user.id]
-
+            user_range_info = range_info[(user.id, yesterday, yesterday)]
             if (not user_range_info['work_hours']) or (user_range_info['remaining_hours'] != user_range_info['work_hours']):
                 log.info('User %s skipped because they were not required to log performance yesterday' % user)
                 continue
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-08-12 09:14
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ninetofiver', '0091_auto_20190730_0859'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDayLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('work_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=6)),
+                ('holiday_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=6)),
+                ('leave_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=6)),
+                ('pending_leave_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=6)),
+                ('performed_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=6)),
+                ('standby_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'date'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='userdayledger',
+            unique_together=set([('user', 'date')]),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-08-14 13:42
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ninetofiver', '0092_userdayledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserMonthSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('month', models.PositiveIntegerField()),
+                ('work_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('holiday_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('leave_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('pending_leave_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('performed_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('overtime_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('remaining_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('consultancy_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('project_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('support_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('customer_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('internal_hours', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=8)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'year', 'month'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='usermonthsummary',
+            unique_together=set([('user', 'year', 'month')]),
+        ),
+    ]
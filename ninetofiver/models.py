@@ -13,6 +13,7 @@ from django.contrib.auth.models import User
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.urls import reverse
 from django.utils.translation import ugettext as _
 from django_countries.fields import CountryField
@@ -62,6 +63,9 @@ PERIOD_YEARLY = 'yearly'
 PERMISSION_RECEIVE_PENDING_LEAVE_REMINDER = 'receive_pending_leave_reminder'
 PERMISSION_RECEIVE_MODIFIED_ATTACHMENT_NOTIFICATION = 'receive_modified_attachment_notification'
 
+# Weekdays, ordered as returned by `date.weekday()`
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
 
 class BaseManager(PolymorphicManager):
     """Base manager."""
@@ -186,7 +190,51 @@ class Company(BaseModel):
         return reverse('ninetofiver_api_v2:download_company_logo', kwargs={'pk': self.pk})
 
 
-class WorkSchedule(BaseModel):
+class WeekdayHoursMixin(object):
+    """Mixin for models defining an amount of hours for each weekday."""
+
+    @property
+    def weekday_hours(self):
+        """Get the hours for each weekday, indexed by `date.weekday()`."""
+        try:
+            return self._weekday_hours
+        except AttributeError:
+            self._weekday_hours = tuple(x if isinstance(x, Decimal) else Decimal(str(x))
+                                        for x in [getattr(self, day) for day in WEEKDAYS])
+            return self._weekday_hours
+
+    def get_hours_for_date(self, date):
+        """Get the hours for the given date."""
+        return self.weekday_hours[date.weekday()]
+
+    def get_hours_for_range(self, from_date, until_date):
+        """Get the total hours for the given (inclusive) date range."""
+        day_count = (until_date - from_date).days + 1
+        if day_count <= 0:
+            return Decimal('0.00')
+
+        # Every full week contributes the hours of the entire week, the remaining days are added separately
+        weeks, remaining_days = divmod(day_count, 7)
+        weekday_hours = self.weekday_hours
+        hours = sum(weekday_hours, Decimal('0.00')) * weeks
+        weekday = from_date.weekday()
+        for i in range(remaining_days):
+            hours += weekday_hours[(weekday + i) % 7]
+
+        return hours
+
+    def save(self, *args, **kwargs):
+        """Save the object."""
+        self.__dict__.pop('_weekday_hours', None)
+        super().save(*args, **kwargs)
+
+    def refresh_from_db(self, *args, **kwargs):
+        """Reload field values from the database."""
+        self.__dict__.pop('_weekday_hours', None)
+        super().refresh_from_db(*args, **kwargs)
+
+
+class WorkSchedule(WeekdayHoursMixin, BaseModel):
 
     """
     Work schedule model.
@@ -905,7 +953,7 @@ class ContractUser(BaseModel):
         return '%s [%s]' % (self.user, self.contract_role)
 
 
-class ContractUserWorkSchedule(BaseModel):
+class ContractUserWorkSchedule(WeekdayHoursMixin, BaseModel):
 
     """
     Contract user work schedule model.
@@ -1219,6 +1267,52 @@ class StandbyPerformance(Performance):
                                       _('Standy performances can only be created for support contracts.')})
 
 
+class PerformanceIterable(ModelIterable):
+    """
+    Iterable yielding activity and standby performances for non-polymorphic performance querysets.
+
+    Performances are taken from their child tables, which are expected to be selected related, so all of them are
+    fetched using a single query. Related objects selected for performances are shared with their child instances.
+
+    """
+
+    child_fields = ('activityperformance', 'standbyperformance')
+
+    def __iter__(self):
+        select_related = self.queryset.query.select_related
+        shared_fields = ([x for x in select_related if x not in self.child_fields]
+                         if isinstance(select_related, dict) else [])
+
+        # django-polymorphic replaces the accessors of child instances with ones which query them, so the child
+        # instances selected along with performances are read from their related object caches instead
+        cache_names = [Performance._meta.get_field(x).get_cache_name() for x in self.child_fields]
+
+        for performance in super().__iter__():
+            child = performance
+
+            for cache_name in cache_names:
+                if performance.__dict__.get(cache_name, None) is not None:
+                    child = performance.__dict__[cache_name]
+                    break
+
+            if child is not performance:
+                for field in shared_fields:
+                    setattr(child, field, getattr(performance, field))
+
+            yield child
+
+
+def join_performance_children(queryset):
+    """Join the child tables of performances to the given queryset, so it yields child instances from one query."""
+    queryset = (queryset
+                .non_polymorphic()
+                .select_related('activityperformance__performance_type', 'activityperformance__contract_role',
+                                'standbyperformance'))
+    queryset._iterable_class = PerformanceIterable
+
+    return queryset
+
+
 class Invoice(BaseModel):
     """Invoice model."""
 
@@ -1352,3 +1446,69 @@ class Training(BaseModel):
         #
         # if validation_error_dict:
         #     raise ValidationError(validation_error_dict)
+
+
+class UserDayLedger(models.Model):
+
+    """
+    User day ledger model.
+
+    Holds the hours derived for a user on a given day, using the same rules as range info calculations. Rows are
+    discarded when the data they are derived from changes, and recalculated when next requested, so totals for a date
+    range can be determined by summing rows rather than recalculating every day.
+
+    """
+
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE)
+    date = models.DateField()
+    work_hours = models.DecimalField(max_digits=6, decimal_places=2, default=Decimal('0.00'))
+    holiday_hours = models.DecimalField(max_digits=6, decimal_places=2, default=Decimal('0.00'))
+    leave_hours = models.DecimalField(max_digits=6, decimal_places=2, default=Decimal('0.00'))
+    pending_leave_hours = models.DecimalField(max_digits=6, decimal_places=2, default=Decimal('0.00'))
+    performed_hours = models.DecimalField(max_digits=6, decimal_places=2, default=Decimal('0.00'))
+    standby_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('user', 'date'),)
+        ordering = ['user', 'date']
+
+    def __str__(self):
+        """Return a string representation."""
+        return '%s - %s' % (self.user, self.date)
+
+
+class UserMonthSummary(models.Model):
+
+    """
+    User month summary model.
+
+    Holds the hours derived for a user for a given month, including a breakdown of performed hours per contract
+    type. Rows are discarded when the data they are derived from changes, and recalculated when next requested.
+
+    """
+
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE)
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    work_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    holiday_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    leave_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    pending_leave_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    performed_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    overtime_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    remaining_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    consultancy_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    project_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    support_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    customer_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    internal_hours = models.DecimalField(max_digits=8, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('user', 'year', 'month'),)
+        ordering = ['user', 'year', 'month']
+
+    def __str__(self):
+        """Return a string representation."""
+        return '%s - %s-%s' % (self.user, self.year, self.month)
@@ -1,4 +1,14 @@
+import base64
+import json
+from collections import OrderedDict
+from functools import reduce
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomizablePageNumberPagination(pagination.PageNumberPagination):
@@ -8,3 +18,115 @@ class CustomizablePageNumberPagination(pagination.PageNumberPagination):
     page_size = 25
     page_size_query_param = 'page_size'
     max_page_size = 1000
+
+
+class KeysetPagination(pagination.BasePagination):
+
+    """
+    Keyset pagination.
+
+    Objects are ordered by a unique key, the `keyset_ordering` of the view, and each page continues after the key of
+    the last object of the previous page, which is passed along as an opaque cursor. No total count is determined, and
+    pages cost the same regardless of how deep they are. Only forward pagination is supported.
+
+    """
+
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_page_size(self, request):
+        """Get the page size for the given request."""
+        try:
+            return pagination._positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                            cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def encode_cursor(self, values):
+        """Encode the given key values as a cursor."""
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, fields):
+        """Decode the key values of the given fields from a cursor."""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            if len(values) != len(fields):
+                raise ValueError()
+
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate the given queryset."""
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', ('id',))
+        fields = [queryset.model._meta.get_field(x) for x in ordering]
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param, None)
+        if cursor:
+            values = self.decode_cursor(cursor, fields)
+            # Continue after the last key: (a, b) > (x, y) equals a > x or (a = x and b > y)
+            queryset = queryset.filter(reduce(lambda x, y: x | y, [
+                Q(**dict([(ordering[j], values[j]) for j in range(i)] + [('%s__gt' % ordering[i], values[i])]))
+                for i in range(len(ordering))
+            ]))
+
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        results = results[:page_size]
+
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = self.encode_cursor([x.value_to_string(results[-1]) for x in fields])
+
+        return results
+
+    def get_next_link(self):
+        """Get the link to the next page."""
+        if not self.next_cursor:
+            return None
+
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        """Get the paginated response."""
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class CustomizablePageNumberOrKeysetPagination(CustomizablePageNumberPagination):
+
+    """
+    Page number pagination which switches to keyset pagination for requests passing a cursor.
+
+    Passing an empty cursor requests the first page.
+
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate the given queryset."""
+        self.keyset_pagination = None
+
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset_pagination = self.keyset_pagination_class()
+            return self.keyset_pagination.paginate_queryset(queryset, request, view=view)
+
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        """Get the paginated response."""
+        if self.keyset_pagination:
+            return self.keyset_pagination.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
@@ -337,6 +337,31 @@ class Base(Configuration):
     # Default starting hour for working days
     DEFAULT_WORKING_DAY_STARTING_HOUR = 9
 
+    # Amount of seconds range info for a month is cached for
+    # Range info is only cached when the default cache is shared between processes (so not a local memory or dummy
+    # cache), which can be configured through CACHES
+    RANGE_INFO_CACHE_TIMEOUT = values.IntegerValue(60 * 60 * 24)
+
+    # Amount of seconds holidays are kept in memory per process for, when the cache is shared between processes
+    HOLIDAY_CALENDAR_TIMEOUT = values.IntegerValue(60 * 60)
+    # Amount of seconds reference data is kept in memory per process for, when the cache is shared between processes
+    REFERENCE_DATA_TIMEOUT = values.IntegerValue(60 * 60)
+
+    # Engine used for range info and availability calculations, either "python" or "numpy" (requires NumPy)
+    CALCULATION_ENGINE = values.Value('python')
+
+    # Amount of users calculations are performed for at once when streaming results
+    CALCULATION_CHUNK_SIZE = values.IntegerValue(25)
+
+    # Amount of worker processes report calculations are spread over, disabled when 1 or less
+    CALCULATION_WORKERS = values.IntegerValue(0)
+
+    # Amount of API keys cached per process, and the amount of seconds they are cached for
+    API_KEY_CACHE_SIZE = values.IntegerValue(1024)
+    API_KEY_CACHE_TIMEOUT = values.IntegerValue(60)
+    # Whether cached API keys are shared between processes through the cache
+    API_KEY_CACHE_SHARED = values.BooleanValue(False)
+
     # Mattermost integration
     MATTERMOST_INCOMING_WEBHOOK_URL = values.Value(None)
     MATTERMOST_PERFORMANCE_REMINDER_NOTIFICATION_ENABLED = values.Value(True)
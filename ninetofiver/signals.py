@@ -2,9 +2,9 @@
 from django_auth_ldap.backend import populate_user
 from django.contrib.auth import models as auth_models
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save, m2m_changed, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_save, m2m_changed, pre_delete
 from django.utils.translation import ugettext_lazy as _
-from ninetofiver import models, notifications
+from ninetofiver import caching, ledger, models, notifications
 from ninetofiver.utils import send_mail, get_users_with_permission
 
 
@@ -38,6 +38,19 @@ def on_user_post_save(sender, instance, created=False, **kwargs):
         user_info = models.UserInfo(user=instance)
         user_info.save()
 
+    # Deactivated users can no longer authenticate using their API keys
+    if not instance.is_active:
+        caching.invalidate_api_key_credentials(list(models.ApiKey.objects
+                                                    .filter(user=instance)
+                                                    .values_list('key', flat=True)))
+
+
+@receiver(post_save, sender=models.ApiKey)
+@receiver(post_delete, sender=models.ApiKey)
+def on_api_key_changed(sender, instance, **kwargs):
+    """Process a change to an API key."""
+    caching.invalidate_api_key_credentials([instance.key])
+
 
 @receiver(pre_save, sender=models.Leave)
 def on_leave_pre_save(sender, instance, created=False, **kwargs):
@@ -201,4 +214,166 @@ def on_attachment_pre_delete(sender, instance, **kwargs):
 
     if timesheets or leaves:
         notifications.send_attachments_modified_notification(attachments=[instance], action='removed',
-                                                             timesheets=timesheets, leaves=leaves)
\ No newline at end of file
+                                                             timesheets=timesheets, leaves=leaves)
+
+
+@receiver(pre_save, sender=models.ActivityPerformance)
+@receiver(pre_save, sender=models.StandbyPerformance)
+def on_performance_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a performance."""
+    # If the performance is moved to another day, the day it was previously on needs its ledger invalidated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        dirty = instance.get_dirty_fields(check_relationship=True)
+        if ('date' in dirty) or ('timesheet' in dirty):
+            user_id = (models.Timesheet.objects.filter(id=dirty.get('timesheet', instance.timesheet_id))
+                       .values_list('user_id', flat=True).first())
+            ledger.invalidate_user_day_ledger([user_id], dirty.get('date', instance.date),
+                                              dirty.get('date', instance.date))
+            caching.bump_range_info_version(user_id, dirty.get('date', instance.date))
+
+
+@receiver(post_save, sender=models.ActivityPerformance)
+@receiver(post_save, sender=models.StandbyPerformance)
+@receiver(post_delete, sender=models.ActivityPerformance)
+@receiver(post_delete, sender=models.StandbyPerformance)
+def on_performance_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a performance."""
+    ledger.invalidate_user_day_ledger([instance.timesheet.user_id], instance.date, instance.date)
+    caching.bump_range_info_version(instance.timesheet.user_id, instance.date)
+
+
+@receiver(pre_save, sender=models.LeaveDate)
+def on_leave_date_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a leave date."""
+    # If the leave date is moved to another day, the day it was previously on needs its ledger invalidated as well
+    if instance.pk and instance.is_dirty():
+        dirty = instance.get_dirty_fields()
+        if dirty.get('starts_at', None):
+            ledger.invalidate_user_day_ledger([instance.timesheet.user_id], dirty['starts_at'].date(),
+                                              dirty['starts_at'].date())
+            caching.bump_range_info_version(instance.timesheet.user_id, dirty['starts_at'].date())
+
+
+@receiver(post_save, sender=models.LeaveDate)
+@receiver(post_delete, sender=models.LeaveDate)
+def on_leave_date_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a leave date."""
+    # The timesheet is used to determine the user, since the leave may already be gone when it is being deleted
+    ledger.invalidate_user_day_ledger([instance.timesheet.user_id], instance.starts_at.date(),
+                                      instance.starts_at.date())
+    caching.bump_range_info_version(instance.timesheet.user_id, instance.starts_at.date())
+
+
+@receiver(pre_save, sender=models.Leave)
+def on_leave_status_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a leave, invalidating the ledger when its status changes."""
+    if instance.pk and instance.is_dirty() and ('status' in instance.get_dirty_fields()):
+        for starts_at in instance.leavedate_set.values_list('starts_at', flat=True):
+            ledger.invalidate_user_day_ledger([instance.user_id], starts_at.date(), starts_at.date())
+            caching.bump_range_info_version(instance.user_id, starts_at.date())
+
+
+@receiver(pre_save, sender=models.Holiday)
+def on_holiday_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a holiday."""
+    if instance.pk and instance.is_dirty():
+        dirty = instance.get_dirty_fields()
+        if ('date' in dirty) or ('country' in dirty):
+            ledger.invalidate_holiday(dirty.get('date', instance.date), dirty.get('country', instance.country))
+            caching.bump_range_info_version()
+
+
+@receiver(post_save, sender=models.Holiday)
+@receiver(post_delete, sender=models.Holiday)
+def on_holiday_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a holiday."""
+    ledger.invalidate_holiday(instance.date, instance.country)
+    caching.bump_range_info_version()
+    caching.invalidate_holiday_calendar()
+
+
+@receiver(pre_save, sender=models.EmploymentContract)
+def on_employment_contract_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for an employment contract."""
+    # The days covered by the employment contract before it changed need their ledger invalidated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        previous = models.EmploymentContract.objects.filter(pk=instance.pk).first()
+        if previous:
+            ledger.invalidate_employment_contract(previous)
+            caching.bump_range_info_version(previous.user_id)
+
+
+@receiver(post_save, sender=models.EmploymentContract)
+@receiver(post_delete, sender=models.EmploymentContract)
+def on_employment_contract_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for an employment contract."""
+    ledger.invalidate_employment_contract(instance)
+    caching.bump_range_info_version(instance.user_id)
+
+
+@receiver(pre_save, sender=models.WorkSchedule)
+def on_work_schedule_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a work schedule."""
+    if instance.pk and instance.is_dirty():
+        for employment_contract in instance.employmentcontract_set.all():
+            ledger.invalidate_employment_contract(employment_contract)
+        caching.bump_range_info_version()
+
+
+@receiver(pre_save, sender=models.Whereabout)
+def on_whereabout_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a whereabout."""
+    if instance.pk and instance.is_dirty():
+        dirty = instance.get_dirty_fields()
+        if dirty.get('starts_at', None):
+            caching.bump_range_info_version(instance.timesheet.user_id, dirty['starts_at'].date())
+
+
+@receiver(post_save, sender=models.Whereabout)
+@receiver(post_delete, sender=models.Whereabout)
+def on_whereabout_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a whereabout."""
+    caching.bump_range_info_version(instance.timesheet.user_id, instance.starts_at.date())
+
+
+@receiver(pre_save, sender=models.PerformanceType)
+def on_performance_type_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a performance type."""
+    # Performed hours depend on performance type multipliers
+    if instance.pk and instance.is_dirty() and ('multiplier' in instance.get_dirty_fields()):
+        ledger.invalidate_performance_type(instance)
+        caching.bump_range_info_version()
+
+
+@receiver(pre_save, sender=models.LeaveType)
+def on_leave_type_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a leave type."""
+    if instance.pk and instance.is_dirty():
+        dirty = instance.get_dirty_fields()
+        if ('sickness' in dirty) or ('overtime' in dirty):
+            ledger.invalidate_leave_type(instance)
+
+
+@receiver(pre_save, sender=models.ProjectContract)
+@receiver(pre_save, sender=models.ConsultancyContract)
+@receiver(pre_save, sender=models.SupportContract)
+def on_contract_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a contract."""
+    # Month summaries break performed hours down by whether the customer is the company itself
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        dirty = instance.get_dirty_fields(check_relationship=True)
+        if ('customer' in dirty) or ('company' in dirty):
+            ledger.invalidate_contract(instance)
+
+
+@receiver(post_save, sender=models.LeaveType)
+@receiver(post_delete, sender=models.LeaveType)
+@receiver(post_save, sender=models.PerformanceType)
+@receiver(post_delete, sender=models.PerformanceType)
+@receiver(post_save, sender=models.Location)
+@receiver(post_delete, sender=models.Location)
+@receiver(post_save, sender=models.ContractRole)
+@receiver(post_delete, sender=models.ContractRole)
+def on_reference_data_changed(sender, instance, **kwargs):
+    """Process post-save and post-delete events for reference data."""
+    caching.invalidate_reference_data(sender)
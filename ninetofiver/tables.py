@@ -13,7 +13,7 @@ from django.utils.translation import ugettext_lazy as _
 from django_tables2.export.export import TableExport
 from django_tables2.utils import A
 
-from ninetofiver import models
+from ninetofiver import caching, models
 from ninetofiver.utils import month_date_range, format_duration, dates_in_range
 
 
@@ -487,7 +487,7 @@ class UserLeaveOverviewTable(BaseTable):
         """Constructor."""
         # Create an additional column for every leave type
         extra_columns = []
-        for leave_type in models.LeaveType.objects.order_by('name'):
+        for leave_type in sorted(caching.get_reference_data().get_all(models.LeaveType), key=lambda x: x.name):
             column = SummedHoursColumn(accessor=A('leave_type_hours.%s' % leave_type.name))
             extra_columns.append([leave_type.name, column])
         kwargs['extra_columns'] = extra_columns
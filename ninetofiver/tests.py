@@ -1,12 +1,20 @@
+from django.core import signing
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_assured import testcases
 from django.utils.timezone import utc
-from ninetofiver import factories, models
+from unittest import mock, skipIf
+from ninetofiver import caching, calculation, calculation_numpy, factories, ledger, models
+from ninetofiver.api_v2 import projections, serializers
+from ninetofiver.utils import DateSegmentIndex, dates_in_range
 from decimal import Decimal
 from datetime import timedelta
+from types import SimpleNamespace
 import logging
+import os
 import tempfile
 import datetime
 
@@ -246,3 +254,531 @@ class AdminReportViewTests(AuthenticatedAPITestCase):
         """Test the project contract budget overview report view."""
         response = self.client.get(reverse('admin_report_project_contract_budget_overview'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class DateSegmentIndexTests(SimpleTestCase):
+    """Date segment index tests."""
+
+    def test_lookup(self):
+        """Test looking up the items covering a date."""
+        first = models.ContractUserWorkSchedule(starts_at=datetime.date(2019, 1, 1),
+                                                ends_at=datetime.date(2019, 1, 31))
+        second = models.ContractUserWorkSchedule(starts_at=datetime.date(2019, 1, 15), ends_at=None)
+        index = DateSegmentIndex([first, second])
+
+        self.assertEqual(index.get(datetime.date(2018, 12, 31)), ())
+        self.assertEqual(index.get(datetime.date(2019, 1, 1)), (first,))
+        self.assertEqual(index.get(datetime.date(2019, 1, 20)), (first, second))
+        self.assertEqual(index.get(datetime.date(2019, 2, 1)), (second,))
+        self.assertEqual(index.get(datetime.date(2019, 1, 10)), (first,))
+        self.assertEqual(index.first(datetime.date(2030, 1, 1)), second)
+
+
+class ResultRecordTests(SimpleTestCase):
+    """Result record tests."""
+
+    def test_access(self):
+        """Test attribute and dict-style access to result records."""
+        day_res = calculation.DayResult()
+        day_res.work_hours += Decimal('8.00')
+        day_res['performed_hours'] = Decimal('3.00')
+        day_res.update_totals()
+
+        self.assertEqual(day_res['remaining_hours'], Decimal('5.00'))
+        self.assertEqual(day_res.total_hours, Decimal('3.00'))
+        self.assertNotIn('leaves', day_res)
+        self.assertRaises(KeyError, lambda: day_res['leaves'])
+
+        user_res = calculation.UserRangeResult(work_hours=Decimal('8.00'), details={'2018-03-01': day_res})
+        self.assertEqual(user_res.to_dict()['details']['2018-03-01'], dict(day_res))
+        self.assertEqual(user_res, user_res.to_dict())
+        self.assertNotIn('summary', user_res.to_dict())
+
+
+def get_shard_info(users, context=None):
+    """Get the ID of the process calculating for the given users, and the employment contracts of their context."""
+    return {x.id: (os.getpid(), context.employment_contract_index) for x in users}
+
+
+class UserShardTests(SimpleTestCase):
+    """User shard tests."""
+
+    def test_shards(self):
+        """Test splitting users into shards."""
+        self.assertEqual(calculation.get_user_shards(range(10), 4), [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        self.assertEqual(calculation.get_user_shards(range(2), 4), [[0], [1]])
+        self.assertEqual(calculation.get_user_shards([], 4), [])
+
+    @mock.patch.object(calculation.settings, 'CALCULATION_CHUNK_SIZE', 1)
+    @mock.patch.object(calculation.settings, 'CALCULATION_WORKERS', 2)
+    def test_sharded(self):
+        """Test calculating in a process pool, with a calendar context split per shard."""
+        users = [SimpleNamespace(id=x) for x in range(1, 5)]
+        context = calculation.CalendarContext(users, datetime.date(2018, 3, 1), datetime.date(2018, 3, 31))
+        context.__dict__['employment_contract_index'] = {x.id: 'contract %s' % x.id for x in users}
+        self.addCleanup(calculation.shutdown_executor)
+
+        res = calculation.calculate_sharded(get_shard_info, users, context=context)
+        self.assertEqual(res, {
+            1: (res[1][0], {1: 'contract 1', 2: 'contract 2'}),
+            2: (res[1][0], {1: 'contract 1', 2: 'contract 2'}),
+            3: (res[3][0], {3: 'contract 3', 4: 'contract 4'}),
+            4: (res[3][0], {3: 'contract 3', 4: 'contract 4'}),
+        })
+        self.assertNotEqual(res[1][0], os.getpid())
+        self.assertNotEqual(res[3][0], os.getpid())
+
+        executor = calculation.get_executor()
+        calculation.calculate_sharded(get_shard_info, users, context=context)
+        self.assertIs(calculation.get_executor(), executor)
+
+
+class CalendarDataTestMixin:
+    """This test case mixin sets up calendar data for a user for March 2018."""
+
+    def setUp(self):
+        super().setUp()
+        self.from_date = datetime.date(2018, 3, 1)
+        self.until_date = datetime.date(2018, 3, 31)
+
+        company = factories.InternalCompanyFactory.create(country='BE')
+        work_schedule = factories.WorkScheduleFactory.create(monday=8, tuesday=8, wednesday=8, thursday=8, friday=6,
+                                                             saturday=0, sunday=0)
+        factories.EmploymentContractFactory.create(user=self.user, company=company, work_schedule=work_schedule,
+                                                   employment_contract_type=factories.EmploymentContractTypeFactory(),
+                                                   started_at=datetime.date(2018, 1, 1), ended_at=None)
+        factories.HolidayFactory.create(date=datetime.date(2018, 3, 5), country='BE')
+
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2018, month=3)
+        contract = factories.ProjectContractFactory.create(active=True, company=company)
+        contract_role = factories.ContractRoleFactory.create()
+        factories.ContractUserFactory.create(user=self.user, contract=contract, contract_role=contract_role)
+        performance_type = factories.PerformanceTypeFactory.create(multiplier=Decimal('1.50'))
+        for day, duration in [(6, Decimal('7.50')), (7, Decimal('8.00')), (7, Decimal('1.25'))]:
+            factories.ActivityPerformanceFactory.create(timesheet=timesheet, contract=contract,
+                                                        contract_role=contract_role, performance_type=performance_type,
+                                                        date=datetime.date(2018, 3, day), duration=duration)
+
+        leave = factories.LeaveFactory.create(user=self.user, leave_type=factories.LeaveTypeFactory.create(),
+                                              status=models.STATUS_APPROVED)
+        factories.LeaveDateFactory.create(leave=leave, timesheet=timesheet,
+                                          starts_at=datetime.datetime(2018, 3, 8, 9, 0, 1, tzinfo=utc),
+                                          ends_at=datetime.datetime(2018, 3, 8, 13, 0, 0, tzinfo=utc))
+
+
+class UserDayLedgerTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """User day ledger tests."""
+
+    def test_totals(self):
+        """Test whether ledger totals match range info."""
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date)[self.user.id]
+        totals = ledger.get_user_day_ledger_totals(self.user, self.from_date, self.until_date)
+
+        for key in ['work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                    'total_hours', 'overtime_hours', 'remaining_hours']:
+            self.assertEqual(totals[key], range_info[key])
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 31)
+
+    def test_rebuild_command(self):
+        """Test the rebuild user day ledger command."""
+        call_command('rebuild_user_day_ledger', from_date='2018-03-01', until_date='2018-03-31')
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 31)
+
+    def test_month_summary(self):
+        """Test whether month summaries match range info."""
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date)[self.user.id]
+        summary = ledger.get_user_month_summaries([(self.user, 2018, 3)])[(self.user.id, 2018, 3)]
+
+        for key in ['work_hours', 'holiday_hours', 'leave_hours', 'performed_hours', 'overtime_hours',
+                    'remaining_hours']:
+            self.assertEqual(getattr(summary, key), range_info[key])
+        self.assertEqual(summary.project_hours, range_info['performed_hours'])
+        self.assertEqual(models.UserMonthSummary.objects.filter(user=self.user).count(), 1)
+
+    def test_month_summary_conflict(self):
+        """Test whether summaries stored by another request take precedence over calculated ones."""
+        stored = models.UserMonthSummary.objects.create(user=self.user, year=2018, month=3,
+                                                        work_hours=Decimal('1.00'))
+
+        with mock.patch.object(ledger, 'get_stored_user_month_summaries',
+                               side_effect=[[], ledger.get_stored_user_month_summaries([(self.user, 2018, 3)])]):
+            summary = ledger.get_user_month_summaries([(self.user, 2018, 3)])[(self.user.id, 2018, 3)]
+
+        self.assertEqual(summary.pk, stored.pk)
+        self.assertEqual(summary.work_hours, Decimal('1.00'))
+
+
+class ShardedCalculationTests(CalendarDataTestMixin, TransactionTestCase):
+    """Sharded calculation tests, which run outside of a transaction so a process pool is used."""
+
+    def setUp(self):
+        self.user = factories.UserFactory()
+        super().setUp()
+        self.addCleanup(calculation.shutdown_executor)
+
+    @mock.patch.object(calculation.settings, 'CALCULATION_CHUNK_SIZE', 1)
+    @mock.patch.object(calculation.settings, 'CALCULATION_WORKERS', 2)
+    def test_range_info(self):
+        """Test whether range info calculated in a process pool matches range info calculated in process."""
+        users = [self.user, factories.UserFactory()]
+        expected = calculation.get_range_info(users, self.from_date, self.until_date, daily=True, serialize=True)
+
+        # Test databases live in memory, so worker processes can only calculate from data loaded up front
+        context = calculation.CalendarContext(users, self.from_date, self.until_date)
+        context.load(*(context.SHARED_DATA + context.USER_DATA + context.DATE_USER_DATA))
+
+        with mock.patch.object(calculation, 'get_executor', wraps=calculation.get_executor) as get_executor:
+            res = calculation.calculate_sharded(calculation.get_range_info, users, self.from_date, self.until_date,
+                                                daily=True, serialize=True, context=context)
+            self.assertTrue(get_executor.called)
+
+        self.assertEqual(res, expected)
+        self.assertEqual(res[self.user.id]['performed_hours'], Decimal('25.13'))
+
+
+class UserDayLedgerInvalidationTests(CalendarDataTestMixin, TransactionTestCase):
+    """User day ledger invalidation tests, which commit their changes so on-commit invalidation is performed."""
+
+    def setUp(self):
+        self.user = factories.UserFactory()
+        super().setUp()
+
+    def assertTotalsMatchRangeInfo(self):
+        """Assert the ledger totals match freshly calculated range info."""
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date)[self.user.id]
+        totals = ledger.get_user_day_ledger_totals(self.user, self.from_date, self.until_date)
+
+        for key in ['work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                    'total_hours', 'overtime_hours', 'remaining_hours']:
+            self.assertEqual(totals[key], range_info[key])
+
+    def test_performance_changed(self):
+        """Test whether changing a performance invalidates the day it is on."""
+        self.assertTotalsMatchRangeInfo()
+
+        existing = models.ActivityPerformance.objects.first()
+        performance = factories.ActivityPerformanceFactory.create(
+            timesheet=existing.timesheet, contract=existing.contract, contract_role=existing.contract_role,
+            performance_type=existing.performance_type, date=datetime.date(2018, 3, 20), duration=Decimal('2.00'))
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 30)
+        self.assertFalse(models.UserDayLedger.objects.filter(user=self.user, date=performance.date).exists())
+        self.assertTotalsMatchRangeInfo()
+
+        performance.date = datetime.date(2018, 3, 21)
+        performance.save()
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 29)
+        self.assertTotalsMatchRangeInfo()
+
+    def test_work_schedule_changed(self):
+        """Test whether changing the work schedule of an open-ended employment contract invalidates all its days."""
+        self.assertTotalsMatchRangeInfo()
+        ledger.get_user_day_ledger_totals(self.user, datetime.date(2018, 6, 1), datetime.date(2018, 6, 30))
+
+        work_schedule = models.EmploymentContract.objects.get(user=self.user).work_schedule
+        work_schedule.friday = Decimal('8.00')
+        work_schedule.save()
+        self.assertFalse(models.UserDayLedger.objects.filter(user=self.user).exists())
+        self.assertTotalsMatchRangeInfo()
+
+    def test_performance_type_changed(self):
+        """Test whether changing a performance type multiplier invalidates the days and months it is used in."""
+        self.assertTotalsMatchRangeInfo()
+        ledger.get_user_month_summaries([(self.user, 2018, 3)])
+
+        performance_type = models.ActivityPerformance.objects.first().performance_type
+        performance_type.multiplier = Decimal('2.00')
+        performance_type.save()
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 29)
+        self.assertFalse(models.UserMonthSummary.objects.filter(user=self.user).exists())
+        self.assertTotalsMatchRangeInfo()
+
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date)[self.user.id]
+        summary = ledger.get_user_month_summaries([(self.user, 2018, 3)])[(self.user.id, 2018, 3)]
+        self.assertEqual(summary.performed_hours, range_info['performed_hours'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RangeInfoCacheTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Range info cache tests."""
+
+    def test_cached_range_info(self):
+        """Test whether range info assembled from cached months matches calculated range info."""
+        from_date = datetime.date(2018, 2, 15)
+        until_date = datetime.date(2018, 4, 10)
+        expected = calculation.get_range_info([self.user], from_date, until_date, daily=True, detailed=True,
+                                              summary=True, serialize=True)[self.user.id]
+
+        for i in range(2):
+            with mock.patch.object(caching, 'is_cache_shared', return_value=True):
+                res = caching.get_range_info(self.user, from_date, until_date, daily=True, detailed=True,
+                                             summary=True)
+            for key in ['work_hours', 'holiday_hours', 'leave_hours', 'performed_hours', 'overtime_hours',
+                        'remaining_hours']:
+                self.assertEqual(res[key], expected[key])
+            self.assertEqual(res['details'], expected['details'])
+            self.assertEqual(res['summary']['performances'], list(expected['summary']['performances']))
+
+    def test_shared_cache(self):
+        """Test whether range info is only cached when the cache is shared between processes."""
+        self.assertFalse(caching.is_cache_shared())
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': directory}}):
+                self.assertTrue(caching.is_cache_shared())
+
+
+class HolidayCalendarTests(AuthenticatedAPITestCase):
+    """Holiday calendar tests."""
+
+    def test_lookup(self):
+        """Test looking up holidays, and invalidating the calendar when holidays change."""
+        holiday = factories.HolidayFactory.create(date=datetime.date(2018, 3, 5), country='BE')
+        calendar = caching.get_holiday_calendar()
+
+        self.assertTrue(calendar.is_holiday('BE', datetime.date(2018, 3, 5)))
+        self.assertFalse(calendar.is_holiday('NL', datetime.date(2018, 3, 5)))
+        self.assertFalse(calendar.is_holiday('BE', datetime.date(2018, 3, 6)))
+        self.assertEqual(calendar.get_range(datetime.date(2018, 1, 1), datetime.date(2019, 12, 31)),
+                         {datetime.date(2018, 3, 5): {'BE': [holiday]}})
+
+        holiday.delete()
+        calendar = caching.get_holiday_calendar()
+        self.assertFalse(calendar.is_holiday('BE', datetime.date(2018, 3, 5)))
+
+    def test_process_calendar(self):
+        """Test keeping the holiday calendar in memory, which requires a cache shared between processes."""
+        self.assertIsNot(caching.get_holiday_calendar(), caching.get_holiday_calendar())
+
+        with mock.patch.object(caching, 'is_cache_shared', return_value=True):
+            calendar = caching.get_holiday_calendar()
+            self.assertIs(caching.get_holiday_calendar(), calendar)
+
+            calendar.expires_at -= caching.settings.HOLIDAY_CALENDAR_TIMEOUT
+            self.assertTrue(calendar.is_expired())
+            self.assertIsNot(caching.get_holiday_calendar(), calendar)
+
+            calendar = caching.get_holiday_calendar()
+            factories.HolidayFactory.create(date=datetime.date(2018, 3, 5), country='BE')
+            self.assertIsNot(caching.get_holiday_calendar(), calendar)
+
+
+class ReferenceDataRegistryTests(AuthenticatedAPITestCase):
+    """Reference data registry tests."""
+
+    def test_lookup(self):
+        """Test looking up reference data, and invalidating the registry when reference data changes."""
+        sickness = factories.LeaveTypeFactory.create(sickness=True)
+        performance_type = factories.PerformanceTypeFactory.create(multiplier=Decimal('1.50'))
+        registry = caching.get_reference_data()
+
+        self.assertIn(sickness.id, registry.sickness_leave_type_ids)
+        self.assertEqual(registry.get_multiplier(performance_type.id), Decimal('1.50'))
+
+        performance_type.multiplier = Decimal('2.00')
+        performance_type.save()
+        sickness.delete()
+        registry = caching.get_reference_data()
+
+        self.assertEqual(registry.get_multiplier(performance_type.id), Decimal('2.00'))
+        self.assertNotIn(sickness.id, registry.sickness_leave_type_ids)
+
+    def test_process_registry(self):
+        """Test keeping the registry in memory, which requires a cache shared between processes."""
+        self.assertIsNot(caching.get_reference_data(), caching.get_reference_data())
+
+        with mock.patch.object(caching, 'is_cache_shared', return_value=True):
+            registry = caching.get_reference_data()
+            self.assertIs(caching.get_reference_data(), registry)
+
+            registry.expires_at -= caching.settings.REFERENCE_DATA_TIMEOUT
+            self.assertTrue(registry.is_expired())
+            self.assertIsNot(caching.get_reference_data(), registry)
+
+            registry = caching.get_reference_data()
+            factories.LocationFactory.create()
+            self.assertIsNot(caching.get_reference_data(), registry)
+
+
+class RangeInfoDeltaTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Range info delta tests."""
+
+    def test_delta(self):
+        """Test whether range info deltas only include the days of changed months."""
+        from_date = datetime.date(2018, 2, 1)
+        res = caching.get_range_info_delta(self.user, from_date, self.until_date)
+        self.assertFalse(res['delta'])
+        self.assertEqual(len(res['details']), 59)
+
+        res = caching.get_range_info_delta(self.user, from_date, self.until_date, token=res['token'])
+        self.assertTrue(res['delta'])
+        self.assertEqual(res['details'], {})
+
+        existing = models.ActivityPerformance.objects.first()
+        performance = factories.ActivityPerformanceFactory.create(
+            timesheet=existing.timesheet, contract=existing.contract, contract_role=existing.contract_role,
+            performance_type=existing.performance_type, date=datetime.date(2018, 3, 20), duration=Decimal('2.00'))
+        expected = calculation.get_range_info([self.user], from_date, self.until_date, daily=True,
+                                              serialize=True)[self.user.id]
+
+        res = caching.get_range_info_delta(self.user, from_date, self.until_date, token=res['token'])
+        self.assertTrue(res['delta'])
+        march = [str(x) for x in dates_in_range(self.from_date, self.until_date)]
+        self.assertEqual(sorted(res['details'].keys()), march)
+        self.assertEqual(res['details']['2018-03-20'], expected['details']['2018-03-20'])
+        self.assertEqual(res['performed_hours'], expected['performed_hours'])
+
+        performance.delete()
+        res = caching.get_range_info_delta(self.user, from_date, self.until_date, token=res['token'])
+        self.assertEqual(len(res['details']), 31)
+        self.assertEqual(res['details']['2018-03-20']['performed_hours'], 0)
+
+    def test_token_size(self):
+        """Test whether tokens hold a fingerprint per month rather than per day."""
+        res = caching.get_range_info_delta(self.user, datetime.date(2018, 1, 1), datetime.date(2018, 12, 31))
+        token = signing.loads(res['token'], salt=caching.RANGE_INFO_DELTA_TOKEN_SALT)
+        self.assertEqual(list(token['fingerprints'].keys()), ['2018-03'])
+
+
+class CompactAvailabilityTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Compact availability tests."""
+
+    def test_flags(self):
+        """Test whether compact availability flags match availability tags."""
+        res = calculation.get_compact_availability([self.user], self.from_date, self.until_date)
+        expected = calculation.get_availability_info([self.user], self.from_date, self.until_date)
+        user_res = res['users'][str(self.user.id)]
+
+        for day_index, (current_date, day_key) in enumerate(calculation.get_days(self.from_date, self.until_date)):
+            tags = [tag for tag, flag in calculation.AVAILABILITY_FLAGS.items() if user_res['days'][day_index] & flag]
+            self.assertEqual(tags, sorted(expected[str(self.user.id)][day_key].day_tags,
+                                          key=list(calculation.AVAILABILITY_FLAGS.keys()).index))
+
+        self.assertEqual(len(res['holidays']), 1)
+        self.assertEqual(len(res['leave_dates']), 1)
+        self.assertEqual(list(user_res['leave_dates'].keys()), [7])
+
+    def test_locations(self):
+        """Test whether whereabout locations are referenced by ID, regardless of the amount of locations."""
+        factories.LocationFactory.create_batch(60)
+        timesheet = models.Timesheet.objects.get(user=self.user, year=2018, month=3)
+        location = factories.LocationFactory.create()
+        factories.WhereaboutFactory.create(timesheet=timesheet, location=location,
+                                           starts_at=datetime.datetime(2018, 3, 9, 9, 0, 0, tzinfo=utc),
+                                           ends_at=datetime.datetime(2018, 3, 9, 17, 0, 0, tzinfo=utc))
+
+        res = calculation.get_compact_availability([self.user], self.from_date, self.until_date)
+        user_res = res['users'][str(self.user.id)]
+
+        self.assertEqual(user_res['locations'], {8: [location.id]})
+        self.assertEqual(res['locations'], {str(location.id): {'id': location.id, 'name': location.name}})
+        self.assertTrue(all(x < (1 << len(calculation.AVAILABILITY_FLAGS)) for x in user_res['days']))
+
+
+class ProjectionTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Projection tests."""
+
+    def test_projection(self):
+        """Test whether projections match the representation of their serializers."""
+        for serializer_class, instances in [
+            (serializers.HolidaySerializer, models.Holiday.objects.all()),
+            (serializers.LeaveSerializer, models.Leave.objects.all()),
+            (serializers.LeaveDateSerializer, models.LeaveDate.objects.all()),
+            (serializers.ActivityPerformanceSerializer, models.ActivityPerformance.objects.all()),
+            (serializers.MinimalContractSerializer, models.Contract.objects.all()),
+        ]:
+            self.assertEqual(projections.project_many(serializer_class, instances),
+                             serializer_class(instances, many=True).data)
+
+
+class RangeInfoTotalsTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Range info totals tests."""
+
+    def test_totals(self):
+        """Test whether totals aggregated by the database match totals calculated per day."""
+        expected = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True,
+                                              summary=True)[self.user.id]
+        res = calculation.get_range_info([self.user], self.from_date, self.until_date, summary=True)[self.user.id]
+
+        self.assertNotIn('details', res)
+        for key in ['work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                    'total_hours', 'overtime_hours', 'remaining_hours']:
+            self.assertEqual(res[key], expected[key])
+        self.assertEqual({x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in res['summary']['performances']},
+                         {x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in expected['summary']['performances']})
+
+
+@skipIf(calculation_numpy.np is None, 'NumPy is not installed')
+class NumpyEngineTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """NumPy calculation engine tests."""
+
+    def test_range_info(self):
+        """Test whether the NumPy engine calculates the same range info as the Python engine."""
+        expected = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True, summary=True,
+                                              engine='python')[self.user.id]
+        res = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True, summary=True,
+                                         engine='numpy')[self.user.id]
+
+        for key in ['work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                    'total_hours', 'overtime_hours', 'remaining_hours']:
+            self.assertEqual(res[key], expected[key])
+        self.assertEqual(res['details'], expected['details'])
+        self.assertEqual({x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in res['summary']['performances']},
+                         {x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in expected['summary']['performances']})
+
+    def test_availability_info(self):
+        """Test whether the NumPy engine determines the same availability info as the Python engine."""
+        expected = calculation.get_availability_info([self.user], self.from_date, self.until_date, engine='python')
+        res = calculation.get_availability_info([self.user], self.from_date, self.until_date, engine='numpy')
+
+        self.assertEqual({day: info.day_tags for day, info in res[str(self.user.id)].items()},
+                         {day: info.day_tags for day, info in expected[str(self.user.id)].items()})
+
+    def test_context(self):
+        """Test whether the NumPy engine calculates the same results from a calendar context."""
+        context = calculation.CalendarContext([self.user], self.from_date - timedelta(days=7), self.until_date)
+        expected = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True, summary=True,
+                                              engine='numpy')[self.user.id]
+        res = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True, summary=True,
+                                         context=context, engine='numpy')[self.user.id]
+
+        self.assertEqual(res['details'], expected['details'])
+        self.assertEqual({x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in res['summary']['performances']},
+                         {x['contract'].id: (x['duration'], x['standby_days'])
+                          for x in expected['summary']['performances']})
+        self.assertIn('activity_performance_data', context.__dict__)
+
+        expected = calculation.get_availability_info([self.user], self.from_date, self.until_date, engine='numpy')
+        res = calculation.get_availability_info([self.user], self.from_date, self.until_date, context=context,
+                                                engine='numpy')
+        self.assertEqual({day: info.day_tags for day, info in res[str(self.user.id)].items()},
+                         {day: info.day_tags for day, info in expected[str(self.user.id)].items()})
+
+
+class PerformanceIterableTests(CalendarDataTestMixin, AuthenticatedAPITestCase):
+    """Performance iterable tests."""
+
+    def test_single_query(self):
+        """Test fetching activity and standby performances, along with related objects, using a single query."""
+        timesheet = models.Timesheet.objects.get(user=self.user, year=2018, month=3)
+        factories.StandbyPerformanceFactory.create(timesheet=timesheet, date=datetime.date(2018, 3, 10),
+                                                   contract=factories.SupportContractFactory.create())
+        expected = list(models.Performance.objects.filter(timesheet__user=self.user).order_by('date', 'id'))
+
+        queryset = models.join_performance_children(models.Performance.objects
+                                                    .filter(timesheet__user=self.user)
+                                                    .select_related('contract', 'contract__customer')
+                                                    .order_by('date', 'id'))
+        with self.assertNumQueries(1):
+            performances = list(queryset)
+            labels = [str(x) for x in performances]
+            customers = [x.contract.customer.id for x in performances]
+
+        self.assertEqual([x.__class__ for x in performances], [x.__class__ for x in expected])
+        self.assertEqual(labels, [str(x) for x in expected])
+        self.assertEqual(customers, [x.contract.customer.id for x in expected])
@@ -1,4 +1,5 @@
 """Utils."""
+import bisect
 import copy
 import datetime
 import os
@@ -143,9 +144,74 @@ class IntelligentManyToManyWidget(ManyToManyWidget):
 
 
 class AvailabilityInfo(object):
+    __slots__ = ('day_tags', 'leave_dates')
+
     def __init__(self):
         self.day_tags = []
         self.leave_dates = []
 
     def add_tag(self, tag):
         self.day_tags.append(tag)
+
+
+class DateSegmentIndex(object):
+    """
+    Date segment index.
+
+    Splits items spanning a (possibly open-ended) date range into contiguous, non-overlapping date segments, each
+    holding the items covering it in their original order. Looking up the items covering a date takes O(log n), or
+    O(1) when walking forward through consecutive dates.
+    """
+
+    def __init__(self, items, start_attr='starts_at', end_attr='ends_at'):
+        items = list(items)
+        one_day = datetime.timedelta(days=1)
+
+        # Every start and every day after an end is a segment boundary
+        boundaries = set()
+        for item in items:
+            boundaries.add(getattr(item, start_attr))
+            if getattr(item, end_attr):
+                boundaries.add(getattr(item, end_attr) + one_day)
+
+        self.starts = sorted(boundaries)
+        self.segments = [tuple(x for x in items if (getattr(x, start_attr) <= start) and
+                               ((not getattr(x, end_attr)) or (getattr(x, end_attr) >= start)))
+                         for start in self.starts]
+        self.cursor = 0
+
+    def get(self, date):
+        """Get the items covering the given date."""
+        starts = self.starts
+        count = len(starts)
+        if not count or date < starts[0]:
+            return ()
+
+        # Try the current segment and the one after it first, so walking forward through days is O(1)
+        cursor = self.cursor
+        for i in (cursor, cursor + 1):
+            if (i < count) and (starts[i] <= date) and ((i + 1 == count) or (date < starts[i + 1])):
+                self.cursor = i
+                return self.segments[i]
+
+        self.cursor = bisect.bisect_right(starts, date) - 1
+        return self.segments[self.cursor]
+
+    def iter_segments(self, from_date, until_date):
+        """Iterate over the segments within the given date range, yielding (from, until, items) tuples."""
+        starts = self.starts
+        count = len(starts)
+        one_day = datetime.timedelta(days=1)
+
+        for i in range(max(0, bisect.bisect_right(starts, from_date) - 1), count):
+            segment_from = max(starts[i], from_date)
+            segment_until = min(starts[i + 1] - one_day, until_date) if (i + 1 < count) else until_date
+            if segment_from > until_date:
+                break
+            if segment_from <= segment_until:
+                yield segment_from, segment_until, self.segments[i]
+
+    def first(self, date):
+        """Get the first item covering the given date, if any."""
+        items = self.get(date)
+        return items[0] if items else None
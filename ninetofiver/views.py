@@ -27,7 +27,7 @@ from wkhtmltopdf.views import PDFTemplateView
 
 from ninetofiver import filters
 from ninetofiver import models
-from ninetofiver import tables, calculation, pagination
+from ninetofiver import tables, caching, calculation, ledger, pagination
 from ninetofiver import redmine
 from ninetofiver.models import ContractLog
 from ninetofiver.utils import month_date_range, dates_in_range, hours_to_days
@@ -310,12 +310,17 @@ def admin_report_timesheet_contract_overview_view(request):
 
     contracts = contracts.values_list('id', flat=True)
 
+    # Calculate range info for all timesheets at once
+    timesheet_date_ranges = {timesheet.id: timesheet.get_date_range() for timesheet in timesheets}
+    periods_range_info = calculation.get_range_info_for_periods(
+        [(timesheet.user, *timesheet_date_ranges[timesheet.id]) for timesheet in timesheets], summary=True)
+
     data = []
     for timesheet in timesheets:
-        date_range = timesheet.get_date_range()
-        range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
+        date_range = timesheet_date_ranges[timesheet.id]
+        range_info = periods_range_info[(timesheet.user.id, date_range[0], date_range[1])]
 
-        for contract_performance in range_info[timesheet.user.id]['summary']['performances']:
+        for contract_performance in range_info['summary']['performances']:
             if (not contracts) or (contract_performance['contract'].id in contracts):
                 data.append({
                     'contract': contract_performance['contract'],
@@ -361,11 +366,15 @@ def admin_report_timesheet_overview_view(request):
                                          user__employmentcontract__ended_at__gte=period_start,
                                          user__employmentcontract__started_at__lte=period_end))
 
+    # Sum ledger totals for all timesheets at once
+    timesheet_date_ranges = {timesheet.id: timesheet.get_date_range() for timesheet in timesheets}
+    periods_range_info = ledger.get_user_day_ledger_totals_for_periods(
+        [(timesheet.user, *timesheet_date_ranges[timesheet.id]) for timesheet in timesheets])
+
     data = []
     for timesheet in timesheets:
-        date_range = timesheet.get_date_range()
-        range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1])
-        range_info = range_info[timesheet.user.id]
+        date_range = timesheet_date_ranges[timesheet.id]
+        range_info = periods_range_info[(timesheet.user.id, date_range[0], date_range[1])]
 
         data.append({
             'timesheet': timesheet,
@@ -455,7 +464,7 @@ def admin_report_user_leave_overview_view(request):
             timesheet_data.setdefault(timesheet.year, {})[timesheet.month] = timesheet
 
         # Grab leave types, index them by ID
-        leave_types = models.LeaveType.objects.all()
+        leave_types = caching.get_reference_data().get_all(models.LeaveType)
 
         # Grab leave dates, index them by year, then month, then leave type ID
         leave_dates = fltr.qs.filter().select_related('leave', 'leave__leave_type')
@@ -519,21 +528,18 @@ def admin_report_user_work_ratio_by_user_view(request):
                                  pk=request.GET.get('user', None), is_active=True) if request.GET.get('user') else None
 
         timesheets = fltr.qs.select_related('user').order_by('year', 'month')
+        summaries = ledger.get_user_month_summaries([(x.user, x.year, x.month) for x in timesheets])
 
         for timesheet in timesheets:
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
+            summary = summaries[(timesheet.user.id, timesheet.year, timesheet.month)]
 
             data.append({
                 'year': timesheet.year,
                 'month': timesheet.month,
-                'work_hours': range_info['work_hours'],
-                'customer_hours': sum([x['duration'] for x in range_info['summary']['performances']
-                                 if x['contract'].customer != x['contract'].company]),
-                'internal_hours': sum([x['duration'] for x in range_info['summary']['performances']
-                                      if x['contract'].customer == x['contract'].company]),
-                'leaves': range_info['leave_hours'],
+                'work_hours': summary.work_hours,
+                'customer_hours': summary.customer_hours,
+                'internal_hours': summary.internal_hours,
+                'leaves': summary.leave_hours,
             })
 
     config = RequestConfig(request, paginate={'per_page': pagination.CustomizablePageNumberPagination.page_size})
@@ -563,17 +569,18 @@ def admin_report_user_work_ratio_by_month_view(request):
 
     if fltr.data.get('month', None) and fltr.data.get('year', None):
 
-        for timesheet in fltr.qs.select_related('user'):
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
+        timesheets = fltr.qs.select_related('user')
+        summaries = ledger.get_user_month_summaries([(x.user, x.year, x.month) for x in timesheets])
+
+        for timesheet in timesheets:
+            summary = summaries[(timesheet.user.id, timesheet.year, timesheet.month)]
 
             data.append({
                 'user':           timesheet.user,
-                'work_hours':     range_info['work_hours'],
-                'customer_hours': sum([x['duration'] for x in range_info['summary']['performances'] if x['contract'].customer != x['contract'].company]),
-                'internal_hours': sum([x['duration'] for x in range_info['summary']['performances'] if x['contract'].customer == x['contract'].company]),
-                'leaves':         range_info['leave_hours'],
+                'work_hours':     summary.work_hours,
+                'customer_hours': summary.customer_hours,
+                'internal_hours': summary.internal_hours,
+                'leaves':         summary.leave_hours,
                 })
 
     config = RequestConfig(request, paginate={'per_page': pagination.CustomizablePageNumberPagination.page_size})
@@ -605,20 +612,16 @@ def admin_report_user_work_ratio_overview_view(request):
                                  pk=request.GET.get('user', None), is_active=True) if request.GET.get('user') else None
 
         timesheets = fltr.qs.select_related('user').order_by('year', 'month')
+        summaries = ledger.get_user_month_summaries([(x.user, x.year, x.month) for x in timesheets])
 
         for timesheet in timesheets:
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
-
-            total_hours = range_info['performed_hours'] + range_info['leave_hours']
-            leave_hours = range_info['leave_hours']
-            consultancy_hours = sum([x['duration'] for x in range_info['summary']['performances']
-                                    if x['contract'].get_real_instance_class() == models.ConsultancyContract])
-            project_hours = sum([x['duration'] for x in range_info['summary']['performances']
-                                if x['contract'].get_real_instance_class() == models.ProjectContract])
-            support_hours = sum([x['duration'] for x in range_info['summary']['performances']
-                                if x['contract'].get_real_instance_class() == models.SupportContract])
+            summary = summaries[(timesheet.user.id, timesheet.year, timesheet.month)]
+
+            total_hours = summary.performed_hours + summary.leave_hours
+            leave_hours = summary.leave_hours
+            consultancy_hours = summary.consultancy_hours
+            project_hours = summary.project_hours
+            support_hours = summary.support_hours
 
             consultancy_pct = round((consultancy_hours / (total_hours if total_hours else 1.0)) * 100, 2)
             project_pct = round((project_hours / (total_hours if total_hours else 1.0)) * 100, 2)
@@ -666,42 +669,6 @@ class AvailabilityView(View):
     def get_active_users(self):
         return auth_models.User.objects.filter(is_active=True).distinct()
 
-    def fetch_contract_user_work_schedules(self, users, from_date, until_date):
-        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                .filter(contract_user__user__in=users)
-                .filter(Q(ends_at__isnull=True, starts_at__lte=until_date) |
-                        Q(ends_at__isnull=False, starts_at__lte=until_date,
-                          ends_at__gte=from_date))
-                .select_related('contract_user', 'contract_user__user',
-                                'contract_user__contract_role', 'contract_user__contract',
-                                'contract_user__contract__customer'))
-
-        # Index contract user work schedules by user
-        contract_user_work_schedule_data = {}
-        for contract_user_work_schedule in contract_user_work_schedules:
-            (contract_user_work_schedule_data
-             .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-             .append(contract_user_work_schedule))
-
-        return contract_user_work_schedule_data
-
-    def fetch_employment_contracts(self, from_date, until_date, users):
-
-        employment_contracts = (models.EmploymentContract.objects
-                                .filter(
-            (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-            (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-            user__in=users)
-                                .order_by('started_at')
-                                .select_related('user', 'company', 'work_schedule'))
-        # Index employment contracts by user ID
-        employment_contract_data = {}
-        for employment_contract in employment_contracts:
-            (employment_contract_data
-             .setdefault(employment_contract.user.id, [])
-             .append(employment_contract))
-        return employment_contract_data
-
 
 class ResourceAvailabilityOverviewView(AvailabilityView):
     """Resource availability overview report."""
@@ -732,14 +699,13 @@ class ResourceAvailabilityOverviewView(AvailabilityView):
         if users and from_date and until_date and (until_date >= from_date):
             dates = dates_in_range(from_date, until_date)
 
-            # Fetch contract user work schedules
-            contract_user_work_schedule_data = self.fetch_contract_user_work_schedules(users, from_date, until_date)
-
-            # Fetch employment contracts
-            employment_contract_data = self.fetch_employment_contracts(from_date, until_date, users)
+            # Fetch calendar data, shared between the availability calculation and this report
+            calendar_context = (calculation.CalendarContext(users, from_date, until_date)
+                                .load('employment_contract_index', 'contract_user_work_schedule_index'))
 
             # Fetch availability
-            availability = calculation.get_availability_info(users, from_date, until_date)
+            availability = calculation.calculate_sharded(calculation.get_availability_info, users, from_date,
+                                                         until_date, context=calendar_context)
 
             # Iterate over users, days to create daily user data
             for user in users:
@@ -760,28 +726,18 @@ class ResourceAvailabilityOverviewView(AvailabilityView):
 
                     # Get contract user work schedules for this day
                     # This allows us to determine the scheduled hours for this user
-                    for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                        if (contract_user_work_schedule.starts_at <= current_date) and \
-                                ((not contract_user_work_schedule.ends_at) or
-                                 (contract_user_work_schedule.ends_at >= current_date)):
-                            day_contract_user_work_schedules.append(contract_user_work_schedule)
-                            day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                           current_date.strftime('%A').lower(), Decimal('0.00'))
+                    for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(user.id,
+                                                                                                         current_date):
+                        day_contract_user_work_schedules.append(contract_user_work_schedule)
+                        day_scheduled_hours += contract_user_work_schedule.get_hours_for_date(current_date)
 
                     # Get employment contract for this day
                     # This allows us to determine the required hours for this user
-                    employment_contract = None
-                    try:
-                        for ec in employment_contract_data[user.id]:
-                            if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                                employment_contract = ec
-                                break
-                    except KeyError:
-                        pass
+                    employment_contract = calendar_context.get_employment_contract(user.id, current_date)
 
                     work_schedule = employment_contract.work_schedule if employment_contract else None
                     if work_schedule:
-                        day_work_hours = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
+                        day_work_hours = work_schedule.get_hours_for_date(current_date)
 
                     user_day_data['availability'] = day_availability
                     user_day_data['contract_user_work_schedules'] = day_contract_user_work_schedules
@@ -845,14 +801,13 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
         if users and from_date and until_date and (until_date >= from_date):
             dates = dates_in_range(from_date, until_date)
 
-            # Fetch availability
-            availability = calculation.get_availability_info(users, from_date, until_date)
-
-            # Fetch contract user work schedules
-            contract_user_work_schedule_data = self.fetch_contract_user_work_schedules(users, from_date, until_date)
+            # Fetch calendar data, shared between the availability calculation and this report
+            calendar_context = (calculation.CalendarContext(users, from_date, until_date)
+                                .load('employment_contract_index', 'contract_user_work_schedule_index'))
 
-            # Fetch employment contracts
-            employment_contract_data = self.fetch_employment_contracts(from_date, until_date, users)
+            # Fetch availability
+            availability = calculation.calculate_sharded(calculation.get_availability_info, users, from_date,
+                                                         until_date, context=calendar_context)
 
             # Iterate over users, days to create daily user data
             for user in users:
@@ -867,13 +822,10 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
 
                     # Get contract user work schedules for this day
                     # This allows us to determine the scheduled hours for this user
-                    for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                        if (contract_user_work_schedule.starts_at <= current_date) and \
-                                ((not contract_user_work_schedule.ends_at) or
-                                 (contract_user_work_schedule.ends_at >= current_date)):
-                            day_contract_user_work_schedules.append(contract_user_work_schedule)
-                            day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                           current_date.strftime('%A').lower(), Decimal('0.00'))
+                    for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(user.id,
+                                                                                                         current_date):
+                        day_contract_user_work_schedules.append(contract_user_work_schedule)
+                        day_scheduled_hours += contract_user_work_schedule.get_hours_for_date(current_date)
 
                     user_day_data = {}
 
@@ -888,19 +840,12 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
 
                     # Get employment contract for this day
                     # This allows us to determine the required hours for this user
-                    employment_contract = None
-                    try:
-                        for ec in employment_contract_data[user.id]:
-                            if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                                employment_contract = ec
-                                break
-                    except KeyError:
-                        pass
+                    employment_contract = calendar_context.get_employment_contract(user.id, current_date)
 
                     work_schedule = employment_contract.work_schedule if employment_contract else None
                     day_work_hours = Decimal('0.00')
                     if work_schedule:
-                        day_work_hours = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
+                        day_work_hours = work_schedule.get_hours_for_date(current_date)
                     user_day_data['work_hours'] = day_work_hours
                     user_day_data['enough_hours'] = day_scheduled_hours >= day_work_hours
 
@@ -1293,7 +1238,7 @@ def admin_report_user_overtime_overview_view(request):
     until_date = parser.parse(request.GET.get('until_date', None)).date() if request.GET.get('until_date') else None
     data = []
 
-    overtime_leave_type_ids = list(models.LeaveType.objects.filter(overtime=True).values_list('id', flat=True))
+    overtime_leave_type_ids = list(caching.get_reference_data().overtime_leave_type_ids)
 
     if user and from_date and until_date and (until_date >= from_date) and overtime_leave_type_ids:
         # Grab leave dates, index them by year, then month, then leave type ID
@@ -1305,28 +1250,33 @@ def admin_report_user_overtime_overview_view(request):
                 .setdefault(leave_date.starts_at.month, [])
                 .append(leave_date))
 
-        # Iterate over years, months to create monthly data
+        # Determine months, and fetch their summaries
+        months = []
         current_date = copy.deepcopy(from_date)
+        while current_date.strftime('%Y%m') <= until_date.strftime('%Y%m'):
+            months.append((current_date.year, current_date.month))
+            current_date += relativedelta(months=1)
+        summaries = ledger.get_user_month_summaries([(user, year, month) for year, month in months])
+
+        # Iterate over years, months to create monthly data
         remaining_overtime_hours = Decimal('0.00')
 
-        while current_date.strftime('%Y%m') <= until_date.strftime('%Y%m'):
-            current_date_range = month_date_range(current_date.year, current_date.month)
-            month_range_info = calculation.get_range_info([user], from_date=current_date_range[0],
-                                                          until_date=current_date_range[1])
+        for year, month in months:
+            summary = summaries[(user.id, year, month)]
 
-            overtime_hours = month_range_info[user.id]['overtime_hours']
+            overtime_hours = summary.overtime_hours
             remaining_overtime_hours += overtime_hours
 
-            remaining_hours = month_range_info[user.id]['remaining_hours']
+            remaining_hours = summary.remaining_hours
             remaining_overtime_hours -= remaining_hours
 
             used_overtime_hours = sum([Decimal(str(round((x.ends_at - x.starts_at).total_seconds() / 3600, 2)))
-                                      for x in leave_date_data.get(current_date.year, {}).get(current_date.month, {})])
+                                      for x in leave_date_data.get(year, {}).get(month, {})])
             remaining_overtime_hours -= used_overtime_hours
 
             data.append({
-                'year': current_date.year,
-                'month': current_date.month,
+                'year': year,
+                'month': month,
                 'user': user,
                 'overtime_hours': overtime_hours,
                 'remaining_hours': remaining_hours,
@@ -1334,8 +1284,6 @@ def admin_report_user_overtime_overview_view(request):
                 'remaining_overtime_hours': remaining_overtime_hours,
             })
 
-            current_date += relativedelta(months=1)
-
     config = RequestConfig(request, paginate={'per_page': pagination.CustomizablePageNumberPagination.page_size})
     table = tables.UserOvertimeOverviewTable(data)
     config.configure(table)
@@ -1622,39 +1570,13 @@ def admin_report_internal_availability_overview_view(request):
         pass
 
     if users and date:
+        # Fetch calendar data, shared between the availability calculation and this report
+        calendar_context = (calculation.CalendarContext(users, date, date)
+                            .load('employment_contract_index', 'contract_user_work_schedule_index'))
+
         # Fetch availability
-        availability = calculation.get_internal_availability_info(users, date, date)
-
-        # # Fetch contract user work schedules
-        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                                        .filter(contract_user__user__in=users)
-                                        .filter(Q(ends_at__isnull=True, starts_at__lte=date) |
-                                                Q(ends_at__isnull=False, starts_at__lte=date,
-                                                  ends_at__gte=date))
-                                        .select_related('contract_user', 'contract_user__user',
-                                                        'contract_user__contract_role', 'contract_user__contract',
-                                                        'contract_user__contract__customer'))
-        # Index contract user work schedules by user
-        contract_user_work_schedule_data = {}
-        for contract_user_work_schedule in contract_user_work_schedules:
-            (contract_user_work_schedule_data
-                .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-                .append(contract_user_work_schedule))
-
-        # Fetch employment contracts
-        employment_contracts = (models.EmploymentContract.objects
-                                .filter(
-                                    (Q(ended_at__isnull=True) & Q(started_at__lte=date)) |
-                                    (Q(started_at__lte=date) & Q(ended_at__gte=date)),
-                                    user__in=users)
-                                .order_by('started_at')
-                                .select_related('user', 'company', 'work_schedule'))
-        # Index employment contracts by user ID
-        employment_contract_data = {}
-        for employment_contract in employment_contracts:
-            (employment_contract_data
-                .setdefault(employment_contract.user.id, [])
-                .append(employment_contract))
+        availability = calculation.calculate_sharded(calculation.get_internal_availability_info, users, date, date,
+                                                     context=calendar_context)
 
         # Iterate over users, days to create daily user data
         for user in users:
@@ -1681,28 +1603,17 @@ def admin_report_internal_availability_overview_view(request):
 
             # Get contract user work schedules for this day
             # This allows us to determine the scheduled hours for this user
-            for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                if (contract_user_work_schedule.starts_at <= date) and \
-                        ((not contract_user_work_schedule.ends_at) or
-                            (contract_user_work_schedule.ends_at >= date)):
-                    day_contract_user_work_schedules.append(contract_user_work_schedule)
-                    day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                   date.strftime('%A').lower(), Decimal('0.00'))
+            for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(user.id, date):
+                day_contract_user_work_schedules.append(contract_user_work_schedule)
+                day_scheduled_hours += contract_user_work_schedule.get_hours_for_date(date)
 
             # Get employment contract for this day
             # This allows us to determine the required hours for this user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= date) and ((not ec.ended_at) or (ec.ended_at >= date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = calendar_context.get_employment_contract(user.id, date)
 
             work_schedule = employment_contract.work_schedule if employment_contract else None
             if work_schedule:
-                day_work_hours = getattr(work_schedule, date.strftime('%A').lower(), Decimal('0.00'))
+                day_work_hours = work_schedule.get_hours_for_date(date)
 
             user_day_data['availability'] = day_availability
             user_day_data['contract_user_work_schedules'] = day_contract_user_work_schedules